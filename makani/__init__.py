@@ -15,5 +15,16 @@
 
 __version__ = "0.2.0"
 
-from .utils.training import Trainer, AutoencoderTrainer, EnsembleTrainer, StochasticTrainer
-from .utils.inference import Inferencer
+from makani.utils.lazy_imports import lazy_attributes
+
+# trainers and inferencer pull in heavy dependencies such as wandb, numba and torch-harmonics, so they are imported on first access
+_LAZY_ATTRIBUTES = {
+    "Trainer": (".utils.training", "Trainer"),
+    "AutoencoderTrainer": (".utils.training", "AutoencoderTrainer"),
+    "EnsembleTrainer": (".utils.training", "EnsembleTrainer"),
+    "StochasticTrainer": (".utils.training", "StochasticTrainer"),
+    "Inferencer": (".utils.inference", "Inferencer"),
+}
+
+
+__getattr__, __dir__ = lazy_attributes(__name__, globals(), _LAZY_ATTRIBUTES)
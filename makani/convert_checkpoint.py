@@ -70,9 +70,9 @@ def get_params(path):
     return ParamsBase.from_json(config)
 
 
-def consolidate_checkpoints(input_path, output_path, checkpoint_version=0):
+def consolidate_checkpoints(input_path, output_path, checkpoint_version=0, checkpoint_format="flexible"):
     """
-    Conversion routine for loading the model and saving it using the flexible format
+    Conversion routine for loading the model and saving it using the flexible or indexed format
 
     Parameters
     ============
@@ -80,6 +80,8 @@ def consolidate_checkpoints(input_path, output_path, checkpoint_version=0):
         Path from which to load the checkpoint
     output_path: str
         Output path to store the checkpoint
+    checkpoint_format: str
+        Format of the consolidated checkpoint, either flexible or indexed
     """
 
     # get the params datastructure
@@ -168,9 +170,9 @@ def consolidate_checkpoints(input_path, output_path, checkpoint_version=0):
     model.load_state_dict(gathered_state_dict, strict=True)
 
     # save the model
-    print(f"Saving checkpoint in flexible format to {output_path}")
+    print(f"Saving checkpoint in {checkpoint_format} format to {output_path}")
     os.makedirs(output_path, exist_ok=True)
-    Driver.save_checkpoint(os.path.join(output_path, checkpoint_template).format(mp_rank=0, checkpoint_version=checkpoint_version), model=model, checkpoint_mode="flexible")
+    Driver.save_checkpoint(os.path.join(output_path, checkpoint_template).format(mp_rank=0, checkpoint_version=checkpoint_version), model=model, checkpoint_mode=checkpoint_format)
 
 
 def average_checkpoints(input_path, output_path):
@@ -258,6 +260,7 @@ if __name__ == "__main__":
     parser.add_argument("--output", help="Target location to save the collected checkpoint.", required=False)
     parser.add_argument("--mode", default="consolidate", type=str, choices=["consolidate", "strip_module", "average"], help="Specify how the checkpoints should be modified.")
     parser.add_argument("--checkpoint_version", default="0", type=str, help="Select checkpoint version. Only relevant for conversion")
+    parser.add_argument("--output_format", default="flexible", type=str, choices=["flexible", "indexed"], help="Format of the consolidated checkpoint. Only relevant for conversion")
     args = parser.parse_args()
 
     print(f"Running convert_checkpoint in {args.mode} mode")
@@ -269,7 +272,7 @@ if __name__ == "__main__":
 
     if args.mode == "consolidate":
         print(f"Launching converions in consolidate mode on {args.input}")
-        consolidate_checkpoints(args.input[0], args.output, checkpoint_version=checkpoint_version)
+        consolidate_checkpoints(args.input[0], args.output, checkpoint_version=checkpoint_version, checkpoint_format=args.output_format)
     elif args.mode == "average":
         print(f"Launching averaging of checkpoints found in {args.input}")
         average_checkpoints(args.input, args.output)
@@ -49,6 +49,7 @@ if __name__ == "__main__":
     parser.add_argument("--bias_file", default=None, type=str, help="If specified, bias will be computed and saved to this file.")
     parser.add_argument("--spectrum_file", default=None, type=str, help="If specified, spectrum will be computed and saved to this file.")
     parser.add_argument("--zonal_spectrum_file", default=None, type=str, help="If specified, zonal spectrum will be computed and saved to this file.")
+    parser.add_argument("--spectrum_lead_time_stride", default=1, type=int, help="Compute spectra and zonal spectra only every n-th rollout step.")
     parser.add_argument(
         "--start_date",
         type=str,
@@ -68,6 +69,12 @@ if __name__ == "__main__":
         help="At what interval to sample initial conditions. Needs to be an integer number specifying the step in terms of dhours.",
     )
     parser.add_argument("--wb2_compatible", action="store_true", help="Makes metrics and quadratures compatible with weatherbench2.")
+    parser.add_argument("--weight_quantization", default="none", type=str, choices=["none", "int8", "fp8"], help="Weight-only quantization of the spectral and MLP weights.")
+    parser.add_argument(
+        "--calibrate_quantization",
+        action="store_true",
+        help="Scores the model before and after weight quantization and reports the change of the forecast skill instead of writing outputs.",
+    )
 
     # parse
     args = parser.parse_args()
@@ -90,6 +97,9 @@ if __name__ == "__main__":
     # checkpoint format
     params["load_checkpoint"] = args.load_checkpoint
 
+    # spectral diagnostics
+    params["spectrum_lead_time_stride"] = args.spectrum_lead_time_stride
+
     # make sure to reconfigure logger after the pytorch distributed init
     comm.init(
         model_parallel_sizes=params["model_parallel_sizes"],
@@ -172,6 +182,10 @@ if __name__ == "__main__":
     params["mask_file"] = args.mask_file
     params["climatology_file"] = args.climatology_file
 
+    # weight quantization is applied after restoring the model, unless the quantization is calibrated
+    if (args.weight_quantization != "none") and not args.calibrate_quantization:
+        params["inference_weight_quantization"] = args.weight_quantization
+
     # by default we use only the multifiles dataloader for inference
     params["dataset_file_suffix"] = args.dataset_file_suffix
     params["multifiles"] = True
@@ -202,8 +216,16 @@ if __name__ == "__main__":
     # instantiate trainer / inference / ensemble object
     inferencer = Inferencer(params, world_rank)
 
-    # run with profiling
-    if world_rank in args.capture_ranks:
+    # calibrate the weight quantization or run with profiling
+    if args.calibrate_quantization:
+        inferencer.calibrate_weight_quantization(
+            weight_quantization=args.weight_quantization if args.weight_quantization != "none" else "int8",
+            start_date=args.start_date,
+            end_date=args.end_date,
+            date_step=args.date_step,
+            wb2_compatible=args.wb2_compatible,
+        )
+    elif world_rank in args.capture_ranks:
         if args.capture_type == "torch":
             capture_prefix = f"{args.capture_prefix}_rank{world_rank}" if args.capture_prefix is not None else None
             trace_handler = partial(profiling.trace_handler, print_stats=True, export_trace_prefix=capture_prefix)
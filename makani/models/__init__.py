@@ -13,8 +13,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .preprocessor import Preprocessor2D
-from .stepper import SingleStepWrapper, MultiStepWrapper
-from .stochastic_interpolant import StochasticInterpolantWrapper
+from makani.utils.lazy_imports import lazy_attributes
 
-import makani.models.model_registry
+# the wrappers and the registry are imported on first access, which keeps importing a single model cheap
+_LAZY_ATTRIBUTES = {
+    "Preprocessor2D": (".preprocessor", "Preprocessor2D"),
+    "SingleStepWrapper": (".stepper", "SingleStepWrapper"),
+    "MultiStepWrapper": (".stepper", "MultiStepWrapper"),
+    "StochasticInterpolantWrapper": (".stochastic_interpolant", "StochasticInterpolantWrapper"),
+    "model_registry": (".model_registry", None),
+}
+
+
+__getattr__, __dir__ = lazy_attributes(__name__, globals(), _LAZY_ATTRIBUTES)
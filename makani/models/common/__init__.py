@@ -14,7 +14,8 @@
 # limitations under the License.
 
 from .activations import ComplexReLU, ComplexActivation
-from .layers import DropPath, LayerScale, PatchEmbed2D, PatchEmbed3D, PatchRecovery2D, PatchRecovery3D, EncoderDecoder, MLP, UpSample3D, DownSample3D, UpSample2D, DownSample2D
+from .layers import DropPath, LayerScale, PatchEmbed2D, PatchEmbed3D, PatchRecovery2D, PatchRecovery3D, EncoderDecoder, MLP, QuantizedPointwise, UpSample3D, DownSample3D, UpSample2D, DownSample2D
 from .fft import RealFFT1, InverseRealFFT1, RealFFT2, InverseRealFFT2, RealFFT3, InverseRealFFT3
 from .layer_norm import GeometricInstanceNormS2
 from .spectral_convolution import SpectralConv, SpectralAttention
+from .spectral_transforms import get_spectral_transform, clear_spectral_transform_registry
@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import torch
+import torch.nn as nn
 
 from functools import partial
 
@@ -105,6 +106,58 @@ def _contract_dense_reconstruct(x, weight, separable=False, operator_type="diago
     return _contract_dense_pytorch(x, weight, separable=separable, operator_type=operator_type, complex=complex)
 
 
+# largest representable values of the quantized formats
+_QUANTIZATION_RANGES = {"int8": 127.0, "fp8": 448.0}
+
+
+class QuantizedWeight(nn.Module):
+    """
+    Symmetric weight-only quantization to int8 or float8_e4m3fn with one scale per slice, where the scales are computed over
+    the dimensions reduce_dims, typically the input channels which are contracted. Complex weights are quantized as pairs of
+    real numbers which share the scale. Like factorized tensors, the weight is dequantized on the fly by to_tensor, so that it
+    can be used with the reconstructed contractions.
+    """
+
+    def __init__(self, weight: torch.Tensor, reduce_dims=(1,), dtype="int8"):
+        super().__init__()
+
+        if dtype not in _QUANTIZATION_RANGES:
+            raise NotImplementedError(f"Error, weight quantization {dtype} not supported.")
+
+        self.quantization = dtype
+        self.is_complex = weight.is_complex()
+
+        reduce_dims = tuple(d % weight.dim() for d in reduce_dims)
+        if self.is_complex:
+            weight = torch.view_as_real(weight)
+            reduce_dims = reduce_dims + (weight.dim() - 1,)
+        weight = weight.to(torch.float32)
+
+        qmax = _QUANTIZATION_RANGES[dtype]
+        scale = torch.clamp(weight.abs().amax(dim=reduce_dims, keepdim=True) / qmax, min=torch.finfo(torch.float32).tiny)
+
+        if dtype == "int8":
+            qweight = torch.clamp(torch.round(weight / scale), min=-qmax, max=qmax).to(torch.int8)
+        else:
+            qweight = (weight / scale).to(torch.float8_e4m3fn)
+
+        self.register_buffer("qweight", qweight, persistent=True)
+        self.register_buffer("scale", scale, persistent=True)
+
+    @property
+    def shape(self):
+        return self.qweight.shape[:-1] if self.is_complex else self.qweight.shape
+
+    def to_tensor(self, dtype=torch.float32):
+        weight = self.qweight.to(torch.float32) * self.scale
+        if self.is_complex:
+            return torch.view_as_complex(weight)
+        return weight.to(dtype)
+
+    def extra_repr(self):
+        return f"shape={list(self.shape)}, quantization={self.quantization}, complex={self.is_complex}"
+
+
 def get_contract_fun(weight, implementation="reconstructed", separable=False, operator_type="diagonal", complex=True):
     """Generic ND implementation of Fourier Spectral Conv contraction
 
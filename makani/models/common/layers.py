@@ -20,6 +20,7 @@ from torch.utils.checkpoint import checkpoint, checkpoint_sequential
 import math
 
 from makani.utils.context import rng_context
+from makani.models.common.factorizations import QuantizedWeight
 
 
 @torch.compile(fullgraph=False)
@@ -413,6 +414,35 @@ class MLP(nn.Module):
         else:
             return self.fwd(x)
 
+
+class QuantizedPointwise(nn.Module):
+    """
+    Weight-only quantized replacement for pointwise convolutions and linear layers. The weight is quantized per output channel
+    and dequantized on the fly, the bias is kept in full precision.
+    """
+
+    def __init__(self, layer, dtype="int8"):
+        super().__init__()
+
+        if not isinstance(layer, (nn.Conv2d, nn.Linear)):
+            raise NotImplementedError(f"Error, cannot quantize layer of type {type(layer).__name__}.")
+
+        self.is_conv = isinstance(layer, nn.Conv2d)
+        self.weight = QuantizedWeight(layer.weight.detach(), reduce_dims=tuple(range(1, layer.weight.dim())), dtype=dtype)
+        if layer.bias is not None:
+            self.bias = nn.Parameter(layer.bias.detach().clone(), requires_grad=False)
+        else:
+            self.bias = None
+
+    def forward(self, x):
+        weight = self.weight.to_tensor(dtype=x.dtype)
+        bias = self.bias.to(dtype=x.dtype) if self.bias is not None else None
+        if self.is_conv:
+            return nn.functional.conv2d(x, weight, bias)
+        else:
+            return nn.functional.linear(x, weight, bias)
+
+
 class UpSample2D(nn.Module):
     """
     Revise from WeatherLearn https://github.com/lizhuoq/WeatherLearn
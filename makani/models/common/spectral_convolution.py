@@ -25,7 +25,7 @@ from torch import amp
 from makani.utils import comm
 from makani.models.common import ComplexReLU
 from makani.models.common.contractions import _contract_rank
-from makani.models.common.factorizations import get_contract_fun
+from makani.models.common.factorizations import get_contract_fun, QuantizedWeight
 
 import torch_harmonics as th
 import torch_harmonics.distributed as thd
@@ -114,6 +114,15 @@ class SpectralConv(nn.Module):
             self.bias.is_shared_mp = ["model"]
             self.bias.sharded_dims_mp = [None, None, None, None]
 
+    def quantize_weight(self, dtype="int8"):
+        """
+        replaces the weight by a copy which is quantized per output channel and mode and dequantized on the fly during the contraction
+        """
+        weight = QuantizedWeight(self.weight.detach(), reduce_dims=(1,), dtype=dtype)
+        del self.weight
+        self.weight = weight
+        self._contract = get_contract_fun(self.weight, implementation="reconstructed", separable=self.separable, complex=True, operator_type=self.operator_type)
+
     def forward(self, x):
         dtype = x.dtype
         residual = x
@@ -0,0 +1,78 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import weakref
+from typing import Optional
+
+import torch
+import torch.nn as nn
+
+import torch_harmonics.distributed as thd
+
+# global registry of spectral transforms. Values are held weakly, so that transforms are released once no module uses them anymore
+_transform_registry = weakref.WeakValueDictionary()
+
+
+def _distributed_layout(handle):
+    """
+    helper routine which returns the layout of the polar and azimuth groups for distributed transforms
+    """
+    if getattr(handle, "__module__", "").startswith("torch_harmonics.distributed") and thd.is_initialized():
+        return (thd.polar_group_size(), thd.polar_group_rank(), thd.azimuth_group_size(), thd.azimuth_group_rank())
+    return None
+
+
+def _resolve_modes(nlat: int, nlon: int, lmax: Optional[int], mmax: Optional[int], grid: str):
+    """
+    helper routine which resolves the number of modes to the values torch-harmonics uses if they are not specified
+    """
+    if lmax is None:
+        lmax = nlat - 1 if grid == "lobatto" else nlat
+    if mmax is None:
+        mmax = nlon // 2 + 1
+    return lmax, mmax
+
+
+def get_spectral_transform(handle, nlat: int, nlon: int, lmax: Optional[int] = None, mmax: Optional[int] = None, grid: Optional[str] = "equiangular", dtype: Optional[torch.dtype] = None, **kwargs) -> nn.Module:
+    r"""
+    Returns a spectral transform such as th.RealSHT or thd.DistributedInverseRealSHT from the global registry and creates it if
+    it does not exist yet. Transforms are keyed by type, grid dimensions, number of modes, grid type, dtype and the distributed
+    layout, so that all modules which require an identical transform share the same instance and hence the precomputed Legendre
+    weights. The weights are non-persistent buffers and therefore do not appear in checkpoints.
+
+    Since the instance is shared, it must not be modified in place by its users. Moving a model to a device also moves the shared
+    transforms, which is why all models in a process are expected to reside on the same device.
+    """
+    # transforms requested without dtype use the default dtype, so that they share the instance with explicit requests
+    if dtype is None:
+        dtype = torch.get_default_dtype()
+
+    # the key is built from the effective number of modes, so that requests with and without explicit modes share the instance
+    lmax, mmax = _resolve_modes(nlat, nlon, lmax, mmax, grid)
+    key = (handle, nlat, nlon, lmax, mmax, grid, dtype, tuple(sorted(kwargs.items())), _distributed_layout(handle))
+
+    transform = _transform_registry.get(key, None)
+    if transform is None:
+        transform = handle(nlat, nlon, lmax=lmax, mmax=mmax, grid=grid, **kwargs)
+        transform = transform.to(dtype=dtype)
+        _transform_registry[key] = transform
+
+    return transform
+
+
+def clear_spectral_transform_registry():
+    """drop all registered transforms. Modules which already hold a transform keep it"""
+    _transform_registry.clear()
+    return
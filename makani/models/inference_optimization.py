@@ -0,0 +1,284 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from typing import Optional
+
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from makani.utils import comm
+from makani.models.common.layers import DropPath, SeededDropout2d, LayerScale, MLP, EncoderDecoder, QuantizedPointwise
+from makani.models.common.spectral_convolution import SpectralConv
+
+# modules which are no-ops in evaluation mode
+_NOOP_MODULES = (nn.Identity, nn.Dropout, nn.Dropout1d, nn.Dropout2d, nn.Dropout3d, nn.AlphaDropout, DropPath, SeededDropout2d)
+
+_DTYPES = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+class _AutocastWrapper(nn.Module):
+    """runs the wrapped network in autocast, so that it can be used with reduced precision weights"""
+
+    def __init__(self, model, dtype):
+        super().__init__()
+        self.model = model
+        self.dtype = dtype
+
+    def forward(self, *args, **kwargs):
+        device_type = args[0].device.type if (len(args) > 0) and isinstance(args[0], torch.Tensor) else "cuda"
+        with torch.autocast(device_type=device_type, dtype=self.dtype):
+            out = self.model(*args, **kwargs)
+
+        return out.to(torch.float32)
+
+
+def _is_pointwise_conv(module):
+    return (
+        isinstance(module, nn.Conv2d)
+        and (module.kernel_size == (1, 1))
+        and (module.groups == 1)
+        and (module.stride == (1, 1))
+        and (module.dilation == (1, 1))
+        and (module.padding == (0, 0))
+    )
+
+
+def _last_pointwise_layer(module):
+    """returns the pointwise output layer of an MLP or EncoderDecoder, provided that it is the last operation"""
+    if isinstance(module, (MLP, EncoderDecoder)):
+        layers = [m for m in module.fwd if not isinstance(m, _NOOP_MODULES)]
+        if (len(layers) > 0) and _is_pointwise_conv(layers[-1]):
+            return layers[-1]
+    return None
+
+
+def _add_to_bias(conv, bias):
+    if conv.bias is None:
+        conv.bias = nn.Parameter(bias.to(dtype=conv.weight.dtype, device=conv.weight.device))
+    else:
+        conv.bias.add_(bias.to(dtype=conv.bias.dtype))
+
+
+def strip_noop_modules(model: nn.Module) -> int:
+    """
+    replaces dropout and stochastic depth modules by identities, removes identities from sequential containers and disables
+    activation checkpointing. Keys of the remaining modules are preserved. Returns the number of removed modules.
+    """
+    count = 0
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, _NOOP_MODULES) and not isinstance(child, nn.Identity):
+                setattr(module, name, nn.Identity())
+                count += 1
+
+        if isinstance(module, nn.Sequential):
+            for name, child in list(module._modules.items()):
+                if isinstance(child, nn.Identity):
+                    del module._modules[name]
+
+        # checkpointing only adds overhead during inference
+        if hasattr(module, "checkpointing") and isinstance(module.checkpointing, bool):
+            module.checkpointing = False
+        if hasattr(module, "checkpointing_level") and isinstance(module.checkpointing_level, int):
+            module.checkpointing_level = 0
+
+    return count
+
+
+def fold_layer_scale(model: nn.Module) -> int:
+    """
+    folds LayerScale modules into the output layer of a preceding MLP, which is the case in the processor blocks of FCN3
+    and SNO with skip connections. Returns the number of folded modules.
+    """
+    count = 0
+    for module in list(model.modules()):
+        layer_scale = getattr(module, "layer_scale", None)
+        if not isinstance(layer_scale, LayerScale):
+            continue
+
+        # the block only applies the layer scale to the update of the skip connection
+        if not hasattr(module, "skip"):
+            continue
+
+        # the layer scale has to directly follow the MLP
+        if not isinstance(getattr(module, "drop_path", None), nn.Identity):
+            continue
+        fc = _last_pointwise_layer(getattr(module, "mlp", None))
+        if (fc is None) or (fc.out_channels != layer_scale.num_chans):
+            continue
+
+        scale = layer_scale.weight.reshape(-1)
+        fc.weight.mul_(scale.reshape(-1, 1, 1, 1).to(dtype=fc.weight.dtype))
+        if fc.bias is not None:
+            fc.bias.mul_(scale.to(dtype=fc.bias.dtype))
+
+        module.layer_scale = nn.Identity()
+        count += 1
+
+    return count
+
+
+def fuse_norms(model: nn.Module) -> int:
+    """
+    fuses batch norms into directly preceding convolutions within sequential containers. Other norms are data-dependent
+    and cannot be folded. Returns the number of fused norms.
+    """
+    count = 0
+    for module in list(model.modules()):
+        if not isinstance(module, nn.Sequential):
+            continue
+
+        names = list(module._modules.keys())
+        for prev_name, name in zip(names[:-1], names[1:]):
+            conv, norm = module._modules.get(prev_name, None), module._modules.get(name, None)
+            if isinstance(conv, nn.Conv2d) and isinstance(norm, nn.BatchNorm2d) and norm.track_running_stats:
+                module._modules[prev_name] = fuse_conv_bn_eval(conv, norm)
+                del module._modules[name]
+                count += 1
+
+    return count
+
+
+def fold_bias_correction(network: nn.Module, preprocessor: nn.Module) -> bool:
+    """
+    folds the constant bias correction of the preprocessor into the bias of the output layer of the network. This is only
+    possible if the correction is constant in space and if the output layer is the last operation of the network up to
+    additive skip connections, as is the case in SFNO. Returns True if the correction was folded.
+    """
+    from makani.models.networks.sfnonet import SphericalFourierNeuralOperatorNet
+
+    bias_correction = getattr(preprocessor, "bias_correction", None)
+    if bias_correction is None:
+        return False
+
+    if not isinstance(network, SphericalFourierNeuralOperatorNet) or (comm.get_size("matmul") > 1):
+        return False
+
+    bias = bias_correction[..., :1, :1]
+    if (bias_correction.shape[0] != 1) or not torch.equal(bias_correction, bias.expand_as(bias_correction)):
+        logging.info("Bias correction varies in space and cannot be folded into the output layer.")
+        return False
+
+    fc = _last_pointwise_layer(network.decoder)
+    if (fc is None) or (fc.out_channels != bias_correction.shape[1]):
+        return False
+
+    _add_to_bias(fc, -bias.reshape(-1))
+    del preprocessor.bias_correction
+
+    return True
+
+
+def quantize_weights(model: nn.Module, dtype: str = "int8") -> int:
+    """
+    weight-only quantization of the spectral convolutions and of the pointwise layers in MLPs and encoders/decoders. Weights
+    are stored as int8 or fp8 with one scale per output channel and dequantized on the fly. Returns the number of quantized layers.
+    """
+    count = 0
+    for module in list(model.modules()):
+        if isinstance(module, SpectralConv) and isinstance(module.weight, torch.Tensor):
+            module.quantize_weight(dtype=dtype)
+            count += 1
+        elif isinstance(module, (MLP, EncoderDecoder)):
+            for name, layer in list(module.fwd._modules.items()):
+                if _is_pointwise_conv(layer) or isinstance(layer, nn.Linear):
+                    module.fwd._modules[name] = QuantizedPointwise(layer, dtype=dtype)
+                    count += 1
+
+    return count
+
+
+def _get_stepper(model: nn.Module) -> Optional[nn.Module]:
+    """returns the stepper, which holds both the preprocessor and the network, of a stepper or a model package wrapper"""
+    if hasattr(model, "preprocessor") and hasattr(model, "model"):
+        return model
+    if hasattr(model, "model") and hasattr(model.model, "preprocessor"):
+        return model.model
+    return None
+
+
+@torch.no_grad()
+def optimize_for_inference(
+    model: nn.Module,
+    strip_noops: bool = True,
+    fold_scales: bool = True,
+    fold_bias: bool = True,
+    fuse_norm_layers: bool = True,
+    channels_last: bool = False,
+    weight_dtype: Optional[str] = None,
+    weight_quantization: Optional[str] = None,
+) -> nn.Module:
+    r"""
+    Transforms a model with restored weights for inference. The model is modified in place, set to evaluation mode and returned.
+    Accepts single or multistep wrappers as returned by model_registry.get_model, model package wrappers or bare networks.
+
+    The following transformations are applied:
+        - dropout and stochastic depth modules are removed and activation checkpointing is disabled
+        - LayerScale modules are folded into the output layer of the preceding MLP
+        - batch norms are fused into preceding convolutions
+        - constant bias corrections of the preprocessor are folded into the output layer of the network
+        - optionally, the weights are converted to channels-last layout and/or reduced precision, in which case the network
+          is run in autocast
+        - optionally, the spectral and pointwise weights are quantized to int8 or fp8, see quantize_weights
+
+    Normalization of the history is computed from each input and hence cannot be folded. The transformed model is meant for
+    inference only and is not compatible with the training checkpoints anymore.
+    """
+    model.eval()
+
+    stepper = _get_stepper(model)
+    network = stepper.model if stepper is not None else model
+
+    if strip_noops:
+        num_stripped = strip_noop_modules(network)
+        logging.info(f"Stripped {num_stripped} no-op modules.")
+
+    if fold_scales:
+        num_folded = fold_layer_scale(network)
+        logging.info(f"Folded {num_folded} layer scales.")
+
+    if fuse_norm_layers:
+        num_fused = fuse_norms(network)
+        logging.info(f"Fused {num_fused} norms.")
+
+    if fold_bias and (stepper is not None):
+        if fold_bias_correction(network, stepper.preprocessor):
+            logging.info("Folded the bias correction into the output layer.")
+
+    if weight_quantization is not None:
+        num_quantized = quantize_weights(network, dtype=weight_quantization)
+        logging.info(f"Quantized the weights of {num_quantized} layers to {weight_quantization}.")
+
+    if channels_last:
+        network = network.to(memory_format=torch.channels_last)
+
+    if weight_dtype is not None:
+        dtype = _DTYPES[weight_dtype] if isinstance(weight_dtype, str) else weight_dtype
+
+        # only the weights of the dense layers are converted, spectral transforms and other buffers remain in full precision
+        for module in network.modules():
+            if isinstance(module, (nn.Conv2d, nn.Linear)):
+                module.to(dtype=dtype)
+
+        network = _AutocastWrapper(network, dtype)
+
+    if stepper is not None:
+        stepper.model = network
+    else:
+        model = network
+
+    return model
@@ -20,12 +20,10 @@ perform inference and its interface is compatible with earth2mip
 import os
 import shutil
 import json
-import jsbeautifier
+from contextlib import contextmanager
 import numpy as np
 import torch
 from makani.utils.YParams import ParamsBase
-from makani.utils.driver import Driver
-from makani.third_party.climt.zenith_angle import cos_zenith_angle
 from makani.utils.dataloaders.data_helpers import get_data_normalization
 from makani.models import model_registry
 import datetime
@@ -51,6 +49,8 @@ class LocalPackage:
     OROGRAPHY_FILE = "orography.nc"
     LANDMASK_FILE = "land_mask.nc"
     SOILTYPE_FILE = "soil_type.nc"
+    EXPORTED_MODEL_FILE = "model.pt2"
+    BASIS_CACHE_DIR = "basis_cache"
 
     def __init__(self, root):
         self.root = root
@@ -93,6 +93,8 @@ class ModelWrapper(torch.nn.Module):
     -------
     forward(x, time):
         performs a single prediction steps
+    append_history(x, out):
+        appends a prediction to the history window
     """
 
     def __init__(self, model, params):
@@ -114,10 +116,12 @@ class ModelWrapper(torch.nn.Module):
         else:
             self.lons = np.linspace(0, 360, nlon, endpoint=False)
 
-        # zenith angle
+        # zenith angle. Only the sun position is computed on the host, the angles on the grid are computed on the device of the input
         self.add_zenith = params.get("add_zenith", False)
         if self.add_zenith:
             self.lon_grid, self.lat_grid = np.meshgrid(self.lons, self.lats)
+            self.register_buffer("lon_rad", torch.as_tensor(np.deg2rad(self.lon_grid, dtype=np.float32)), persistent=False)
+            self.register_buffer("lat_rad", torch.as_tensor(np.deg2rad(self.lat_grid, dtype=np.float32)), persistent=False)
 
         # load the normalization files
         bias, scale = get_data_normalization(self.params)
@@ -152,15 +156,41 @@ class ModelWrapper(torch.nn.Module):
     def set_rng(self, reset=True, seed=333):
         self.model.preprocessor.set_rng(reset=reset, seed=seed)
         return
+
+    def append_history(self, x, out):
+        """
+        appends the prediction out to the history window x for the next step. Outside of autograd, this uses a circular
+        buffer which only copies a single frame, the returned window replaces x, which must not be used anymore.
+        """
+        return self.model.preprocessor.append_history(x, out, 0, update_state=False)
         
+    def cos_zenith(self, time):
+        """
+        computes the cosine of the solar zenith angle on the grid for one or several times and returns a tensor of shape [T, H, W]
+        """
+        # numba is only imported when it is needed
+        from makani.third_party.climt.zenith_angle import _right_ascension_declination, _greenwich_mean_sidereal_time
+
+        time = np.reshape(np.asarray(time, dtype=object), (-1,))
+
+        # sun position and sidereal time, shape [T, 1, 1]
+        ra, dec = _right_ascension_declination(time)
+        gmst = _greenwich_mean_sidereal_time(time)
+        ra, dec, gmst = [torch.as_tensor(np.asarray(v, dtype=np.float32)).to(device=self.lat_rad.device).reshape(-1, 1, 1) for v in [ra, dec, gmst]]
+
+        return torch.sin(self.lat_rad) * torch.sin(dec) + torch.cos(self.lat_rad) * torch.cos(dec) * torch.cos(gmst + self.lon_rad - ra)
+
     def forward(self, x, time, normalized_data=True, replace_state=None):
+        """
+        performs a single prediction step. time can be a single datetime or one datetime per batch entry
+        """
         if not normalized_data:
             x = (x - self.in_bias) / self.in_scale
 
         if self.add_zenith:
-            cosz = cos_zenith_angle(time, self.lon_grid, self.lat_grid)
-            cosz = cosz.astype(np.float32)
-            z = torch.as_tensor(cosz).to(device=x.device)
+            z = self.cos_zenith(time).to(device=x.device)
+            if x.ndim == 4:
+                z = z.unsqueeze(1)
             while z.ndim != x.ndim:
                 z = z[None]
             self.model.preprocessor.cache_unpredicted_features(None, None, xz=z, yz=None)
@@ -168,7 +198,7 @@ class ModelWrapper(torch.nn.Module):
         out = self.model(x, replace_state=replace_state)
 
         if not normalized_data:
-            out = out * self.out_scale + self.out_bias
+            out = torch.addcmul(self.out_bias, out, self.out_scale)
 
         return out
 
@@ -178,6 +208,8 @@ def save_model_package(params):
     Saves out a self-contained model-package.
     The idea is to save anything necessary for inference beyond the checkpoints in one location.
     """
+    import jsbeautifier
+
     # save out the current state of the parameters, make it human readable
     config_path = os.path.join(params.experiment_dir, "config.json")
     jsopts = jsbeautifier.default_options()
@@ -215,10 +247,81 @@ def save_model_package(params):
         f.write(msg)
 
 
+@contextmanager
+def _init_empty_parameters():
+    """
+    Moves parameters to the meta device as soon as they are registered, which skips their initialization. Buffers such as
+    the precomputed SHT weights are created as usual, since non-persistent buffers are not stored in the checkpoint.
+    """
+    register_parameter = torch.nn.Module.register_parameter
+
+    def register_empty_parameter(module, name, param):
+        register_parameter(module, name, param)
+        if param is not None:
+            param = module._parameters[name]
+            empty_param = torch.nn.Parameter(param.to(device=torch.device("meta")), requires_grad=param.requires_grad)
+            empty_param.__dict__.update(param.__dict__)
+            module._parameters[name] = empty_param
+
+    torch.nn.Module.register_parameter = register_empty_parameter
+    try:
+        yield
+    finally:
+        torch.nn.Module.register_parameter = register_parameter
+
+
+def _assign_checkpoint(checkpoint_path, model):
+    """
+    Assigns the weights of a legacy checkpoint to a model with empty parameters. The checkpoint is memory-mapped and its
+    tensors become the parameters of the model, so that no copies are made on the host.
+    """
+    try:
+        checkpoint = torch.load(checkpoint_path, map_location="cpu", mmap=True, weights_only=False)
+    except RuntimeError:
+        # checkpoints in the legacy serialization format cannot be memory-mapped
+        checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+
+    # attributes such as the model parallel sharing information are lost in the assignment
+    param_attrs = {name: dict(param.__dict__) for name, param in model.named_parameters()}
+
+    model.load_state_dict(checkpoint["model_state"], strict=True, assign=True)
+
+    for name, param in model.named_parameters():
+        param.__dict__.update(param_attrs.get(name, {}))
+
+    empty_tensors = [name for name, tensor in list(model.named_parameters()) + list(model.named_buffers()) if tensor.is_meta]
+    if empty_tensors:
+        raise RuntimeError(f"Error, the following tensors were not restored from {checkpoint_path}: {empty_tensors}")
+
+    return
+
+
+def _load_exported_model(params, exported_path, multistep=False):
+    """
+    Constructs the model wrapper around a network which was exported ahead of time. This skips the construction of the network.
+    """
+    from makani.models.stepper import SingleStepWrapper, MultiStepWrapper
+
+    network = torch.export.load(exported_path).module()
+
+    if multistep:
+        model = MultiStepWrapper(params, lambda: network)
+    else:
+        model = SingleStepWrapper(params, lambda: network)
+
+    return model
+
+
 # TODO: this is not clean and should be reworked to allow restoring from params + checkpoint file
-def load_model_package(package, pretrained=True, device="cpu", multistep=False):
+def load_model_package(package, pretrained=True, device="cpu", multistep=False, fast_start=False, optimize=False):
     """
     Loads model package and return the wrapper which can be used for inference.
+
+    With fast_start, the network exported with export_model_package is used if the package contains one. Otherwise the
+    parameters are created on the meta device and the weights are assigned directly from the memory-mapped checkpoint, which
+    skips their initialization. A basis cache shipped with the package is used for the precomputed SHT and DISCO tensors.
+
+    With optimize, the restored model is transformed for inference with model_registry.optimize_model_for_inference.
     """
     path = package.get("config.json")
     params = ParamsBase.from_json(path)
@@ -231,12 +334,33 @@ def load_model_package(package, pretrained=True, device="cpu", multistep=False):
     params.img_local_shape_x = params.img_shape_x
     params.img_local_shape_y = params.img_shape_y
 
-    # get the model and
-    model = model_registry.get_model(params, multistep=multistep).to(device)
+    if fast_start:
+        basis_cache_dir = package.get(LocalPackage.BASIS_CACHE_DIR)
+        if (params.get("basis_cache_dir", None) is None) and os.path.isdir(basis_cache_dir):
+            params.basis_cache_dir = basis_cache_dir
 
-    if pretrained:
-        best_checkpoint_path = package.get(LocalPackage.MODEL_PACKAGE_CHECKPOINT_PATH)
-        Driver.restore_from_checkpoint(best_checkpoint_path, model)
+    if fast_start and pretrained:
+        exported_path = package.get(LocalPackage.EXPORTED_MODEL_FILE)
+        if os.path.isfile(exported_path):
+            model = _load_exported_model(params, exported_path, multistep=multistep)
+        else:
+            with _init_empty_parameters():
+                model = model_registry.get_model(params, multistep=multistep)
+            _assign_checkpoint(package.get(LocalPackage.MODEL_PACKAGE_CHECKPOINT_PATH), model)
+
+        model = model.to(device)
+    else:
+        # get the model and
+        model = model_registry.get_model(params, multistep=multistep).to(device)
+
+        if pretrained:
+            from makani.utils.driver import Driver
+
+            best_checkpoint_path = package.get(LocalPackage.MODEL_PACKAGE_CHECKPOINT_PATH)
+            Driver.restore_from_checkpoint(best_checkpoint_path, model)
+
+    if optimize and pretrained:
+        model = model_registry.optimize_model_for_inference(model, params)
 
     model = ModelWrapper(model, params=params)
 
@@ -246,6 +370,39 @@ def load_model_package(package, pretrained=True, device="cpu", multistep=False):
     return model
 
 
+def export_model_package(model, package_dir, time=None):
+    """
+    Exports the network of a loaded model package ahead of time with torch.export and stores it in the package, where it is
+    picked up by load_model_package with fast_start. The batch dimension is dynamic. Preprocessing, normalization and the
+    internal state of the wrapper remain in python.
+    """
+    if time is None:
+        time = datetime.datetime.now(tz=datetime.timezone.utc)
+
+    network = model.model.model
+
+    # capture the input of the network during a forward pass with a batch size of two, which avoids specializing the batch dimension
+    network_inputs = []
+    handle = network.register_forward_pre_hook(lambda module, args: network_inputs.append(args[0].detach().clone()))
+    num_chans = model.in_bias.shape[1] * (model.params.get("n_history", 0) + 1)
+    inp = torch.zeros((2, num_chans, model.params.img_shape_x, model.params.img_shape_y), dtype=torch.float32, device=model.in_bias.device)
+    try:
+        with torch.no_grad():
+            model.model.preprocessor.update_internal_state(replace_state=True, batch_size=inp.shape[0])
+            model(inp, [time, time])
+    finally:
+        handle.remove()
+
+    batch = torch.export.Dim("batch")
+    with torch.no_grad():
+        exported = torch.export.export(network, (network_inputs[0],), dynamic_shapes=({0: batch},))
+
+    exported_path = os.path.join(package_dir, LocalPackage.EXPORTED_MODEL_FILE)
+    torch.export.save(exported, exported_path)
+
+    return exported_path
+
+
 def load_time_loop(package, device=None, time_step_hours=None):
     """This function loads an earth2mip TimeLoop object that
     can be used for inference.
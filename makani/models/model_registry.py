@@ -29,8 +29,6 @@ import torch
 import torch.nn as nn
 
 from makani.utils.YParams import ParamsBase
-from makani.models import SingleStepWrapper, MultiStepWrapper
-from makani.models import StochasticInterpolantWrapper
 from makani.utils.dataloaders.data_helpers import get_data_normalization
 
 
@@ -141,10 +139,20 @@ def get_model(params: ParamsBase, use_stochastic_interpolation: bool = False, mu
         If no model is registered under the provided name.
     """
 
+    # the wrappers are imported here, so that importing the registry stays cheap
+    from makani.models.stepper import SingleStepWrapper, MultiStepWrapper
+    from makani.models.stochastic_interpolant import StochasticInterpolantWrapper
+
     # conditional import for constraints
     if hasattr(params, "constraints"):
         from makani.models.parametrizations import ConstraintsWrapper
 
+    # cache the precomputed spectral and DISCO basis tensors on disk if requested
+    if (params is not None) and (params.get("basis_cache_dir", None) is not None):
+        from makani.utils.basis_cache import enable_basis_cache
+
+        enable_basis_cache(params.basis_cache_dir)
+
     if params is not None:
         # makani requires that these entries are set in params for now
         inp_shape = (params.img_crop_shape_x, params.img_crop_shape_y)
@@ -188,10 +196,35 @@ def get_model(params: ParamsBase, use_stochastic_interpolation: bool = False, mu
         else:
             model = SingleStepWrapper(params, model_handle)
     else:
-        model = StochasticInterpolantWrapper(params, model_handle, noise_epsilon=params.get("noise_epsilon", 1.0), use_foellmer=params.get("use_foellmer", False))
+        model = StochasticInterpolantWrapper(
+            params,
+            model_handle,
+            noise_epsilon=params.get("noise_epsilon", 1.0),
+            use_foellmer=params.get("use_foellmer", False),
+            sampler=params.get("stochastic_interpolation_sampler", "euler"),
+            sampler_tol=params.get("stochastic_interpolation_tol", 1e-2),
+            sampler_min_step=params.get("stochastic_interpolation_min_step", 1e-3),
+        )
 
     return model
 
 
+def optimize_model_for_inference(model: "torch.nn.Module", params: ParamsBase) -> "torch.nn.Module":
+    """
+    Applies the inference transformations of makani.models.inference_optimization to a model returned by get_model.
+    Has to be called after the weights are restored, as the transformed model does not match the checkpoints anymore.
+    Reduced precision weights, weight-only quantization and channels-last layout are enabled via inference_weight_dtype,
+    inference_weight_quantization and inference_channels_last.
+    """
+    from makani.models.inference_optimization import optimize_for_inference
+
+    return optimize_for_inference(
+        model,
+        channels_last=params.get("inference_channels_last", False),
+        weight_dtype=params.get("inference_weight_dtype", None),
+        weight_quantization=params.get("inference_weight_quantization", None),
+    )
+
+
 # initialize the internal state upon import
 _model_registry = _construct_registry()
@@ -0,0 +1,318 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Low-latency forecast serving on top of the ModelWrapper of a model package. A long-lived ForecastServer keeps the model
+warm on its device, batches concurrent initial condition requests dynamically into a single rollout and streams the
+predictions of each lead time as soon as they are available. The server can be exposed over HTTP on a TCP port or a Unix socket.
+"""
+
+import os
+import json
+import time
+import queue
+import base64
+import datetime
+import threading
+import socketserver
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Union
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class ForecastStream:
+    """
+    Handle for a submitted forecast request. Iterating over the stream yields tuples (step, valid_time, prediction) as soon as
+    the corresponding lead time is available. Exceptions raised during the rollout are re-raised in the consumer.
+    """
+
+    _END = object()
+
+    def __init__(self, inp: torch.Tensor, time: datetime.datetime, n_steps: int, normalized_data: bool):
+        self.inp = inp
+        self.time = time
+        self.n_steps = n_steps
+        self.normalized_data = normalized_data
+        self._queue = queue.Queue()
+
+    def _put(self, item):
+        self._queue.put(item)
+
+    def _finish(self):
+        self._queue.put(ForecastStream._END)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is ForecastStream._END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    def result(self):
+        """blocks until the forecast is complete and returns the list of all lead times"""
+        return list(self)
+
+
+class ForecastServer:
+    """
+    Serves forecasts from a ModelWrapper. Requests submitted concurrently within batch_timeout seconds are batched into a single
+    rollout of up to max_batch_size initial conditions, provided that their shapes and normalization modes agree. Requests with
+    fewer steps drop out of the stream once they are complete. Predictions are moved to the host once per step for the whole batch.
+    """
+
+    def __init__(self, model, device: Union[str, torch.device] = "cpu", max_batch_size: int = 8, batch_timeout: float = 0.01, warmup: bool = True):
+        self.device = torch.device(device)
+        self.model = model.to(self.device)
+        self.model.eval()
+
+        self.max_batch_size = max_batch_size
+        self.batch_timeout = batch_timeout
+        self.timestep = datetime.timedelta(hours=self.model.timestep)
+
+        self._requests = queue.Queue()
+        self._thread = None
+
+        # run a single step so that lazily initialized state is ready before the first request arrives
+        if warmup:
+            params = self.model.params
+            num_chans = self.model.in_bias.shape[1] * (params.get("n_history", 0) + 1)
+            inp = torch.zeros((num_chans, params.img_shape_x, params.img_shape_y), dtype=torch.float32)
+            stream = ForecastStream(inp, datetime.datetime.now(tz=datetime.timezone.utc), 1, True)
+            self._rollout([stream])
+            stream.result()
+
+    @property
+    def is_running(self):
+        return (self._thread is not None) and self._thread.is_alive()
+
+    def start(self):
+        """starts the background thread which processes the requests"""
+        if not self.is_running:
+            self._thread = threading.Thread(target=self._serve_loop, name="forecast-server", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """processes the pending requests and stops the background thread"""
+        if self.is_running:
+            self._requests.put(None)
+            self._thread.join()
+        self._thread = None
+        return
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def submit(self, inp: Union[torch.Tensor, np.ndarray], time: datetime.datetime, n_steps: int = 1, normalized_data: bool = True) -> ForecastStream:
+        """
+        submits an initial condition of shape [C, H, W] valid at time for a rollout of n_steps steps. Naive times are interpreted as UTC
+        """
+        if not self.is_running:
+            raise RuntimeError("Error, the forecast server has to be started before submitting requests.")
+        if n_steps < 1:
+            raise ValueError(f"Error, expected at least one step but got {n_steps}.")
+
+        inp = torch.as_tensor(inp, dtype=torch.float32)
+        if inp.ndim == 4:
+            inp = inp.squeeze(0)
+        if inp.ndim != 3:
+            raise ValueError(f"Error, expected an initial condition of shape [C, H, W] but got {list(inp.shape)}.")
+
+        if time.tzinfo is None:
+            time = time.replace(tzinfo=datetime.timezone.utc)
+
+        stream = ForecastStream(inp, time, n_steps, normalized_data)
+        self._requests.put(stream)
+
+        return stream
+
+    def _collect_batch(self, request):
+        """collects further requests until the batch is full or the timeout has passed. Returns the batch and whether to continue"""
+        batch = [request]
+        deadline = time.monotonic() + self.batch_timeout
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self._requests.get(timeout=remaining) if remaining > 0 else self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, False
+            batch.append(request)
+
+        return batch, True
+
+    def _serve_loop(self):
+        running = True
+        while running:
+            request = self._requests.get()
+            if request is None:
+                break
+
+            batch, running = self._collect_batch(request)
+
+            # requests are rolled out jointly if their shapes and normalization agree
+            groups = {}
+            for request in batch:
+                groups.setdefault((tuple(request.inp.shape), request.normalized_data), []).append(request)
+
+            for group in groups.values():
+                try:
+                    self._rollout(group)
+                except Exception as err:
+                    logger.exception("Forecast rollout failed")
+                    for request in group:
+                        request._put(err)
+
+        return
+
+    def _rollout(self, group):
+        n_steps = max(request.n_steps for request in group)
+        normalized_data = group[0].normalized_data
+        times = [request.time for request in group]
+
+        with torch.inference_mode():
+            x = torch.stack([request.inp for request in group], dim=0).to(self.device)
+
+            # the internal state of the model, e.g. the input noise, has to match the batch size
+            self.model.model.preprocessor.update_internal_state(replace_state=True, batch_size=x.shape[0])
+
+            for step in range(n_steps):
+                out = self.model(x, times, normalized_data=normalized_data, replace_state=False)
+                times = [t + self.timestep for t in times]
+
+                # a single transfer per step for the whole batch
+                out_host = out.to("cpu")
+                for idx, request in enumerate(group):
+                    if step < request.n_steps:
+                        request._put((step + 1, times[idx], out_host[idx]))
+                    if step + 1 == request.n_steps:
+                        request._finish()
+
+                if step + 1 < n_steps:
+                    x = self.model.append_history(x, out)
+
+        return
+
+
+def _encode_array(arr: np.ndarray) -> dict:
+    arr = np.ascontiguousarray(arr)
+    return {"shape": list(arr.shape), "dtype": str(arr.dtype), "data": base64.b64encode(arr.tobytes()).decode("ascii")}
+
+
+def _decode_array(msg: dict) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(msg["data"]), dtype=np.dtype(msg.get("dtype", "float32"))).reshape(msg["shape"])
+
+
+class _ForecastRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of the forecast server:
+        GET /health: returns the status, the channel names and the timestep in hours
+        POST /forecast: expects a JSON body with the fields time (ISO 8601), steps, normalized, shape, dtype and data (base64 encoded
+            array of shape [C, H, W]). The response is streamed as newline-delimited JSON, one line per lead time with the fields
+            step, time, shape, dtype and data.
+    """
+
+    protocol_version = "HTTP/1.1"
+    forecast_server = None
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, code, msg):
+        body = json.dumps(msg).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/health":
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+
+        model = self.forecast_server.model
+        self._send_json(200, {"status": "ok" if self.forecast_server.is_running else "stopped", "channels": model.in_channels, "timestep": model.timestep})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/forecast":
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+
+        try:
+            msg = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            inp = _decode_array(msg)
+            valid_time = datetime.datetime.fromisoformat(msg["time"])
+            stream = self.forecast_server.submit(inp, valid_time, n_steps=int(msg.get("steps", 1)), normalized_data=bool(msg.get("normalized", True)))
+        except Exception as err:
+            self._send_json(400, {"error": str(err)})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        try:
+            for step, valid_time, pred in stream:
+                line = {"step": step, "time": valid_time.isoformat(), **_encode_array(pred.numpy())}
+                self._write_chunk((json.dumps(line) + "\n").encode("utf-8"))
+        except Exception as err:
+            self._write_chunk((json.dumps({"error": str(err)}) + "\n").encode("utf-8"))
+
+        # terminate the chunked response
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # the handler expects an address tuple
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+
+def make_http_server(forecast_server: ForecastServer, host: str = "127.0.0.1", port: int = 8000, socket_path: Optional[str] = None):
+    """
+    Creates an HTTP server for the forecast server, listening on host:port or on the Unix socket socket_path if specified.
+    The caller is responsible for running serve_forever.
+    """
+    handler = type("ForecastRequestHandler", (_ForecastRequestHandler,), {"forecast_server": forecast_server})
+
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return _UnixHTTPServer(socket_path, handler)
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        server.daemon_threads = True
+        return server
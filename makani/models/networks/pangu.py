@@ -15,6 +15,7 @@
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import math
 import sys
 import numpy as np
@@ -409,6 +410,9 @@ class EarthAttention3D(nn.Module):
         )
         self.softmax = nn.Softmax(dim=-1)
 
+        # materialized bias for inference, together with the key it was computed for
+        self._bias_cache = None
+
     def calculate_attn(self, q, k):
         attn = q @ k.transpose(-2, -1)
         return attn
@@ -436,6 +440,34 @@ class EarthAttention3D(nn.Module):
 
         return earth_position_bias
 
+    def get_attention_bias(self, mask=None):
+        """
+        Returns the earth position bias, combined with the shift window mask if present, in the layout expected by SDPA:
+        (1, num_lon*nH*num_pl*num_lat, N, N) if a mask is passed and (1, nH*num_pl*num_lat, N, N) otherwise.
+        In inference, the materialized bias is cached and only recomputed if the bias table or the mask change.
+        """
+        use_cache = (not self.training) and (not torch.is_grad_enabled())
+
+        if use_cache:
+            key = (self.earth_position_bias_table.data_ptr(), self.earth_position_bias_table._version, self.earth_position_bias_table.dtype)
+            if mask is not None:
+                key = key + (mask.data_ptr(), mask._version, mask.dtype)
+            if (self._bias_cache is not None) and (self._bias_cache[0] == key):
+                return self._bias_cache[1]
+
+        earth_position_bias = self.extract_earth_pos_bias()
+        N = earth_position_bias.shape[-1]
+
+        if mask is not None:
+            bias = mask.unsqueeze(1) + earth_position_bias.unsqueeze(0)
+        else:
+            bias = earth_position_bias
+        bias = bias.reshape(1, -1, N, N)
+
+        self._bias_cache = (key, bias) if use_cache else None
+
+        return bias
+
     def apply_mask(self, attn, mask, B_, nW_, N):
         nLon = mask.shape[0]
         attn = attn.view(
@@ -461,9 +493,9 @@ class EarthAttention3D(nn.Module):
         )
         q, k, v = qkv[0], qkv[1], qkv[2]
 
-        earth_position_bias = self.extract_earth_pos_bias()
-
         if not self.use_sdpa:
+            earth_position_bias = self.extract_earth_pos_bias()
+
             q_new = q * self.scale
 
             attn = self.calculate_attn(q_new,k)
@@ -480,21 +512,18 @@ class EarthAttention3D(nn.Module):
             x = self.apply_attention(attn, v, B_, nW_, N, C)
         
         else:
-            if mask is not None:
-                bias = mask.unsqueeze(1).unsqueeze(0) + earth_position_bias.unsqueeze(0).unsqueeze(0)
-                # squeeze the bias if needed in dim 2
-                #bias = bias.squeeze(2)
-            else:
-                bias = earth_position_bias.unsqueeze(0)
-            
-            # extract batch size for q,k,v
-            nLon = self.num_lon
-            q = q.view(B_ // nLon, nLon, q.shape[1], q.shape[2], q.shape[3], q.shape[4]) 
-            k = k.view(B_ // nLon, nLon, k.shape[1], k.shape[2], k.shape[3], k.shape[4])
-            v = v.view(B_ // nLon, nLon, v.shape[1], v.shape[2], v.shape[3], v.shape[4])
-            ####
-            x = torch.nn.functional.scaled_dot_product_attention(q, k, v, attn_mask=bias, scale=self.scale, dropout_p=self.attn_drop)
-            x = x.permute(0, 1, 3, 4, 2, 5).reshape(B_, nW_, N, C)
+            bias = self.get_attention_bias(mask)
+
+            # fold the windows (and the longitude windows if masked) into the head dimension. This way, SDPA receives 4D inputs
+            # and a bias which is broadcast along the batch dimension, so that the memory-efficient kernels can be used and the
+            # (B * num_lon, nH, num_pl*num_lat, N, N) attention matrix is never formed
+            bsize = B_ // self.num_lon if mask is not None else B_
+            q = q.reshape(bsize, -1, N, C // self.num_heads)
+            k = k.reshape(bsize, -1, N, C // self.num_heads)
+            v = v.reshape(bsize, -1, N, C // self.num_heads)
+
+            x = torch.nn.functional.scaled_dot_product_attention(q, k, v, attn_mask=bias, scale=self.scale, dropout_p=(self.attn_drop if self.training else 0.0))
+            x = x.reshape(B_, self.num_heads, nW_, N, C // self.num_heads).permute(0, 2, 3, 1, 4).reshape(B_, nW_, N, C)
 
         # projection
         x = self.proj(x)
@@ -520,6 +549,7 @@ class Transformer3DBlock(nn.Module):
         drop_path (float, optional): Stochastic depth rate. Default: 0.0
         act_layer (nn.Module, optional): Activation layer. Default: nn.GELU
         norm_layer (nn.Module, optional): Normalization layer.  Default: nn.LayerNorm
+        fused_window_partition (bool, optional): If True, padding, shift and window partition (and their inverse) are carried out with a single precomputed gather. Default: False
     """
 
     def __init__(
@@ -538,6 +568,7 @@ class Transformer3DBlock(nn.Module):
         act_layer=nn.GELU,
         norm_layer=nn.LayerNorm,
         checkpointing_level=0,
+        fused_window_partition=False,
     ):
         super().__init__()
         window_size = (2, 6, 12) if window_size is None else window_size
@@ -592,6 +623,59 @@ class Transformer3DBlock(nn.Module):
 
         self.register_buffer("attn_mask", attn_mask)
 
+        self.fused_window_partition = fused_window_partition
+        if self.fused_window_partition:
+            window_index, reverse_index = self._get_window_indices()
+            self.register_buffer("window_index", window_index, persistent=False)
+            self.register_buffer("reverse_index", reverse_index, persistent=False)
+
+    @torch.no_grad()
+    def _get_window_indices(self):
+        """
+        Precomputes the gather indices which map the flattened input (B, Pl*Lat*Lon, C) to the windowed layout and back.
+        The indices are obtained by applying the padding, roll and window partition of the unfused path to the index grid,
+        so that both paths are identical. Padded points refer to an additional zero row at index Pl*Lat*Lon.
+        """
+        Pl, Lat, Lon = self.input_resolution
+        L = Pl * Lat * Lon
+
+        # forward: pad, roll and partition
+        index = torch.arange(L, dtype=torch.long).reshape(1, 1, Pl, Lat, Lon)
+        index = F.pad(index, self.pad.padding, mode="constant", value=L).permute(0, 2, 3, 4, 1)
+        _, Pl_pad, Lat_pad, Lon_pad, _ = index.shape
+        shift_pl, shift_lat, shift_lon = self.shift_size
+        if self.roll:
+            index = torch.roll(index, shifts=(-shift_pl, -shift_lat, -shift_lat), dims=(1, 2, 3))
+        window_index = window_partition(index, self.window_size).reshape(-1)
+
+        # backward: reverse partition, roll and crop
+        index = torch.arange(window_index.shape[0], dtype=torch.long)
+        index = index.reshape(self.attn.num_lon, -1, *self.window_size, 1)
+        index = window_reverse(index, self.window_size, Pl=Pl_pad, Lat=Lat_pad, Lon=Lon_pad)
+        if self.roll:
+            index = torch.roll(index, shifts=(shift_pl, shift_lat, shift_lon), dims=(1, 2, 3))
+        reverse_index = crop3d(index.permute(0, 4, 1, 2, 3), self.input_resolution).reshape(-1)
+
+        return window_index, reverse_index
+
+    def _forward_attention_fused(self, x: torch.Tensor):
+        B, L, C = x.shape
+        win_pl, win_lat, win_lon = self.window_size
+
+        # gather the windows from the input with an appended zero row for the padding
+        x = F.pad(x, (0, 0, 0, 1))
+        x_windows = x[:, self.window_index].view(B * self.attn.num_lon, -1, win_pl * win_lat * win_lon, C)
+
+        if self.checkpointing_level > 0:
+            attn_windows = checkpoint(self.attn, x_windows, self.attn_mask, use_reentrant=False)
+        else:
+            attn_windows = self.attn(x_windows, mask=self.attn_mask)
+
+        # scatter back by gathering with the inverse index
+        x = attn_windows.view(B, -1, C)[:, self.reverse_index]
+
+        return x
+
     def forward(self, x: torch.Tensor):
         Pl, Lat, Lon = self.input_resolution
         B, L, C = x.shape
@@ -601,6 +685,13 @@ class Transformer3DBlock(nn.Module):
             x = checkpoint(self.norm1, x, use_reentrant=False)
         else:
             x = self.norm1(x)
+
+        if self.fused_window_partition:
+            x = self._forward_attention_fused(x)
+            x = shortcut + self.drop_path(x)
+            x = x + self.drop_path(self.mlp(self.norm2(x)))
+            return x
+
         x = x.view(B, Pl, Lat, Lon, C)
 
         # start pad
@@ -680,6 +771,7 @@ class FuserLayer(nn.Module):
         attn_drop (float, optional): Attention dropout rate. Default: 0.0
         drop_path (float | tuple[float], optional): Stochastic depth rate. Default: 0.0
         norm_layer (nn.Module, optional): Normalization layer. Default: nn.LayerNorm
+        fused_window_partition (bool, optional): Use precomputed gathers for padding, shift and window partition. Default: False
     """
 
     def __init__(
@@ -697,6 +789,7 @@ class FuserLayer(nn.Module):
         drop_path=0.0,
         norm_layer=nn.LayerNorm,
         checkpointing_level=0,
+        fused_window_partition=False,
     ):
         super().__init__()
         self.dim = dim
@@ -721,6 +814,7 @@ class FuserLayer(nn.Module):
                     drop_path=drop_path[i] if isinstance(drop_path, Sequence) else drop_path,
                     norm_layer=norm_layer,
                     checkpointing_level=checkpointing_level,
+                    fused_window_partition=fused_window_partition,
                 )
                 for i in range(depth)
             ]
@@ -755,6 +849,7 @@ class Pangu(nn.Module):
         aux_channel_names=[],
         drop_path_rate=0.0,
         checkpointing_level=0,
+        fused_window_partition=False,
         **kwargs,
     ):
 
@@ -815,7 +910,8 @@ class Pangu(nn.Module):
             num_heads=num_heads[0],
             window_size=window_size,
             drop_path=drop_path[:2],
-            checkpointing_level=self.checkpointing_level
+            checkpointing_level=self.checkpointing_level,
+            fused_window_partition=fused_window_partition,
         )
 
         patched_inp_shape_downsample = (
@@ -837,7 +933,8 @@ class Pangu(nn.Module):
             num_heads=num_heads[1],
             window_size=window_size,
             drop_path=drop_path[2:],
-            checkpointing_level=self.checkpointing_level
+            checkpointing_level=self.checkpointing_level,
+            fused_window_partition=fused_window_partition,
         )
 
         self.layer3 = FuserLayer(
@@ -847,7 +944,8 @@ class Pangu(nn.Module):
             num_heads=num_heads[2],
             window_size=window_size,
             drop_path=drop_path[2:],
-            checkpointing_level=self.checkpointing_level
+            checkpointing_level=self.checkpointing_level,
+            fused_window_partition=fused_window_partition,
         )
 
         self.upsample = UpSample3D(
@@ -861,7 +959,8 @@ class Pangu(nn.Module):
             num_heads=num_heads[3],
             window_size=window_size,
             drop_path=drop_path[:2],
-            checkpointing_level=self.checkpointing_level
+            checkpointing_level=self.checkpointing_level,
+            fused_window_partition=fused_window_partition,
         )
 
         self.patchrecovery2d = PatchRecovery2D(
@@ -71,6 +71,10 @@ class PanguOnnx(OnnxWrapper):
         self.register_buffer("atmo_channels", torch.LongTensor(atmo_chans), persistent=False)
         self.register_buffer("surf_channels", torch.LongTensor(surf_chans), persistent=False)
 
+        # atmospheric channels in the variable-major order expected by the ONNX model, which allows gathering them in a single pass
+        atmo_chans_onnx = torch.LongTensor(atmo_chans).reshape(self.n_atmo_groups, self.n_atmo_chans).transpose(1, 0).reshape(-1)
+        self.register_buffer("atmo_channels_onnx", atmo_chans_onnx, persistent=False)
+
         return
 
     def prepare_input(self, input):
@@ -101,13 +105,39 @@ class PanguOnnx(OnnxWrapper):
 
       
     def forward(self, input):
-        
-        surface, atmospheric = self.prepare_input(input)
 
+        if not self.io_binding:
+            surface, atmospheric = self.prepare_input(input)
 
-        output,output_surface=self.onnx_session_run({'input':atmospheric,'input_surface':surface})
+            output,output_surface=self.onnx_session_run({'input':atmospheric,'input_surface':surface})
 
-        output = self.prepare_output(output_surface, output)
+            output = self.prepare_output(output_surface, output)
+
+            return output
+
+        B,V,Lat,Long=input.shape
+
+        if B>1:
+            raise NotImplementedError("Not implemented yet for batch size greater than 1")
+
+        input = input.to(torch.float32)
+        n_surf = self.surf_channels.shape[0]
+        n_atmo = self.atmo_channels_onnx.shape[0]
+
+        with self.acquire_session(input.device) as session:
+            # gather the inputs directly into the layout expected by the ONNX model. The staging buffers are owned by the session
+            surface, atmospheric = self.get_buffers(session, "inputs", [(n_surf, Lat, Long), (self.n_atmo_chans, self.n_atmo_groups, Lat, Long)], input.device)
+            torch.index_select(input[0], 0, self.surf_channels, out=surface)
+            torch.index_select(input[0], 0, self.atmo_channels_onnx, out=atmospheric.view(n_atmo, Lat, Long))
+
+            # the session writes into the slices of the output tensor, which replaces prepare_output
+            if self.reuse_outputs:
+                output = self.get_buffers(session, "outputs", [(1, n_surf + n_atmo, Lat, Long)], input.device, double_buffered=True)[0]
+            else:
+                output = torch.empty((1, n_surf + n_atmo, Lat, Long), dtype=torch.float32, device=input.device)
+            output_surface = output[0, :n_surf]
+            output_atmospheric = output[0, n_surf:].view(self.n_atmo_chans, self.n_atmo_groups, Lat, Long)
+
+            self.onnx_session_run({'input':atmospheric,'input_surface':surface}, outputs=[output_atmospheric, output_surface], session=session)
 
-        
         return output
@@ -32,7 +32,7 @@ import torch_harmonics as th
 import torch_harmonics.distributed as thd
 
 # wrap fft, to unify interface to spectral transforms
-from makani.models.common import RealFFT2, InverseRealFFT2, GeometricInstanceNormS2
+from makani.models.common import RealFFT2, InverseRealFFT2, GeometricInstanceNormS2, get_spectral_transform
 from makani.mpu.fft import DistributedRealFFT2, DistributedInverseRealFFT2
 from makani.mpu.layers import DistributedMLP, DistributedEncoderDecoder
 
@@ -288,6 +288,7 @@ class SphericalFourierNeuralOperatorNet(nn.Module):
         spectral_layers=3,
         bias=False,
         checkpointing_level=0,
+        fft_pipeline_chunks=1,
         **kwargs,
     ):
         super(SphericalFourierNeuralOperatorNet, self).__init__()
@@ -305,7 +306,7 @@ class SphericalFourierNeuralOperatorNet(nn.Module):
         self.w = int(self.inp_shape[1] // scale_factor)
 
         # initialize spectral transforms
-        self._init_spectral_transforms(spectral_transform, model_grid_type, sht_grid_type, hard_thresholding_fraction, max_modes)
+        self._init_spectral_transforms(spectral_transform, model_grid_type, sht_grid_type, hard_thresholding_fraction, max_modes, fft_pipeline_chunks)
 
         # determine activation function
         if activation_function == "relu":
@@ -513,6 +514,7 @@ class SphericalFourierNeuralOperatorNet(nn.Module):
         sht_grid_type="legendre-gauss",
         hard_thresholding_fraction=1.0,
         max_modes=None,
+        fft_pipeline_chunks=1,
     ):
         """
         Initialize the spectral transforms based on the maximum number of modes to keep. Handles the computation
@@ -541,19 +543,20 @@ class SphericalFourierNeuralOperatorNet(nn.Module):
                 sht_handle = thd.DistributedRealSHT
                 isht_handle = thd.DistributedInverseRealSHT
 
-            # set up
-            self.trans_down = sht_handle(*self.inp_shape, lmax=modes_lat, mmax=modes_lon, grid=model_grid_type).float()
-            self.itrans_up = isht_handle(*self.out_shape, lmax=modes_lat, mmax=modes_lon, grid=model_grid_type).float()
-            self.trans = sht_handle(self.h, self.w, lmax=modes_lat, mmax=modes_lon, grid=sht_grid_type).float()
-            self.itrans = isht_handle(self.h, self.w, lmax=modes_lat, mmax=modes_lon, grid=sht_grid_type).float()
+            # set up. The SHTs are taken from the global registry to share the precomputed weights
+            self.trans_down = get_spectral_transform(sht_handle, *self.inp_shape, lmax=modes_lat, mmax=modes_lon, grid=model_grid_type, dtype=torch.float32)
+            self.itrans_up = get_spectral_transform(isht_handle, *self.out_shape, lmax=modes_lat, mmax=modes_lon, grid=model_grid_type, dtype=torch.float32)
+            self.trans = get_spectral_transform(sht_handle, self.h, self.w, lmax=modes_lat, mmax=modes_lon, grid=sht_grid_type, dtype=torch.float32)
+            self.itrans = get_spectral_transform(isht_handle, self.h, self.w, lmax=modes_lat, mmax=modes_lon, grid=sht_grid_type, dtype=torch.float32)
 
         elif spectral_transform == "fft":
             fft_handle = RealFFT2
             ifft_handle = InverseRealFFT2
 
             if comm.get_size("spatial") > 1:
-                fft_handle = DistributedRealFFT2
-                ifft_handle = DistributedInverseRealFFT2
+                # overlap the distributed transpositions with the FFTs of other channel chunks
+                fft_handle = partial(DistributedRealFFT2, pipeline_chunks=fft_pipeline_chunks)
+                ifft_handle = partial(DistributedInverseRealFFT2, pipeline_chunks=fft_pipeline_chunks)
 
             self.trans_down = fft_handle(*self.inp_shape, lmax=modes_lat, mmax=modes_lon).float()
             self.itrans_up = ifft_handle(*self.out_shape, lmax=modes_lat, mmax=modes_lon).float()
@@ -24,7 +24,7 @@ from functools import partial
 from itertools import groupby
 
 # helpers
-from makani.models.common import DropPath, LayerScale, MLP, EncoderDecoder, SpectralConv
+from makani.models.common import DropPath, LayerScale, MLP, EncoderDecoder, SpectralConv, get_spectral_transform
 from makani.utils.features import get_water_channels
 
 # get spectral transforms and spherical convolutions from torch_harmonics
@@ -169,8 +169,8 @@ class DiscreteContinuousDecoder(nn.Module):
             isht_handle = thd.DistributedInverseRealSHT if comm.get_size("spatial") > 1 else th.InverseRealSHT
 
             # set upsampling module
-            self.sht = sht_handle(*inp_shape, grid=grid_in).float()
-            self.isht = isht_handle(*out_shape, lmax=self.sht.lmax, mmax=self.sht.mmax, grid=grid_out).float()
+            self.sht = get_spectral_transform(sht_handle, *inp_shape, grid=grid_in, dtype=torch.float32)
+            self.isht = get_spectral_transform(isht_handle, *out_shape, lmax=self.sht.lmax, mmax=self.sht.mmax, grid=grid_out, dtype=torch.float32)
             self.upsample = nn.Sequential(self.sht, self.isht)
         else:
             resample_handle = thd.DistributedResampleS2 if comm.get_size("spatial") > 1 else th.ResampleS2
@@ -583,9 +583,9 @@ class SphericalNeuralOperatorNet(nn.Module):
             sht_handle = thd.DistributedRealSHT
             isht_handle = thd.DistributedInverseRealSHT
 
-        # set up
-        self.sht = sht_handle(self.h, self.w, lmax=modes_lat, mmax=modes_lon, grid=sht_grid_type).float()
-        self.isht = isht_handle(self.h, self.w, lmax=modes_lat, mmax=modes_lon, grid=sht_grid_type).float()
+        # set up. The SHTs are taken from the global registry to share the precomputed weights
+        self.sht = get_spectral_transform(sht_handle, self.h, self.w, lmax=modes_lat, mmax=modes_lon, grid=sht_grid_type, dtype=torch.float32)
+        self.isht = get_spectral_transform(isht_handle, self.h, self.w, lmax=modes_lat, mmax=modes_lon, grid=sht_grid_type, dtype=torch.float32)
 
     @torch.compiler.disable(recursive=True)
     def _get_norm_layer_handle(
@@ -24,8 +24,69 @@ import torch_harmonics as th
 import torch_harmonics.distributed as thd
 
 from makani.utils import comm
+from makani.models.common import get_spectral_transform
 from physicsnemo.distributed.utils import split_tensor_along_dim, compute_split_shapes
 
+# constants of the Philox4x32-10 counter-based generator
+_PHILOX_M0 = 0xD2511F53
+_PHILOX_M1 = 0xCD9E8D57
+_PHILOX_W0 = 0x9E3779B9
+_PHILOX_W1 = 0xBB67AE85
+_MASK32 = 0xFFFFFFFF
+_MASK16 = 0xFFFF
+
+
+def _mulhilo32(a, b):
+    """
+    helper routine which computes the high and low 32 bits of the product of 32 bit integers stored in int64 tensors.
+    The product is assembled from 16 bit limbs, so that no intermediate result overflows the signed 64 bit range
+    """
+    a0, a1 = a & _MASK16, a >> 16
+    b0, b1 = b & _MASK16, b >> 16
+    t = a0 * b0
+    m = a1 * b0 + a0 * b1 + (t >> 16)
+    lo = ((m & _MASK16) << 16) | (t & _MASK16)
+    hi = a1 * b1 + (m >> 16)
+    return hi, lo
+
+
+def _philox4x32(c0, c1, c2, c3, k0, k1, rounds=10):
+    """Philox4x32 bijection, see Salmon et al.; Parallel Random Numbers: As Easy as 1, 2, 3; SC 2011"""
+    for _ in range(rounds):
+        hi0, lo0 = _mulhilo32(c0, _PHILOX_M0)
+        hi1, lo1 = _mulhilo32(c2, _PHILOX_M1)
+        c0, c1, c2, c3 = hi1 ^ c1 ^ k0, lo1, hi0 ^ c3 ^ k1, lo0
+        k0 = (k0 + _PHILOX_W0) & _MASK32
+        k1 = (k1 + _PHILOX_W1) & _MASK32
+    return c0, c1, c2, c3
+
+
+def philox_normal(shape, seed: int, step: int, stream_offset: int = 0, device=None) -> torch.Tensor:
+    r"""
+    Counter-based standard normal samples. The leading dimension of shape enumerates independent streams, e.g. batch or ensemble
+    members. Each sample is a pure function of (seed, step, stream, index), so that all streams are generated in a single batched
+    call and any step can be reproduced from the seed and the step counter alone, without saving generator state. The samples do
+    not depend on the device.
+    """
+    num_streams = shape[0]
+    numel = math.prod(shape[1:])
+
+    # one Philox evaluation yields four 32 bit integers, i.e. two Box-Muller pairs
+    num_counters = (numel + 3) // 4
+    c0 = torch.arange(num_counters, dtype=torch.int64, device=device).unsqueeze(0).expand(num_streams, num_counters)
+    c1 = torch.full_like(c0, step & _MASK32)
+    c2 = ((torch.arange(num_streams, dtype=torch.int64, device=device) + stream_offset) & _MASK32).unsqueeze(1).expand(num_streams, num_counters)
+    c3 = torch.full_like(c0, (step >> 32) & _MASK32)
+    x0, x1, x2, x3 = _philox4x32(c0, c1, c2, c3, seed & _MASK32, (seed >> 32) & _MASK32)
+
+    # convert to uniforms in (0, 1) using the upper 24 bits and apply Box-Muller
+    u = (torch.stack([x0, x1, x2, x3], dim=-1) >> 8).to(torch.float32).add_(0.5).mul_(2.0**-24)
+    r = torch.sqrt(-2.0 * torch.log(u[..., 0::2]))
+    theta = 2.0 * math.pi * u[..., 1::2]
+    z = torch.stack([r * torch.cos(theta), r * torch.sin(theta)], dim=-1)
+
+    return z.reshape(num_streams, -1)[:, :numel].reshape(shape)
+
 
 class BaseNoiseS2(nn.Module):
     def __init__(
@@ -37,14 +98,22 @@ class BaseNoiseS2(nn.Module):
         grid_type="equiangular",
         seed=333,
         reflect=False,
+        rng_type="torch",
         **kwargs,
     ):
         r"""
         Abstract base class for noise on the sphere. Initializes the inverse SHT needed by many of the
         noise classes. Derived noise classes can be stateful or stateless.
+
+        With rng_type="philox", the noise is drawn from counter-based streams, one per batch entry. The random state then
+        consists of the seed and the step counter only.
         """
         super().__init__()
 
+        if rng_type not in ["torch", "philox"]:
+            raise NotImplementedError(f"Error, rng type {rng_type} not supported.")
+        self.rng_type = rng_type
+
         # Number of latitudinal modes.
         self.nlat, self.nlon = img_shape
         self.num_channels = num_channels
@@ -57,13 +126,13 @@ class BaseNoiseS2(nn.Module):
                 polar_group = None if (comm.get_size("h") == 1) else comm.get_group("h")
                 azimuth_group = None if (comm.get_size("w") == 1) else comm.get_group("w")
                 thd.init(polar_group, azimuth_group)
-            self.isht = thd.DistributedInverseRealSHT(self.nlat, self.nlon, grid=grid_type)
+            self.isht = get_spectral_transform(thd.DistributedInverseRealSHT, self.nlat, self.nlon, grid=grid_type, dtype=torch.float32)
             self.lmax_local = self.isht.l_shapes[comm.get_rank("h")]
             self.mmax_local = self.isht.m_shapes[comm.get_rank("w")]
             self.nlat_local = self.isht.lat_shapes[comm.get_rank("h")]
             self.nlon_local = self.isht.lon_shapes[comm.get_rank("w")]
         else:
-            self.isht = th.InverseRealSHT(self.nlat, self.nlon, grid=grid_type)
+            self.isht = get_spectral_transform(th.InverseRealSHT, self.nlat, self.nlon, grid=grid_type, dtype=torch.float32)
             self.lmax_local = self.isht.lmax
             self.mmax_local = self.isht.mmax
             self.nlat_local = self.nlat
@@ -82,6 +151,8 @@ class BaseNoiseS2(nn.Module):
         raise NotImplementedError("is_stateful method not implemented for this noise class")
 
     def set_rng(self, seed=333):
+        self.seed = seed
+        self.rng_step = 0
         self.rng_cpu = torch.Generator(device=torch.device("cpu"))
         self.rng_cpu.manual_seed(seed)
         if torch.cuda.is_available():
@@ -98,6 +169,18 @@ class BaseNoiseS2(nn.Module):
             with torch.no_grad():
                 self.state.fill_(0.0)
 
+    # fills the tensor in place with standard normal samples
+    def _sample_normal_(self, out):
+        if self.rng_type == "philox":
+            out.copy_(philox_normal(out.shape, seed=self.seed, step=self.rng_step, device=out.device))
+            self.rng_step += 1
+        elif out.is_cuda:
+            out.normal_(mean=0.0, std=1.0, generator=self.rng_gpu)
+        else:
+            out.normal_(mean=0.0, std=1.0, generator=self.rng_cpu)
+
+        return out
+
     # this routine generates a noise sample for a single time step and updates the state accordingly, by appending the last time step
     def update(self, replace_state=False, batch_size=None):
         # Update should always create a new state, so 
@@ -106,23 +189,25 @@ class BaseNoiseS2(nn.Module):
         with torch.no_grad():
             if batch_size is None:
                 batch_size = self.state.shape[0]
-            newstate = torch.empty((batch_size, self.num_time_steps, self.num_channels, self.lmax_local, self.mmax_local, 2), dtype=self.state.dtype, device=self.state.device)
-            if self.state.is_cuda:
-                newstate.normal_(mean=0.0, std=1.0, generator=self.rng_gpu)
-            else:
-                newstate.normal_(mean=0.0, std=1.0, generator=self.rng_cpu)
 
-            if self.reflect:
-                newstate = -newstate
+            # only reallocate if the batch size changes, otherwise sample directly into the state
+            if batch_size != self.state.shape[0]:
+                self.state = torch.empty((batch_size, self.num_time_steps, self.num_channels, self.lmax_local, self.mmax_local, 2), dtype=self.state.dtype, device=self.state.device)
 
-            if newstate.shape == self.state.shape:
-                self.state.copy_(newstate)
-            else:
-                self.state = newstate
+            self._sample_normal_(self.state)
+
+            if self.reflect:
+                self.state.neg_()
 
         return
 
     def set_rng_state(self, cpu_state, gpu_state):
+        # the philox state is the seed and the step counter
+        if self.rng_type == "philox":
+            if cpu_state is not None:
+                self.seed, self.rng_step = [int(v) for v in cpu_state.tolist()]
+            return
+
         if cpu_state is not None:
             self.rng_cpu.set_state(cpu_state)
         if torch.cuda.is_available() and (gpu_state is not None):
@@ -131,6 +216,9 @@ class BaseNoiseS2(nn.Module):
         return
 
     def get_rng_state(self):
+        if self.rng_type == "philox":
+            return torch.tensor([self.seed, self.rng_step], dtype=torch.int64), None
+
         cpu_state = self.rng_cpu.get_state()
         gpu_state = None
         if torch.cuda.is_available():
@@ -160,6 +248,7 @@ class IsotropicGaussianRandomFieldS2(BaseNoiseS2):
         seed=333,
         reflect=False,
         learnable =False,
+        rng_type="torch",
         **kwargs,
     ):
         r"""
@@ -186,8 +275,10 @@ class IsotropicGaussianRandomFieldS2(BaseNoiseS2):
             "legendre-gauss".
         learnable : bool, default is False
             Parameter which enables learnable Gaussian noise
+        rng_type : string, default is "torch"
+            Random number generator. Either "torch" or the counter-based "philox"
         """
-        super().__init__(img_shape=img_shape, batch_size=batch_size, num_channels=num_channels, num_time_steps=num_time_steps, grid_type=grid_type, seed=seed, reflect=reflect)
+        super().__init__(img_shape=img_shape, batch_size=batch_size, num_channels=num_channels, num_time_steps=num_time_steps, grid_type=grid_type, seed=seed, reflect=reflect, rng_type=rng_type)
 
         if not isinstance(alpha, float):
             alpha = float(alpha)
@@ -216,8 +307,12 @@ class IsotropicGaussianRandomFieldS2(BaseNoiseS2):
 
     def forward(self, update_internal_state=False):
 
-        # combine channels and time:
-        cstate = torch.view_as_complex(self.state / math.sqrt(2)) * self.sigma_l
+        # combine channels and time, the normalization is folded into the sigma_l scaling of the ISHT input. If sigma_l is
+        # learned, the scaled state is saved for backward and therefore has to be decoupled from the state, which is updated in place
+        if self.sigma_l.requires_grad:
+            cstate = torch.view_as_complex(self.state / math.sqrt(2)) * self.sigma_l
+        else:
+            cstate = torch.view_as_complex(self.state) * (self.sigma_l / math.sqrt(2))
         batch_size = cstate.shape[0]
 
         # flatten history
@@ -254,6 +349,20 @@ def toep(c, r=None):
     return np.lib.stride_tricks.as_strided(vals[len(c) - 1 :], shape=out_shp, strides=(-n, n)).copy()
 
 
+def _diffusion_update_(state: torch.Tensor, eta: torch.Tensor, phi: torch.Tensor, sigma_l: torch.Tensor, sign: float = 1.0):
+    """
+    In-place AR(1) update of the diffusion noise state of shape (B, T, C, L, M, 2): the history is shifted by one step and the
+    new last step is computed as phi * state[:, -1] + sign * sigma_l * eta[:, 0], without allocating intermediate tensors.
+    """
+    # shift the history one step at a time, since copies between overlapping memory are not allowed
+    for t in range(state.shape[1] - 1):
+        state[:, t].copy_(state[:, t + 1])
+
+    state[:, -1].mul_(phi).addcmul_(sigma_l[:, 0], eta[:, 0], value=sign)
+
+    return state
+
+
 class DiffusionNoiseS2(BaseNoiseS2):
     def __init__(
         self,
@@ -268,6 +377,7 @@ class DiffusionNoiseS2(BaseNoiseS2):
         seed=333,
         reflect=False,
         learnable =False,
+        rng_type="torch",
         **kwargs,
     ):
         r"""
@@ -294,8 +404,13 @@ class DiffusionNoiseS2(BaseNoiseS2):
             "legendre-gauss".
         learnable : bool, default is False
             Parameter which enables learnable Diffusion noise
+        rng_type : string, default is "torch"
+            Random number generator. Either "torch" or the counter-based "philox"
         """
-        super().__init__(img_shape=img_shape, batch_size=batch_size, num_channels=num_channels, num_time_steps=num_time_steps, grid_type=grid_type, seed=seed, reflect=reflect)
+        super().__init__(img_shape=img_shape, batch_size=batch_size, num_channels=num_channels, num_time_steps=num_time_steps, grid_type=grid_type, seed=seed, reflect=reflect, rng_type=rng_type)
+
+        # preallocated buffer for the innovations
+        self.eta = None
 
         # Compute l:
         ls = torch.arange(self.lmax)
@@ -365,14 +480,12 @@ class DiffusionNoiseS2(BaseNoiseS2):
             if learnable:
                 raise NotImplementedError(f"num_time_steps>1 learnable diffusion noise not supported")
 
-            discount = []
-            phi_flat = self.phi.reshape(-1)
-            for phi_tmp in phi_flat.tolist():
-                phivec = np.power(phi_tmp, np.arange(0, self.num_time_steps))
-                disc = torch.as_tensor(toep(phivec, np.zeros(self.num_time_steps)))
-                disc = disc.to(dtype=torch.float32)
-                discount.append(disc)
-            discount = torch.stack(discount, dim=0)
+            # closed form for all channels at once: discount[c, t, r] = phi_c^(t - r) for t >= r and 0 otherwise
+            phi_flat = self.phi.detach().reshape(-1, 1, 1).to(dtype=torch.float64)
+            steps = torch.arange(self.num_time_steps)
+            lag = steps.reshape(-1, 1) - steps.reshape(1, -1)
+            discount = torch.where(lag >= 0, torch.pow(phi_flat, lag.clamp(min=0)), 0.0)
+            discount = discount.to(dtype=torch.float32)
             self.register_buffer("discount", discount, persistent=False)
 
     def is_stateful(self):
@@ -387,18 +500,25 @@ class DiffusionNoiseS2(BaseNoiseS2):
                 nsteps = self.num_time_steps if replace_state else 1
                 if batch_size is None:
                     batch_size = self.state.shape[0]
-                eta_l = torch.empty((batch_size, nsteps, self.num_channels, self.lmax_local, self.mmax_local, 2), dtype=torch.float32, device=self.state.device)
-                if self.state.is_cuda:
-                    eta_l.normal_(mean=0.0, std=1.0, generator=self.rng_gpu)
-                else:
-                    eta_l.normal_(mean=0.0, std=1.0, generator=self.rng_cpu)
 
-                # multiply by sigma
-                eta_l = self.sigma_l * eta_l
+                # sample into the preallocated buffer, which holds enough time steps for a full replacement
+                eta_shape = (batch_size, self.num_time_steps, self.num_channels, self.lmax_local, self.mmax_local, 2)
+                if (self.eta is None) or (tuple(self.eta.shape) != eta_shape) or (self.eta.device != self.state.device):
+                    self.eta = torch.empty(eta_shape, dtype=torch.float32, device=self.state.device)
+                eta_l = self._sample_normal_(self.eta[:, :nsteps, ...])
 
                 # reflect if required:
+                sign = -1.0 if self.reflect else 1.0
+
+                if (not replace_state) and (self.state.shape[0] == batch_size):
+                    # fused in-place AR(1) update of the state
+                    _diffusion_update_(self.state, eta_l, self.phi, self.sigma_l, sign)
+                    return
+
+                # multiply by sigma
+                eta_l.mul_(self.sigma_l)
                 if self.reflect:
-                    eta_l = -eta_l
+                    eta_l.neg_()
 
                 if not replace_state:
                     # update previous state
@@ -411,16 +531,18 @@ class DiffusionNoiseS2(BaseNoiseS2):
                 else:
                     newstate = eta_l
                     # the very first element in the time history requires a different weighting to sample the stationary distribution
-                    newstate[:, 0, ...] = newstate[:, 0, ...] / torch.sqrt(1.0 - self.phi**2)
+                    newstate[:, 0, ...].div_(torch.sqrt(1.0 - self.phi**2))
                     # get the right history by multiplying with the discount matrix
                     if self.num_time_steps > 1:
                         newstate = torch.einsum("ctr,brclmu->btclmu", self.discount, newstate).contiguous()
 
-                # update the state
-                if newstate.shape == self.state.shape:
+                # update the state. The innovation buffer must not be aliased by the state
+                if newstate is self.state:
+                    pass
+                elif newstate.shape == self.state.shape:
                     self.state.copy_(newstate)
                 else:
-                    self.state = newstate
+                    self.state = newstate.clone()
 
         return
 
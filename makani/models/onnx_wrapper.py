@@ -15,6 +15,8 @@
 
 import os
 import sys
+import queue
+from contextlib import contextmanager
 import numpy as np
 from typing import Union
 import torch
@@ -24,15 +26,30 @@ import torch.nn as nn
 import onnx
 
 
+# numpy element types of the tensors bound to the sessions
+_NP_DTYPES = {
+    torch.float32: np.float32,
+    torch.float16: np.float16,
+    torch.float64: np.float64,
+    torch.int32: np.int32,
+    torch.int64: np.int64,
+}
+
+
 class OnnxWrapper(nn.Module):
     """
     A torch.nn.Module wrapper that runs inference on an ONNX model
     Args:
         onnx_file: File containing the onnx weights
+        onnx_io_binding: Bind the memory of the torch tensors directly to the session inputs and outputs instead of converting them to and from numpy arrays
+        onnx_num_sessions: Number of sessions per device. Concurrent calls each acquire a session from the pool
+        onnx_reuse_outputs: Reuse the output buffers between calls. Two sets of buffers are alternated, so that the output of one call can be passed as input to the next one,
+            as is the case in autoregressive rollouts. Outputs have to be copied if they are needed for longer.
+        onnx_intra_op_num_threads: Number of threads used by each session
     """
     _onnxruntime=None
 
-    def __init__(self,onnx_file, **kwargs):
+    def __init__(self, onnx_file, onnx_io_binding=True, onnx_num_sessions=1, onnx_reuse_outputs=False, onnx_intra_op_num_threads=1, **kwargs):
         super(OnnxWrapper,self).__init__()
 
         # Lazy import onnxruntime
@@ -41,6 +58,16 @@ class OnnxWrapper(nn.Module):
             OnnxWrapper._onnxruntime=onnxruntime
         self.ort=OnnxWrapper._onnxruntime
 
+        self.io_binding = onnx_io_binding
+        self.num_sessions = onnx_num_sessions
+        self.reuse_outputs = onnx_reuse_outputs
+
+        # buffers which are reused between calls, keyed by session, tag, shapes and device
+        self._buffers = {}
+
+        # output shapes for each set of input shapes, inferred on the first call
+        self._output_shapes = {}
+
         #Initialize inference session
         
         self.options = self.ort.SessionOptions()
@@ -48,30 +75,67 @@ class OnnxWrapper(nn.Module):
         self.options.enable_mem_pattern = False
         self.options.enable_mem_reuse = False
         # Increase the number for faster inference and more memory consumption
-        self.options.intra_op_num_threads = 1
+        self.options.intra_op_num_threads = onnx_intra_op_num_threads
         self.cuda_provider_options = {'arena_extend_strategy':'kSameAsRequested',}
 
         self.load_onnx_session(onnx_file)
-       
+
+    def _create_session_pool(self, providers):
+        sessions = [self.ort.InferenceSession(self.onnx_file, sess_options=self.options, providers=providers) for _ in range(self.num_sessions)]
+
+        pool = queue.Queue()
+        for session in sessions:
+            pool.put(session)
+
+        return sessions[0], pool
+
     def load_onnx_session(self,onnx_file):
         self.onnx_file=onnx_file
 
         # Check if cuda is available to initialize a CUDA onnxruntime        
         if  torch.cuda.is_available():
-            self.gpu_session=self.ort.InferenceSession(self.onnx_file,sess_options=self.options, providers=[('CUDAExecutionProvider', self.cuda_provider_options)])
+            self.gpu_session, self.gpu_pool = self._create_session_pool([('CUDAExecutionProvider', self.cuda_provider_options)])
         else:
-            self.gpu_session=None
+            self.gpu_session, self.gpu_pool = None, None
         
-        self.cpu_session=self.ort.InferenceSession(self.onnx_file,sess_options=self.options, providers=[('CPUExecutionProvider', self.cuda_provider_options)])
+        self.cpu_session, self.cpu_pool = self._create_session_pool([('CPUExecutionProvider', self.cuda_provider_options)])
 
+        self._buffers.clear()
+        self._output_shapes.clear()
 
-    def onnx_session_run(self,inputs):
-        input_device=next(iter(inputs.values())).device
-        if (self.gpu_session is not None) and input_device!=torch.device('cpu'):
-            onnx_session=self.gpu_session
+    @contextmanager
+    def acquire_session(self, device):
+        """takes a session for the given device from the pool and returns it once the caller is done"""
+        if (self.gpu_pool is not None) and device != torch.device('cpu'):
+            pool = self.gpu_pool
         else:
-            onnx_session=self.cpu_session
+            pool = self.cpu_pool
+
+        session = pool.get()
+        try:
+            yield session
+        finally:
+            pool.put(session)
+
+    def get_buffers(self, session, tag, shapes, device, dtype=torch.float32, double_buffered=False):
+        """
+        returns a list of buffers with the requested shapes which is owned by the session. With double buffering, two
+        sets of buffers are alternated between calls
+        """
+        key = (id(session), tag, tuple(tuple(shape) for shape in shapes), str(device), dtype)
+
+        entry = self._buffers.get(key, None)
+        if entry is None:
+            entry = [[torch.empty(shape, dtype=dtype, device=device) for shape in shapes] for _ in range(2 if double_buffered else 1)]
+            self._buffers[key] = entry
 
+        # rotate the sets of buffers
+        buffers = entry.pop(0)
+        entry.append(buffers)
+
+        return buffers
+
+    def _session_run_numpy(self, onnx_session, inputs, input_device):
         for key in inputs.keys():
             inputs[key]=inputs[key].cpu().detach().numpy().astype(np.float32)
                     
@@ -81,4 +145,84 @@ class OnnxWrapper(nn.Module):
         for output in outputs:
             output_tensor_list.append(torch.from_numpy(output).to(input_device))
 
-        return output_tensor_list
\ No newline at end of file
+        return output_tensor_list
+
+    @staticmethod
+    def _can_bind(onnx_session, input_device):
+        """
+        memory can only be bound on the device the session runs on. Sessions which fell back to the CPU provider, e.g. with a
+        CPU-only build of onnxruntime, cannot bind CUDA tensors
+        """
+        if input_device.type == "cuda":
+            return "CUDAExecutionProvider" in onnx_session.get_providers()
+        return input_device.type == "cpu"
+
+    def _session_run_io_binding(self, onnx_session, inputs, input_device, outputs=None):
+        if input_device.type == "cuda":
+            device_type, device_id = "cuda", (input_device.index if input_device.index is not None else torch.cuda.current_device())
+        else:
+            device_type, device_id = "cpu", 0
+
+        binding = onnx_session.io_binding()
+
+        # bind the memory of the inputs directly. The converted tensors are kept alive until the session has run
+        inputs = {key: inp.detach().to(device=input_device, dtype=torch.float32).contiguous() for key, inp in inputs.items()}
+        for key, inp in inputs.items():
+            binding.bind_input(key, device_type, device_id, _NP_DTYPES[inp.dtype], list(inp.shape), inp.data_ptr())
+
+        output_names = [out.name for out in onnx_session.get_outputs()]
+        shapes_key = tuple((key, tuple(inp.shape)) for key, inp in inputs.items())
+        output_shapes = self._output_shapes.get(shapes_key, None)
+
+        # allocate or reuse the output buffers if the output shapes are known
+        if (outputs is None) and (output_shapes is not None):
+            if self.reuse_outputs:
+                outputs = self.get_buffers(onnx_session, "outputs", output_shapes, input_device, double_buffered=True)
+            else:
+                outputs = [torch.empty(shape, dtype=torch.float32, device=input_device) for shape in output_shapes]
+
+        if outputs is not None:
+            for key, out in zip(output_names, outputs):
+                if not out.is_contiguous():
+                    raise ValueError(f"Output buffer for {key} has to be contiguous")
+                binding.bind_output(key, device_type, device_id, _NP_DTYPES[out.dtype], list(out.shape), out.data_ptr())
+        else:
+            # the shapes are unknown, let onnxruntime allocate the outputs once
+            for key in output_names:
+                binding.bind_output(key, device_type, device_id)
+
+        # onnxruntime does not know about the torch stream
+        if input_device.type == "cuda":
+            torch.cuda.current_stream(input_device).synchronize()
+
+        onnx_session.run_with_iobinding(binding)
+        binding.synchronize_outputs()
+
+        if outputs is None:
+            outputs = [torch.from_numpy(out.numpy()).to(input_device) for out in binding.get_outputs()]
+            self._output_shapes[shapes_key] = [tuple(out.shape) for out in outputs]
+
+        return list(outputs)
+
+    def onnx_session_run(self, inputs, outputs=None, session=None):
+        """
+        Runs the session on a dictionary of input tensors and returns the list of output tensors. With IO binding, outputs can
+        be a list of preallocated, contiguous tensors which the session writes to. A session acquired by the caller can be passed
+        as well, otherwise one is taken from the pool.
+        """
+        input_device=next(iter(inputs.values())).device
+
+        if session is None:
+            with self.acquire_session(input_device) as session:
+                return self.onnx_session_run(inputs, outputs=outputs, session=session)
+
+        if self.io_binding and self._can_bind(session, input_device):
+            output_tensor_list = self._session_run_io_binding(session, inputs, input_device, outputs=outputs)
+        else:
+            output_tensor_list = self._session_run_numpy(session, inputs, input_device)
+            if outputs is not None:
+                for out, res in zip(outputs, output_tensor_list):
+                    out.copy_(res)
+                output_tensor_list = list(outputs)
+
+        return output_tensor_list
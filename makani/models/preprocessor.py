@@ -25,7 +25,7 @@ from makani.utils import comm
 from makani.utils.grids import GridConverter
 from physicsnemo.distributed.mappings import reduce_from_parallel_region, copy_to_parallel_region
 
-from makani.models.preprocessor_helpers import get_bias_correction, get_static_features
+from makani.models.preprocessor_helpers import get_bias_correction, get_static_features, HistoryBuffer
 
 
 class Preprocessor2D(nn.Module):
@@ -70,6 +70,9 @@ class Preprocessor2D(nn.Module):
         self.unpredicted_inp_eval = None
         self.unpredicted_tar_eval = None
 
+        # circular buffers for the history windows
+        self.history_buffers = []
+
         # get bias correction
         bias = get_bias_correction(params)
 
@@ -135,7 +138,8 @@ class Preprocessor2D(nn.Module):
                     grid_type=params.model_grid_type,
                     seed=self.noise_base_seed,
                     reflect=reflect,
-                    learnable=noise_params.get("learnable", False)
+                    learnable=noise_params.get("learnable", False),
+                    rng_type=noise_params.get("rng_type", "torch"),
                 )
             elif noise_params["type"] == "white":
                 from makani.models.noise import IsotropicGaussianRandomFieldS2
@@ -150,7 +154,8 @@ class Preprocessor2D(nn.Module):
                     grid_type=params.model_grid_type,
                     seed=self.noise_base_seed,
                     reflect=reflect,
-                    learnable=noise_params.get("learnable", False)
+                    learnable=noise_params.get("learnable", False),
+                    rng_type=noise_params.get("rng_type", "torch"),
                 )
             elif noise_params["type"] == "dummy":
                 from makani.models.noise import DummyNoiseS2
@@ -207,6 +212,25 @@ class Preprocessor2D(nn.Module):
             x = x[:, : x.shape[1] - nfeat, :, :]
         return x
 
+    def _append_history_buffered(self, x1, x2):
+        r"""
+        Appends x2 to the history window x1 using a circular buffer, which only copies a single frame. If x1 is the current
+        window of one of the buffers, the frame is appended in place, otherwise a free buffer is initialized from x1.
+        The returned window aliases the buffer, x1 must not be used anymore afterwards.
+        """
+        buffer = next((b for b in self.history_buffers if b.is_window(x1)), None)
+
+        if buffer is None:
+            buffer = next((b for b in self.history_buffers if b.is_free() and b.matches(x1)), None)
+            if buffer is None:
+                buffer = HistoryBuffer(x1, self.n_history + 1)
+                self.history_buffers.append(buffer)
+            buffer.reset(x1)
+
+        buffer.append(x2)
+
+        return buffer.window()
+
     def append_history(self, x1, x2, step, update_state=True):
         r"""
         Take care of unpredicted features first. This is necessary in order to copy the targets unpredicted features
@@ -231,7 +255,10 @@ class Preprocessor2D(nn.Module):
                     else:
                         self.unpredicted_inp_eval.copy_(torch.cat([self.unpredicted_inp_eval[:, 1:, :, :, :], utar], dim=1))
 
-        if self.n_history > 0:
+        # in-place updates of the history are only possible if no gradients are required
+        if (self.n_history > 0) and not (torch.is_grad_enabled() and (x1.requires_grad or x2.requires_grad)):
+            res = self._append_history_buffered(x1, x2)
+        elif self.n_history > 0:
             # this is more complicated
             x1 = self.expand_history(x1, nhist=self.n_history + 1)
             x2 = self.expand_history(x2, nhist=1)
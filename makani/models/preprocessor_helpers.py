@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import os
+import weakref
 from functools import partial
 import torch
 
@@ -234,4 +235,77 @@ def get_static_features(params):
             else:
                 static_features = torch.cat([static_features, emb], dim=1)
 
-    return static_features
\ No newline at end of file
+    return static_features
+
+
+class HistoryBuffer(object):
+    """
+    Preallocated circular buffer for a history window of num_frames frames. Each frame is stored twice, at slot i and slot
+    i + num_frames, so that the current window is always a contiguous slice of the buffer and can be returned as a view,
+    in flattened form if requested. Appending a frame therefore only copies a single frame instead of the whole window.
+
+    The returned window aliases the buffer and becomes invalid once the next frame is appended. The buffer keeps a weak
+    reference to the last returned window, together with a generation counter which is incremented on every update of
+    the buffer. This allows to detect whether a tensor is the current window of this buffer. Version counters cannot be
+    used for this purpose, since inference tensors do not track them. In-place modifications of the window are safe, as
+    the mirrored slots of a modified frame are only read after the frame has been replaced.
+    """
+
+    def __init__(self, x: torch.Tensor, num_frames: int):
+        self.num_frames = num_frames
+        self.flat = x.dim() == 4
+        self.shape = tuple(x.shape)
+        x = self._expand(x)
+        b_, t_, c_, h_, w_ = x.shape
+        self.buffer = torch.empty((b_, 2 * t_, c_, h_, w_), dtype=x.dtype, device=x.device)
+        self.start = 0
+        self.generation = 0
+        self.window_ref = None
+        self.window_generation = None
+
+    def _expand(self, x):
+        if x.dim() == 4:
+            b_, ct_, h_, w_ = x.shape
+            x = torch.reshape(x, (b_, self.num_frames, ct_ // self.num_frames, h_, w_))
+        return x
+
+    def _is_writable(self) -> bool:
+        # inference tensors can only be updated in place within inference mode
+        return torch.is_inference_mode_enabled() or not self.buffer.is_inference()
+
+    def matches(self, x: torch.Tensor) -> bool:
+        return (tuple(x.shape) == self.shape) and (x.dtype == self.buffer.dtype) and (x.device == self.buffer.device) and self._is_writable()
+
+    def is_free(self) -> bool:
+        return (self.window_ref is None) or (self.window_ref() is None)
+
+    def is_window(self, x: torch.Tensor) -> bool:
+        return (self.window_ref is not None) and (self.window_ref() is x) and (self.window_generation == self.generation) and self._is_writable()
+
+    @torch.no_grad()
+    def reset(self, x: torch.Tensor):
+        x = self._expand(x)
+        self.buffer[:, : self.num_frames].copy_(x)
+        self.buffer[:, self.num_frames :].copy_(x)
+        self.start = 0
+        self.generation += 1
+        self.window_ref = None
+        return
+
+    @torch.no_grad()
+    def append(self, frame: torch.Tensor):
+        # the oldest frame sits in slot start and is replaced by the new frame in both copies
+        frame = torch.reshape(frame, self.buffer[:, 0].shape)
+        self.buffer[:, self.start].copy_(frame)
+        self.buffer[:, self.start + self.num_frames].copy_(frame)
+        self.start = (self.start + 1) % self.num_frames
+        self.generation += 1
+        return
+
+    def window(self) -> torch.Tensor:
+        x = self.buffer[:, self.start : self.start + self.num_frames]
+        if self.flat:
+            x = torch.reshape(x, self.shape)
+        self.window_ref = weakref.ref(x)
+        self.window_generation = self.generation
+        return x
@@ -13,12 +13,58 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from contextlib import nullcontext
+
 import torch
 import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
 
 from makani.models.preprocessor import Preprocessor2D
 
 
+class ActivationOffloadHooks(torch.autograd.graph.saved_tensors_hooks):
+    """
+    Saved tensor hooks which move the activations saved for the backward pass to pinned host memory. The device to host
+    copies are issued on a side stream, so that they overlap with the forward pass of the following rollout steps. The
+    device memory is released as soon as the copy has finished. The host to device copy is issued on the compute stream
+    once the activation is needed in the backward pass. Pinned buffers are recycled by the caching host allocator.
+    Parameters, small tensors and tensors which do not reside on the GPU are kept as they are.
+    """
+
+    def __init__(self, min_numel=1024):
+        self.stream = None
+
+        def pack(tensor):
+            if (not tensor.is_cuda) or isinstance(tensor, nn.Parameter) or (tensor.numel() < min_numel):
+                return tensor
+
+            if self.stream is None:
+                self.stream = torch.cuda.Stream(device=tensor.device)
+
+            # the copy has to wait for the computation of the tensor
+            self.stream.wait_stream(torch.cuda.current_stream(tensor.device))
+            packed = torch.empty(tensor.size(), dtype=tensor.dtype, layout=tensor.layout, pin_memory=True)
+            with torch.cuda.stream(self.stream):
+                packed.copy_(tensor, non_blocking=True)
+
+            # keep the device memory from being reused before the copy has finished
+            tensor.record_stream(self.stream)
+            event = self.stream.record_event()
+
+            return (tensor.device, packed, event)
+
+        def unpack(packed):
+            if not isinstance(packed, tuple):
+                return packed
+
+            device, tensor, event = packed
+            torch.cuda.current_stream(device).wait_event(event)
+
+            return tensor.to(device, non_blocking=True)
+
+        super().__init__(pack, unpack)
+
+
 class SingleStepWrapper(nn.Module):
     def __init__(self, params, model_handle):
         super().__init__()
@@ -66,6 +112,26 @@ class MultiStepWrapper(nn.Module):
         # collect parameters for history
         self.n_future = params.n_future
 
+        # memory saving options for long rollouts:
+        # truncate the gradient flow through the rollout every truncation_steps steps (0 means no truncation)
+        self.truncation_steps = params.get("multistep_truncation_steps", 0)
+        # recompute the model activations of each step in the backward pass
+        self.checkpointing = params.get("multistep_checkpointing", False)
+        # offload the saved activations to host memory, except for the last offload_keep_steps steps, which are needed first in the backward pass
+        self.activation_offload = params.get("multistep_activation_offload", False)
+        self.offload_keep_steps = params.get("multistep_offload_keep_steps", 1)
+        self.offload_hooks = ActivationOffloadHooks() if self.activation_offload else None
+
+    def _offload_context(self, step):
+        if self.activation_offload and (step < self.n_future + 1 - self.offload_keep_steps):
+            return self.offload_hooks
+        return nullcontext()
+
+    def _model_forward(self, inp):
+        if self.checkpointing and torch.is_grad_enabled():
+            return checkpoint(self.model, inp, use_reentrant=False)
+        return self.model(inp)
+
     def _forward_train(self, inp, update_state=True, replace_state=True):
         result = []
         inpt = inp
@@ -77,33 +143,34 @@ class MultiStepWrapper(nn.Module):
         # do the rollout
         for step in range(self.n_future + 1):
 
-            # in push-forward mode, we need to detach the tensor:
-            if self.push_forward_mode:
+            # in push-forward mode, we need to detach the tensor. With truncation, we only detach every truncation_steps steps:
+            if self.push_forward_mode or ((self.truncation_steps > 0) and (step > 0) and (step % self.truncation_steps == 0)):
                 inpt = inpt.detach()
 
-            # add unpredicted features
-            inpa = self.preprocessor.append_unpredicted_features(inpt)
+            with self._offload_context(step):
+                # add unpredicted features
+                inpa = self.preprocessor.append_unpredicted_features(inpt)
 
-            # do history normalization
-            self.preprocessor.history_compute_stats(inpa)
-            inpan = self.preprocessor.history_normalize(inpa, target=False)
+                # do history normalization
+                self.preprocessor.history_compute_stats(inpa)
+                inpan = self.preprocessor.history_normalize(inpa, target=False)
 
-            # add static features
-            inpans = self.preprocessor.add_static_features(inpan)
+                # add static features
+                inpans = self.preprocessor.add_static_features(inpan)
 
-            # prediction
-            predn = self.model(inpans)
+                # prediction
+                predn = self._model_forward(inpans)
 
-            # perform bias correction if requested
-            predn = self.preprocessor.correct_bias(predn)
+                # perform bias correction if requested
+                predn = self.preprocessor.correct_bias(predn)
 
-            # append the denormalized result to output list
-            # important to do that here, otherwise normalization stats
-            # will have been updated later:
-            pred = self.preprocessor.history_denormalize(predn, target=True)
+                # append the denormalized result to output list
+                # important to do that here, otherwise normalization stats
+                # will have been updated later:
+                pred = self.preprocessor.history_denormalize(predn, target=True)
 
-            # add residual (for residual learning, no-op for direct learning
-            pred = self.preprocessor.add_residual(inpt, pred)
+                # add residual (for residual learning, no-op for direct learning
+                pred = self.preprocessor.add_residual(inpt, pred)
 
             # append output
             result.append(pred)
@@ -14,8 +14,10 @@
 # limitations under the License.
 
 import sys
+import math
 
 import torch
+import torch.distributed as dist
 import torch.nn as nn
 
 from functools import partial
@@ -121,11 +123,40 @@ class StochasticInterpolantWrapper(nn.Module):
     During training, the module
 
     [1] Chen et al.; Probabilistic forecasting with stochastic interpolants and Follmer Processes
+
+    During inference, the SDE is integrated with one of the following samplers:
+        - "euler": Euler-Maruyama with n_steps equidistant steps, as in [1]
+        - "heun": stochastic Heun (predictor-corrector) with n_steps equidistant steps
+        - "srk": stochastic Runge-Kutta scheme SRA1 for additive noise [2] with n_steps equidistant steps
+        - "adaptive": Heun with an embedded Euler-Maruyama error estimate and step size control against sampler_tol,
+          starting from a step size of 1/n_steps [3]. Rejected steps draw a new noise sample.
+    The higher order samplers use two network evaluations per step but typically need far fewer steps.
+
+    [2] Roessler; Runge-Kutta Methods for the Strong Approximation of Solutions of Stochastic Differential Equations
+    [3] Jolicoeur-Martineau et al.; Gotta Go Fast When Generating Data with Score-Based Models
     """
 
-    def __init__(self, params, model_handle, noise_epsilon=1.0, use_foellmer=False, antithetic_sampling=False, seed=333, **kwargs):
+    def __init__(
+        self,
+        params,
+        model_handle,
+        noise_epsilon=1.0,
+        use_foellmer=False,
+        antithetic_sampling=False,
+        seed=333,
+        sampler="euler",
+        sampler_tol=1e-2,
+        sampler_min_step=1e-3,
+        **kwargs,
+    ):
         super().__init__()
 
+        if sampler not in ["euler", "heun", "srk", "adaptive"]:
+            raise NotImplementedError(f"Error, sampler {sampler} not supported.")
+        self.sampler = sampler
+        self.sampler_tol = sampler_tol
+        self.sampler_min_step = sampler_min_step
+
         assert params.n_history == 0
         assert params.n_future == 0
 
@@ -280,7 +311,7 @@ class StochasticInterpolantWrapper(nn.Module):
                 stens = torch.cat([stens, 1.0 - stens], dim=1)
 
             # noise already has the right dims [B, 1, C, H, W]
-            noise = self.noise_module(update_internal_state=True)
+            noise = self._sample_noise(ishape[0])
 
             # unsqueeze input and target to [B, S, C, H, W]
             inp = expand_time(inp, n_samples * samples_fact)
@@ -301,62 +332,149 @@ class StochasticInterpolantWrapper(nn.Module):
 
         return drift_pred, drift
 
-    def _forward_eval(self, inp, n_steps=1):
+    def _sample_noise(self, batch_size: int) -> torch.Tensor:
+        """returns a noise sample of shape [B, 1, C, H, W] and resizes the noise state if the batch size changes"""
+        with torch.no_grad():
+            if self.noise_module.state.shape[0] != batch_size:
+                self.noise_module.update(replace_state=True, batch_size=batch_size)
+
+            noise = self.noise_module(update_internal_state=True)
+
+        return noise
+
+    def _diffusion_coefficient(self, s: float) -> float:
+        # the first step uses the plain diffusion coefficient, since the Foellmer coefficient is not defined at s=0
+        if s == 0.0:
+            return self.sigma_fn(s)
+
+        return math.sqrt(self.gsq_fn(torch.tensor(s, dtype=torch.float64), foellmer=self.use_foellmer).item())
 
-        assert len(inp.shape) == 4
+    def _drift_eval(self, x: torch.Tensor, x0: torch.Tensor, xu: torch.Tensor, static: torch.Tensor, s: float) -> torch.Tensor:
+        # the Foellmer correction is singular at s=0 and s=1. At both points its prefactor vanishes or is not used
+        stens = torch.full((x.shape[0],), s, dtype=x.dtype, device=x.device)
+        foellmer = self.use_foellmer and (0.0 < s < 1.0)
 
+        return self._compute_bhat(x, x0, xu, static, stens, foellmer=foellmer)
+
+    def _error_norm(self, x_high: torch.Tensor, x_low: torch.Tensor, x_prev: torch.Tensor) -> float:
+        """mixed absolute/relative RMS norm of the local error estimate, reduced over the spatial ranks"""
         with torch.no_grad():
-            # get unpredicted in shape [B, T, C, H, W]
-            inpu, _ = self.preprocessor.get_unpredicted_features()
+            delta = self.sampler_tol * torch.clamp(torch.maximum(x_high.abs(), x_prev.abs()), min=1.0)
+            err = torch.stack([torch.sum(torch.square((x_high - x_low) / delta)), torch.tensor(x_high.numel(), dtype=torch.float32, device=x_high.device)])
 
-            if inpu is not None:
-                # rewmove time dim to get shape [B, C, H, W]
-                inpu = inpu.squeeze(1)
+            if comm.get_size("spatial") > 1:
+                dist.all_reduce(err, group=comm.get_group("spatial"))
 
-            # get static in shape [B, C, H, W]
-            static = self.preprocessor.get_static_features()
+            err = torch.sqrt(err[0] / err[1]).item()
 
-            # get sampling points: shape [S]
-            stens = torch.linspace(0, 1, n_steps + 1, dtype=inp.dtype, device=inp.device)
+        return err
 
-            # compute delta s, shape: [S]
-            delta_s = stens[1:] - stens[:-1]
+    def _euler_step(self, x, x0, xu, static, s, ds, noise):
+        bhat = self._drift_eval(x, x0, xu, static, s)
+        return x + bhat * ds + self._diffusion_coefficient(s) * math.sqrt(ds) * noise
 
-            # tile and reshape stens [B, S+1]
-            stens = expand_batch(stens, inp.shape[0])
+    def _heun_step(self, x, x0, xu, static, s, ds, noise, return_euler=False):
+        dw = math.sqrt(ds) * noise
+        g0 = self._diffusion_coefficient(s)
+        g1 = self._diffusion_coefficient(s + ds)
 
-        # do the sampling
-        # initialization
-        s_0 = stens[:, 0]
-        deltas_0 = delta_s[0]
+        # predictor
+        b0 = self._drift_eval(x, x0, xu, static, s)
+        x_pred = x + b0 * ds + g0 * dw
 
-        # deterministic term: the model output should be squeezed
-        x = inp + self.model(inp, inp, inpu, static, s_0) * delta_s[0]
+        # corrector. The noise is additive, so that the diffusion term is integrated with the trapezoidal rule for the variance
+        b1 = self._drift_eval(x_pred, x0, xu, static, s + ds)
+        x_new = x + 0.5 * (b0 + b1) * ds + math.sqrt(0.5 * (g0**2 + g1**2)) * dw
 
-        # noise term needs to be adjusted to have dimension [B, C, H, W]
-        with torch.no_grad():
-            noise = self.noise_module(update_internal_state=True).squeeze(1)
+        if return_euler:
+            return x_new, x_pred
+        else:
+            return x_new
+
+    def _srk_step(self, x, x0, xu, static, s, ds, noise, noise_aux):
+        # SRA1 tableau for additive noise: c0 = (0, 3/4), c1 = (1, 0), A0 = B0 / 2 = (3/4), alpha = (1/3, 2/3), beta1 = (1, 0), beta2 = (-1, 1)
+        dw = math.sqrt(ds) * noise
+        # I_(1,0) / ds, approximated from the Brownian increment and an independent sample
+        chi = 0.5 * math.sqrt(ds) * (noise + noise_aux / math.sqrt(3.0))
+
+        g0 = self._diffusion_coefficient(s)
+        g1 = self._diffusion_coefficient(s + ds)
 
-        x = x + self.sigma_fn(s_0.reshape(-1, 1, 1, 1)) * torch.sqrt(deltas_0) * noise
+        b0 = self._drift_eval(x, x0, xu, static, s)
+        h1 = x + 0.75 * b0 * ds + 1.5 * g1 * chi
+        b1 = self._drift_eval(h1, x0, xu, static, s + 0.75 * ds)
 
-        # trajectory: upper bound is n_steps-1, like in the paper
-        for i in range(1, n_steps):
+        return x + (b0 / 3.0 + 2.0 * b1 / 3.0) * ds + g1 * (dw - chi) + g0 * chi
 
-            # get s and deltas
-            s_i = stens[:, i]
-            deltas_i = delta_s[i]
+    def _forward_eval(self, inp, n_steps=1, n_samples=1):
+        """
+        Integrates the SDE from s=0 to s=1. Multiple samples are evaluated in a single batched trajectory, either by
+        passing inputs of shape [B, S, C, H, W] or by passing n_samples > 1. The output then has shape [B, S, C, H, W].
+        """
 
-            # pass to bhat computation, get everything into shape: [B, C, H, W]
-            bhat = self._compute_bhat(x, inp, inpu, static, s_i, foellmer=self.use_foellmer)
+        assert len(inp.shape) in [4, 5]
 
-            # deterministic part
-            x = x + bhat * deltas_i
+        # flatten samples into the batch dimension
+        batched = (len(inp.shape) == 5) or (n_samples > 1)
+        if len(inp.shape) == 5:
+            n_samples = inp.shape[1]
+        elif n_samples > 1:
+            inp = expand_time(inp, n_samples)
+        if batched:
+            batch_size = inp.shape[0]
+            inp = inp.flatten(0, 1)
 
-            # noise term
-            with torch.no_grad():
-                noise = self.noise_module(update_internal_state=True).squeeze(1)
+        with torch.no_grad():
+            # get unpredicted in shape [B, T, C, H, W]
+            inpu, _ = self.preprocessor.get_unpredicted_features()
 
-            x = x + torch.sqrt(self.gsq_fn(s_i.reshape(-1, 1, 1, 1), foellmer=self.use_foellmer) * deltas_i) * noise
+            if inpu is not None:
+                # rewmove time dim to get shape [B, C, H, W]
+                inpu = inpu.squeeze(1)
+                if batched:
+                    inpu = expand_time(inpu, n_samples).flatten(0, 1)
+
+            # get static in shape [B, C, H, W]
+            static = self.preprocessor.get_static_features()
+
+            if (static is not None) and (static.shape[0] != inp.shape[0]):
+                static = torch.tile(static, (inp.shape[0] // static.shape[0], 1, 1, 1))
+
+        # do the sampling
+        x = inp
+        if self.sampler == "adaptive":
+            s = 0.0
+            ds = 1.0 / n_steps
+            while s < 1.0:
+                ds = min(ds, 1.0 - s)
+                noise = self._sample_noise(x.shape[0]).squeeze(1)
+                x_new, x_low = self._heun_step(x, inp, inpu, static, s, ds, noise, return_euler=True)
+
+                # accept the step if the error is within the tolerance or the step size cannot be reduced any further
+                err = self._error_norm(x_new, x_low, x)
+                if (err <= 1.0) or (ds <= self.sampler_min_step):
+                    x = x_new
+                    s = s + ds
+
+                # the error estimate is first order, hence the exponent 1/2
+                ds = max(self.sampler_min_step, ds * min(2.0, 0.9 * max(err, 1e-8) ** (-0.5)))
+        else:
+            stens = [i / n_steps for i in range(n_steps + 1)]
+            for i in range(n_steps):
+                s = stens[i]
+                ds = stens[i + 1] - stens[i]
+                noise = self._sample_noise(x.shape[0]).squeeze(1)
+
+                if self.sampler == "euler":
+                    x = self._euler_step(x, inp, inpu, static, s, ds, noise)
+                elif self.sampler == "heun":
+                    x = self._heun_step(x, inp, inpu, static, s, ds, noise)
+                elif self.sampler == "srk":
+                    noise_aux = self._sample_noise(x.shape[0]).squeeze(1)
+                    x = self._srk_step(x, inp, inpu, static, s, ds, noise, noise_aux)
+
+        if batched:
+            x = x.reshape(batch_size, n_samples, *x.shape[1:])
 
         return x
 
@@ -365,4 +483,4 @@ class StochasticInterpolantWrapper(nn.Module):
         if self.training:
             return self._forward_train(inp, tar, n_samples=n_samples)
         else:
-            return self._forward_eval(inp, n_steps=n_steps)
+            return self._forward_eval(inp, n_steps=n_steps, n_samples=n_samples)
@@ -13,18 +13,57 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Optional
+from typing import Optional, List, Generator
 import math
 import torch
 from torch import nn
 import torch.nn.functional as F
 
 from makani.utils import comm
+from makani.mpu.mappings import PendingTranspose, distributed_transpose_start, distributed_transpose_wait
 from physicsnemo.distributed.utils import compute_split_shapes
 from torch_harmonics.distributed import distributed_transpose_azimuth as distributed_transpose_w
 from torch_harmonics.distributed import distributed_transpose_polar as distributed_transpose_h
 
 
+def _transpose_pipelined(x: torch.Tensor, dims, dim1_split_sizes: List[int], comm_id: str) -> Generator:
+    """
+    generator which issues an asynchronous distributed transposition, yields control and returns the
+    transposed tensor once resumed. Has to be used with yield from inside a pipeline stage.
+    """
+    handle = PendingTranspose(dims, dim1_split_sizes, comm_id)
+    x = distributed_transpose_start.apply(x.contiguous(), handle)
+    yield
+    return distributed_transpose_wait.apply(x, handle)
+
+
+def _run_pipelined(pipelines: List[Generator]) -> List[torch.Tensor]:
+    """
+    helper routine which advances a list of pipelines in round-robin fashion. Each pipeline yields after issuing
+    a transposition, so that the communication of one chunk overlaps with the computation of the other chunks.
+    The order in which the collectives are issued is deterministic and therefore identical on all ranks.
+    """
+    results = [None for _ in pipelines]
+    active = list(enumerate(pipelines))
+    while active:
+        remaining = []
+        for idx, pipeline in active:
+            try:
+                next(pipeline)
+                remaining.append((idx, pipeline))
+            except StopIteration as result:
+                results[idx] = result.value
+        active = remaining
+
+    return results
+
+
+def _pipeline_chunk_shapes(num_chans: int, pipeline_chunks: int, comm_size: int) -> List[int]:
+    # each chunk needs at least one channel per rank
+    num_chunks = max(min(pipeline_chunks, num_chans // comm_size), 1)
+    return compute_split_shapes(num_chans, num_chunks)
+
+
 class DistributedRealFFT1(nn.Module):
     """
     Helper routine to wrap FFT similarly to the SHT
@@ -118,12 +157,16 @@ class DistributedInverseRealFFT1(nn.Module):
 
 class DistributedRealFFT2(nn.Module):
     """
-    Helper routine to wrap FFT similarly to the SHT
+    Helper routine to wrap FFT similarly to the SHT. If pipeline_chunks > 1, the channel dimension is split into
+    chunks and the distributed transpositions of one chunk are overlapped with the FFTs of the other chunks.
     """
 
-    def __init__(self, nlat: int, nlon: int, lmax: Optional[int] = None, mmax: Optional[int] = None):
+    def __init__(self, nlat: int, nlon: int, lmax: Optional[int] = None, mmax: Optional[int] = None, pipeline_chunks: Optional[int] = 1):
         super().__init__()
 
+        # number of channel chunks to pipeline
+        self.pipeline_chunks = pipeline_chunks
+
         # get the comms grid:
         self.comm_size_h = comm.get_size("h")
         self.comm_size_w = comm.get_size("w")
@@ -145,10 +188,52 @@ class DistributedRealFFT2(nn.Module):
         self.l_shapes = compute_split_shapes(self.lmax, self.comm_size_h)
         self.m_shapes = compute_split_shapes(self.mmax, self.comm_size_w)
 
+    def _forward_pipelined(self, x: torch.Tensor, norm: Optional[str] = "ortho", channel_dim: Optional[int] = -3) -> Generator:
+        # store number of chans
+        num_chans = x.shape[channel_dim]
+
+        # h and w is split. First we make w local by transposing into channel dim
+        if self.comm_size_w > 1:
+            x = yield from _transpose_pipelined(x, (channel_dim, -1), self.lon_shapes, "w")
+
+        # do first FFT
+        x = torch.fft.rfft(x, n=self.nlon, dim=-1, norm=norm)
+
+        # mode truncation
+        x = x[..., : self.mmax].contiguous()
+
+        # transpose: after this, m is split and c is local
+        if self.comm_size_w > 1:
+            chan_shapes = compute_split_shapes(num_chans, self.comm_size_w)
+            x = yield from _transpose_pipelined(x, (-1, channel_dim), chan_shapes, "w")
+
+        # transpose: after this, c is split and h is local
+        if self.comm_size_h > 1:
+            x = yield from _transpose_pipelined(x, (channel_dim, -2), self.lat_shapes, "h")
+
+        # do second FFT:
+        x = torch.fft.fft(x, n=self.nlat, dim=-2, norm=norm)
+
+        # apply mode truncation:
+        x = torch.cat([x[..., : self.lmax_high, :], x[..., -self.lmax_low :, :]], dim=-2)
+
+        # transpose: after this, l is split and c is local
+        if self.comm_size_h > 1:
+            chan_shapes = compute_split_shapes(num_chans, self.comm_size_h)
+            x = yield from _transpose_pipelined(x, (-2, channel_dim), chan_shapes, "h")
+
+        return x
+
     def forward(self, x: torch.Tensor, norm: Optional[str] = "ortho", channel_dim: Optional[int] = -3) -> torch.Tensor:
         # store number of chans
         num_chans = x.shape[channel_dim]
 
+        # pipelined variant, which overlaps communication and computation of different channel chunks
+        if (self.pipeline_chunks > 1) and (self.comm_size_h * self.comm_size_w > 1):
+            chunk_shapes = _pipeline_chunk_shapes(num_chans, self.pipeline_chunks, max(self.comm_size_h, self.comm_size_w))
+            xlist = _run_pipelined([self._forward_pipelined(xc, norm, channel_dim) for xc in torch.split(x, chunk_shapes, dim=channel_dim)])
+            return torch.cat(xlist, dim=channel_dim)
+
         # h and w is split. First we make w local by transposing into channel dim
         if self.comm_size_w > 1:
             x = distributed_transpose_w.apply(x, (channel_dim, -1), self.lon_shapes)
@@ -184,12 +269,16 @@ class DistributedRealFFT2(nn.Module):
 
 class DistributedInverseRealFFT2(nn.Module):
     """
-    Helper routine to wrap FFT similarly to the SHT
+    Helper routine to wrap FFT similarly to the SHT. If pipeline_chunks > 1, the channel dimension is split into
+    chunks and the distributed transpositions of one chunk are overlapped with the FFTs of the other chunks.
     """
 
-    def __init__(self, nlat: int, nlon: int, lmax: Optional[int] = None, mmax: Optional[int] = None):
+    def __init__(self, nlat: int, nlon: int, lmax: Optional[int] = None, mmax: Optional[int] = None, pipeline_chunks: Optional[int] = 1):
         super().__init__()
 
+        # number of channel chunks to pipeline
+        self.pipeline_chunks = pipeline_chunks
+
         # get the comms grid:
         self.comm_size_h = comm.get_size("h")
         self.comm_size_w = comm.get_size("w")
@@ -211,10 +300,52 @@ class DistributedInverseRealFFT2(nn.Module):
         self.l_shapes = compute_split_shapes(self.lmax, self.comm_size_h)
         self.m_shapes = compute_split_shapes(self.mmax, self.comm_size_w)
 
+    def _forward_pipelined(self, x: torch.Tensor, norm: Optional[str] = "ortho", channel_dim: Optional[int] = -3) -> Generator:
+        # store number of channels
+        num_chans = x.shape[channel_dim]
+
+        # transpose: after that, channels are split, l is local:
+        if self.comm_size_h > 1:
+            x = yield from _transpose_pipelined(x, (channel_dim, -2), self.l_shapes, "h")
+
+        # pad the middle, so that the inverse FFT is correct
+        if self.lmax < self.nlat:
+            xh = x[..., : self.lmax_high, :]
+            xl = x[..., -self.lmax_low :, :]
+            xhp = F.pad(xh, (0, 0, 0, self.nlat - self.lmax), mode="constant")
+            x = torch.cat([xhp, xl], dim=-2)
+
+        # do first fft
+        x = torch.fft.ifft(x, n=self.nlat, dim=-2, norm=norm)
+
+        if self.comm_size_h > 1:
+            chan_shapes = compute_split_shapes(num_chans, self.comm_size_h)
+            x = yield from _transpose_pipelined(x, (-2, channel_dim), chan_shapes, "h")
+
+        # transpose: after this, channels are split and m is local
+        if self.comm_size_w > 1:
+            x = yield from _transpose_pipelined(x, (channel_dim, -1), self.m_shapes, "w")
+
+        # apply the inverse (real) FFT
+        x = torch.fft.irfft(x, n=self.nlon, dim=-1, norm=norm)
+
+        # transpose: after this, m is split and channels are local
+        if self.comm_size_w > 1:
+            chan_shapes = compute_split_shapes(num_chans, self.comm_size_w)
+            x = yield from _transpose_pipelined(x, (-1, channel_dim), chan_shapes, "w")
+
+        return x
+
     def forward(self, x: torch.Tensor, norm: Optional[str] = "ortho", channel_dim: Optional[int] = -3) -> torch.Tensor:
         # store number of channels
         num_chans = x.shape[channel_dim]
 
+        # pipelined variant, which overlaps communication and computation of different channel chunks
+        if (self.pipeline_chunks > 1) and (self.comm_size_h * self.comm_size_w > 1):
+            chunk_shapes = _pipeline_chunk_shapes(num_chans, self.pipeline_chunks, max(self.comm_size_h, self.comm_size_w))
+            xlist = _run_pipelined([self._forward_pipelined(xc, norm, channel_dim) for xc in torch.split(x, chunk_shapes, dim=channel_dim)])
+            return torch.cat(xlist, dim=channel_dim)
+
         # transpose: after that, channels are split, l is local:
         if self.comm_size_h > 1:
             x = distributed_transpose_h.apply(x, (channel_dim, -2), self.l_shapes)
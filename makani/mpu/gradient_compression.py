@@ -0,0 +1,139 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Optional, Any
+
+import torch
+import torch.nn.functional as F
+import torch.distributed as dist
+
+# largest representable value in float8_e4m3fn
+_FP8_MAX = 448.0
+
+
+class GradientCompressor(object):
+    """
+    Base class for compressed gradient reductions. reduce averages a flat gradient tensor over the process group in place
+    and returns a future which holds a list with the reduced tensor, just like the futures returned by torch.distributed.
+    The key identifies the bucket and is used to keep track of per-bucket state such as the error feedback.
+    """
+
+    def __init__(self, process_group: Optional[dist.ProcessGroup] = None):
+        self.process_group = process_group
+
+    def reduce(self, tensor: torch.Tensor, key: Optional[Any] = None) -> torch.futures.Future:
+        return dist.all_reduce(tensor, op=dist.ReduceOp.AVG, group=self.process_group, async_op=True).get_future()
+
+
+class Bf16Compressor(GradientCompressor):
+    """
+    Casts the gradients to bfloat16 for the reduction and back to the original precision afterwards
+    """
+
+    def reduce(self, tensor: torch.Tensor, key: Optional[Any] = None) -> torch.futures.Future:
+        compressed = tensor.to(torch.bfloat16)
+        fut = dist.all_reduce(compressed, op=dist.ReduceOp.AVG, group=self.process_group, async_op=True).get_future()
+
+        def decompress(fut):
+            tensor.copy_(fut.value()[0])
+            return [tensor]
+
+        return fut.then(decompress)
+
+
+class Fp8Compressor(GradientCompressor):
+    """
+    Quantizes the gradients to float8_e4m3fn with one scale per chunk. Since summation in FP8 is not accurate, the reduction
+    is carried out as a quantized all-to-all, followed by a local reduction in FP32 and a quantized all-gather of the
+    reduced chunks. This amounts to roughly a quarter of the data volume of a full precision all-reduce. The local
+    quantization error is added to the gradient of the same bucket in the next iteration (error feedback).
+    """
+
+    def __init__(self, process_group: Optional[dist.ProcessGroup] = None, error_feedback: Optional[bool] = True):
+        super().__init__(process_group=process_group)
+        self.error_feedback = error_feedback
+        self.residuals = {}
+
+    @staticmethod
+    def _quantize(tensor: torch.Tensor):
+        scale = torch.clamp(tensor.abs().amax(dim=-1, keepdim=True) / _FP8_MAX, min=torch.finfo(torch.float32).tiny)
+        return (tensor / scale).to(torch.float8_e4m3fn), scale
+
+    def reduce(self, tensor: torch.Tensor, key: Optional[Any] = None) -> torch.futures.Future:
+        comm_size = dist.get_world_size(group=self.process_group)
+
+        # pad and split into one chunk per rank
+        numel = tensor.numel()
+        chunk_size = (numel + comm_size - 1) // comm_size
+        x = F.pad(tensor.reshape(-1).to(torch.float32), (0, chunk_size * comm_size - numel)).reshape(comm_size, chunk_size)
+
+        # add the quantization error of the previous iteration. Buckets might have been rebuilt in the meantime
+        if self.error_feedback:
+            residual = self.residuals.get(key, None)
+            if (residual is not None) and (residual.shape == x.shape):
+                x = x + residual
+
+        xq, scale = self._quantize(x)
+
+        if self.error_feedback:
+            self.residuals[key] = x - xq.to(torch.float32) * scale
+
+        # all collectives of a bucket are issued from the hook in a fixed order, so that they cannot interleave with the
+        # collectives of other buckets. With NCCL, waiting on the handles only synchronizes the streams and does not block the host
+        scale_recv = torch.empty_like(scale)
+        xq_recv = torch.empty((comm_size, chunk_size), dtype=torch.uint8, device=tensor.device)
+        scale_work = dist.all_to_all_single(scale_recv, scale, group=self.process_group, async_op=True)
+        xq_work = dist.all_to_all_single(xq_recv, xq.view(torch.uint8), group=self.process_group, async_op=True)
+        scale_work.wait()
+        xq_work.wait()
+
+        # reduce the local chunk in full precision and requantize
+        shard = torch.mean(xq_recv.view(torch.float8_e4m3fn).to(torch.float32) * scale_recv, dim=0, keepdim=True)
+        shardq, shard_scale = self._quantize(shard)
+
+        # gather the reduced chunks
+        scale_gather = torch.empty((comm_size, 1), dtype=torch.float32, device=tensor.device)
+        xq_gather = torch.empty((comm_size, chunk_size), dtype=torch.uint8, device=tensor.device)
+        scale_fut = dist.all_gather_into_tensor(scale_gather, shard_scale, group=self.process_group, async_op=True).get_future()
+        xq_fut = dist.all_gather_into_tensor(xq_gather, shardq.view(torch.uint8), group=self.process_group, async_op=True).get_future()
+
+        # the callback only dequantizes and copies back
+        def decompress(fut):
+            result = (xq_gather.view(torch.float8_e4m3fn).to(torch.float32) * scale_gather).reshape(-1)[:numel]
+            tensor.copy_(result.reshape(tensor.shape))
+            return [tensor]
+
+        return torch.futures.collect_all([scale_fut, xq_fut]).then(decompress)
+
+
+def get_gradient_compressor(gradient_compression: str, process_group: Optional[dist.ProcessGroup] = None, **parameters) -> Optional[GradientCompressor]:
+    """
+    Factory for gradient compressors. Returns None if no compression is requested.
+    """
+    if gradient_compression == "none":
+        return None
+    elif gradient_compression == "bf16":
+        return Bf16Compressor(process_group=process_group)
+    elif gradient_compression == "fp8":
+        return Fp8Compressor(process_group=process_group, **parameters)
+    else:
+        raise NotImplementedError(f"Error, gradient compression {gradient_compression} not supported.")
+
+
+def compressed_reduction_comm_hook(state: GradientCompressor, bucket: dist.GradBucket) -> torch.futures.Future[torch.Tensor]:
+    """
+    DDP communication hook which reduces the bucket with the compressor passed as state
+    """
+    return state.reduce(bucket.buffer(), key=bucket.index()).then(lambda fut: fut.value()[0])
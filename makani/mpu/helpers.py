@@ -13,12 +13,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import math
+
 import torch
 import torch.nn.functional as F
 import torch.distributed as dist
 from torch._utils import _flatten_dense_tensors
 
-from physicsnemo.distributed.utils import split_tensor_along_dim
+from physicsnemo.distributed.utils import split_tensor_along_dim, compute_split_shapes
 from makani.utils import comm
 
 
@@ -47,6 +49,54 @@ def _transpose(tensor, dim0, dim1, dim1_split_sizes, group=None, async_op=False)
     return x_recv, dim0_split_sizes, req
 
 
+def _transpose_async(tensor, dim0, dim1, dim1_split_sizes, group=None):
+    """
+    asynchronous variant of _transpose. The chunks are packed into a single flat buffer and exchanged with
+    all_to_all_single, which is supported by both NCCL and gloo. Returns the flat send and receive buffers,
+    the shapes of the received chunks, the dim0 split sizes and the request handle. The received chunks
+    have to be unpacked with _transpose_unpack after waiting on the request.
+    """
+
+    # get comm params
+    comm_size = dist.get_world_size(group=group)
+    comm_rank = dist.get_rank(group=group)
+
+    # split and pack into a flat send buffer. The layout of the send buffer is identical to the
+    # layout of the receive buffer of the reverse transposition
+    dim0_split_sizes = compute_split_shapes(tensor.shape[dim0], comm_size)
+    tsplit = torch.split(tensor, dim0_split_sizes, dim=dim0)
+    x_send = torch.cat([y.reshape(-1) for y in tsplit])
+    send_numels = [y.numel() for y in tsplit]
+
+    # prepare receive buffer
+    recv_shapes = []
+    x_shape = list(tensor.shape)
+    x_shape[dim0] = dim0_split_sizes[comm_rank]
+    for dim1_len in dim1_split_sizes:
+        x_shape[dim1] = dim1_len
+        recv_shapes.append(list(x_shape))
+    recv_numels = [math.prod(shape) for shape in recv_shapes]
+    x_recv = torch.empty(sum(recv_numels), dtype=tensor.dtype, device=tensor.device)
+
+    # global transposition, complex tensors are communicated as real tensors
+    req = dist.all_to_all_single(
+        torch.view_as_real(x_recv) if x_recv.is_complex() else x_recv,
+        torch.view_as_real(x_send) if x_send.is_complex() else x_send,
+        output_split_sizes=recv_numels,
+        input_split_sizes=send_numels,
+        group=group,
+        async_op=True,
+    )
+
+    return x_send, x_recv, recv_shapes, dim0_split_sizes, req
+
+
+def _transpose_unpack(x_recv, recv_shapes, dim1):
+    recv_numels = [math.prod(shape) for shape in recv_shapes]
+    xlist = [y.reshape(shape) for y, shape in zip(torch.split(x_recv, recv_numels), recv_shapes)]
+    return torch.cat(xlist, dim=dim1)
+
+
 def gather_uneven(tensor, dim, comm_name):
     if comm.get_size(comm_name) == 1:
         return tensor
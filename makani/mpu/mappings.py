@@ -20,13 +20,15 @@ import torch
 from torch.amp import custom_fwd, custom_bwd
 import torch.distributed as dist
 from torch.nn.parallel import DistributedDataParallel
+from torch.distributed.algorithms.ddp_comm_hooks import powerSGD_hook
 from makani.utils import comm
 
 # torch utils
 from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
 
 # we need those
-from makani.mpu.helpers import _transpose
+from makani.mpu.helpers import _transpose, _transpose_async, _transpose_unpack
+from makani.mpu.gradient_compression import get_gradient_compressor, compressed_reduction_comm_hook
 
 # we need the parameter counter
 from makani.models.helpers import count_parameters
@@ -58,9 +60,211 @@ class distributed_transpose(torch.autograd.Function):
         return gi, None, None, None
 
 
+class PendingTranspose(object):
+    """
+    Handle which connects distributed_transpose_start and distributed_transpose_wait. It holds the buffers and
+    request of the transposition in flight, in the forward as well as in the backward pass.
+    """
+
+    def __init__(self, dims, dim1_split_sizes, comm_id):
+        self.dims = dims
+        self.dim1_split_sizes = dim1_split_sizes
+        self.comm_id = comm_id
+        self.dim0_split_sizes = None
+        self.state = None
+
+
+class distributed_transpose_start(torch.autograd.Function):
+    """
+    Issues an asynchronous distributed transposition and returns the (not yet filled) flat receive buffer.
+    distributed_transpose_wait has to be called on the result with the same handle before it can be used.
+    In the backward pass, the roles are reversed: distributed_transpose_wait issues the transposition of the
+    gradient and distributed_transpose_start waits for it.
+    """
+
+    @staticmethod
+    @custom_fwd(device_type="cuda")
+    def forward(ctx, x, handle):
+        x_send, x_recv, recv_shapes, dim0_split_sizes, req = _transpose_async(x, handle.dims[0], handle.dims[1], handle.dim1_split_sizes, group=comm.get_group(handle.comm_id))
+        handle.dim0_split_sizes = dim0_split_sizes
+        handle.state = (x_send, recv_shapes, req)
+        ctx.handle = handle
+        return x_recv
+
+    @staticmethod
+    @custom_bwd(device_type="cuda")
+    def backward(ctx, _):
+        handle = ctx.handle
+        x_send, x_recv, recv_shapes, req = handle.state
+        handle.state = None
+        req.wait()
+        gi = _transpose_unpack(x_recv, recv_shapes, handle.dims[0])
+        return gi, None
+
+
+class distributed_transpose_wait(torch.autograd.Function):
+
+    @staticmethod
+    @custom_fwd(device_type="cuda")
+    def forward(ctx, x_recv, handle):
+        _, recv_shapes, req = handle.state
+        handle.state = None
+        req.wait()
+        x = _transpose_unpack(x_recv, recv_shapes, handle.dims[1])
+        ctx.handle = handle
+        return x
+
+    @staticmethod
+    @custom_bwd(device_type="cuda")
+    def backward(ctx, go):
+        handle = ctx.handle
+        # the send buffer of the reverse transposition has the same layout as the forward receive buffer,
+        # so it is passed on as the gradient of the latter. It is not used by distributed_transpose_start though.
+        x_send, x_recv, recv_shapes, _, req = _transpose_async(go.contiguous(), handle.dims[1], handle.dims[0], handle.dim0_split_sizes, group=comm.get_group(handle.comm_id))
+        handle.state = (x_send, x_recv, recv_shapes, req)
+        return x_send, None
+
+
+class GradientBuckets(object):
+    """
+    State of the gradient reduction for parameters which are not shared across all model parallel ranks. The parameters
+    are grouped into buckets with the same is_shared_mp signature, so that each bucket is reduced with a single all-reduce
+    per communicator. The bucket sizes are computed from the maximum parameter sizes across the model parallel group, which
+    ensures that all ranks agree on the bucket layout. Buckets are launched asynchronously and strictly in index order as soon
+    as all their gradients are ready, so that the order of the collectives is identical on all ranks and the reductions
+    overlap with the remaining backward pass. All collectives are issued from the hook, only the copy back of the reduced
+    gradients is deferred to the future callbacks. If a compressor is passed, it is used for the reduction over the data
+    parallel ranks, the reductions over the model parallel ranks are always carried out in full precision.
+    """
+
+    def __init__(self, parameters, reduction_buffer_count, device, compressor=None):
+        self.compressor = compressor
+
+        # gradients become ready roughly in reverse order of registration
+        parameters = list(reversed(parameters))
+
+        # make bucket boundaries independent of the local shard sizes
+        param_bytes = torch.tensor([param.numel() * param.element_size() for param in parameters], dtype=torch.int64, device=device)
+        if comm.get_size("model") > 1:
+            dist.all_reduce(param_bytes, op=dist.ReduceOp.MAX, group=comm.get_group("model"))
+        param_bytes = param_bytes.tolist()
+        bucket_size_bytes = (sum(param_bytes) + reduction_buffer_count - 1) // reduction_buffer_count
+
+        self.buckets = []
+        self.signatures = []
+        open_buckets = {}
+        open_bytes = {}
+        for param, nbytes in zip(parameters, param_bytes):
+            signature = tuple(group for group in comm.get_comm_names() if (group != "data") and (group in param.is_shared_mp) and (comm.get_size(group) > 1))
+
+            # open a new bucket if there is none or the current one is full
+            if (signature not in open_buckets) or ((open_bytes[signature] > 0) and (open_bytes[signature] + nbytes > bucket_size_bytes)):
+                open_buckets[signature] = len(self.buckets)
+                open_bytes[signature] = 0
+                self.buckets.append([])
+                self.signatures.append(signature)
+
+            self.buckets[open_buckets[signature]].append(param)
+            open_bytes[signature] += nbytes
+
+        self.param_to_bucket = {id(param): idx for idx, bucket in enumerate(self.buckets) for param in bucket}
+        self.num_parameters = len(parameters)
+        self.reset()
+
+    def reset(self):
+        self.pending = [len(bucket) for bucket in self.buckets]
+        self.num_ready = 0
+        self.next_bucket = 0
+        self.futures = []
+
+    def _launch(self, idx):
+        grads = [param.grad.data for param in self.buckets[idx] if param.grad is not None]
+
+        fut = torch.futures.Future()
+        if not grads:
+            fut.set_result(None)
+            return fut
+
+        # check if grads are complex
+        is_complex = [g.is_complex() for g in grads]
+        grads_real = [torch.view_as_real(g) if g.is_complex() else g for g in grads]
+
+        # flatten
+        coalesced = _flatten_dense_tensors(grads_real)
+
+        # sum over the ranks sharing the parameters first, then average over the data parallel ranks. All collectives are
+        # issued here in a fixed order, the callbacks only copy back. With NCCL, the blocking model parallel reductions
+        # only synchronize the streams
+        for group in self.signatures[idx]:
+            dist.all_reduce(coalesced, op=dist.ReduceOp.SUM, group=comm.get_group(group))
+
+        if (comm.get_size("data") > 1) and (self.compressor is not None):
+            fut = self.compressor.reduce(coalesced, key=idx)
+        elif comm.get_size("data") > 1:
+            fut = dist.all_reduce(coalesced, op=dist.ReduceOp.AVG, group=comm.get_group("data"), async_op=True).get_future()
+        else:
+            fut.set_result([coalesced])
+
+        # copy back
+        def unflatten(fut):
+            synced_coalesced = fut.value()[0]
+            for buf, synced_real, is_comp in zip(grads, _unflatten_dense_tensors(synced_coalesced, grads_real), is_complex):
+                if is_comp:
+                    synced = torch.view_as_complex(synced_real)
+                else:
+                    synced = synced_real
+                buf.copy_(synced)
+            return None
+
+        return fut.then(unflatten)
+
+    def mark_ready(self, params) -> bool:
+        """marks parameters as ready, launches all complete buckets in order and returns whether all parameters are ready"""
+        for param in params:
+            self.pending[self.param_to_bucket[id(param)]] -= 1
+        self.num_ready += len(params)
+
+        while (self.next_bucket < len(self.buckets)) and (self.pending[self.next_bucket] == 0):
+            self.futures.append(self._launch(self.next_bucket))
+            self.next_bucket += 1
+
+        return self.num_ready == self.num_parameters
+
+    def finalize(self, buffer: torch.Tensor) -> torch.futures.Future:
+        """returns a future which completes once all buckets are reduced and resets the state for the next iteration"""
+        fut = torch.futures.collect_all(self.futures).then(lambda x: buffer)
+        self.reset()
+        return fut
+
+
+def bucketed_reduction_comm_hook(state: GradientBuckets, bucket: dist.GradBucket) -> torch.futures.Future[torch.Tensor]:
+    """
+    DDP communication hook which hands the gradients over to the bucketed reduction. Since DDP buckets do not align with
+    the sharing signatures, the reductions are tracked by GradientBuckets and the future of the last DDP bucket only
+    completes once all reductions are done. DDP waits for all bucket futures before the optimizer step.
+    """
+    if state.mark_ready(bucket.parameters()):
+        return state.finalize(bucket.buffer())
+
+    fut = torch.futures.Future()
+    fut.set_result(bucket.buffer())
+    return fut
+
+
 # handler for additional gradient reductions
 # helper for gradient reduction across channel parallel ranks
-def init_gradient_reduction_hooks(model, device, reduction_buffer_count=1, broadcast_buffers=True, find_unused_parameters=False, gradient_as_bucket_view=True, static_graph=False, verbose=False):
+def init_gradient_reduction_hooks(
+    model,
+    device,
+    reduction_buffer_count=1,
+    broadcast_buffers=True,
+    find_unused_parameters=False,
+    gradient_as_bucket_view=True,
+    static_graph=False,
+    gradient_compression="none",
+    gradient_compression_parameters=None,
+    verbose=False,
+):
     # early exit if we are not in a distributed setting:
     if not dist.is_initialized():
         return model
@@ -104,11 +308,6 @@ def init_gradient_reduction_hooks(model, device, reduction_buffer_count=1, broad
             broadcast_buffers = False
             need_hooks = True
 
-    # compute bucket cap in MB:
-    if need_hooks:
-        # if we need hooks, we can only use a single reduction buffer:
-        reduction_buffer_count = 1
-
     # determine size of model. Only local number of parameters is relevant:
     _, _, local_parameter_size_bytes = count_parameters(model, device)
 
@@ -134,76 +333,40 @@ def init_gradient_reduction_hooks(model, device, reduction_buffer_count=1, broad
         process_group=ddp_group,
     )
 
+    # parameters for the gradient compression
+    gradient_compression_parameters = gradient_compression_parameters if gradient_compression_parameters is not None else {}
+
     if not need_hooks:
+        # compression hooks reduce over the DDP process group, which is consistent with the multiplicity scaling above
+        if gradient_compression == "powersgd":
+            if verbose:
+                print("Setting up PowerSGD gradient compression")
+            state = powerSGD_hook.PowerSGDState(process_group=ddp_group, **gradient_compression_parameters)
+            model.register_comm_hook(state=state, hook=powerSGD_hook.powerSGD_hook)
+        elif gradient_compression != "none":
+            if verbose:
+                print(f"Setting up {gradient_compression} gradient compression")
+            compressor = get_gradient_compressor(gradient_compression, process_group=ddp_group, **gradient_compression_parameters)
+            model.register_comm_hook(state=compressor, hook=compressed_reduction_comm_hook)
+
         return model
 
     if verbose:
         print("Setting up custom communication hooks")
 
-    # define comm hook:
-    def reduction_comm_hook(state: object, bucket: dist.GradBucket) -> torch.futures.Future[torch.Tensor]:
-        # allreduce everything first:
-        buff = bucket.buffer()
-        params = bucket.parameters()
-
-        # define the grad reduction function
-        def grad_reduction(fut, grads, group, reduction="sum"):
-            # check if grads are complex
-            is_complex = [g.is_complex() for g in grads]
-            grads_real = [torch.view_as_real(g) if g.is_complex() else g for g in grads]
-
-            # flatten
-            coalesced = _flatten_dense_tensors(grads_real)
-
-            # reduce
-            if reduction == "sum":
-                dist.all_reduce(coalesced, op=dist.ReduceOp.SUM, group=comm.get_group(group), async_op=False)
-            elif reduction == "mean":
-                dist.all_reduce(coalesced, op=dist.ReduceOp.AVG, group=comm.get_group(group), async_op=False)
-            else:
-                raise NotImplementedError(f"Error, reduction {reduction} not supported.")
-
-            # copy back
-            for buf, synced_real, is_comp in zip(grads, _unflatten_dense_tensors(coalesced, grads_real), is_complex):
-                if is_comp:
-                    synced = torch.view_as_complex(synced_real)
-                else:
-                    synced = synced_real
-                buf.copy_(synced)
-
-            return bucket.buffer()
-
-        # get future
-        fut = torch.futures.Future()
-        fut.set_result(bucket.buffer())
-
-        # get the data gradients first:
-        grads = []
-        for p in params:
-            if p.grad is not None:
-                grads.append(p.grad.data)
-
-        if grads:
-            fut = fut.then(lambda x: grad_reduction(x, grads=grads, group="data", reduction="mean"))
-
-        # now go through the groups
-        for group in comm.get_comm_names():
-            if group == "data":
-                continue
+    # PowerSGD requires the structure of the DDP buckets and can only be used with DDP reductions
+    if gradient_compression == "powersgd":
+        raise NotImplementedError(f"Error, gradient compression {gradient_compression} not supported for parameters which are not shared across all model ranks.")
+    compressor = get_gradient_compressor(gradient_compression, process_group=comm.get_group("data"), **gradient_compression_parameters)
 
-            # real first
-            grads = []
-            for p in params:
-                if (p.grad is not None) and (group in p.is_shared_mp):
-                    grads.append(p.grad.data)
+    # group the parameters into buckets with the same sharing signature
+    parameters = [param for param in model.module.parameters() if param.requires_grad]
+    gradient_buckets = GradientBuckets(parameters, reduction_buffer_count, device, compressor=compressor)
 
-            # append the new reduction functions
-            if grads:
-                fut = fut.then(lambda x: grad_reduction(x, grads=grads, group=group, reduction="sum"))
-
-        return fut
+    if verbose:
+        print(f"Using {len(gradient_buckets.buckets)} gradient reduction buckets")
 
     # register model comm hook
-    model.register_comm_hook(state=None, hook=reduction_comm_hook)
+    model.register_comm_hook(state=gradient_buckets, hook=bucketed_reduction_comm_hook)
 
     return model
@@ -0,0 +1,48 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import logging
+
+import torch
+
+from makani.models.model_package import LocalPackage, load_model_package
+from makani.models.model_serving import ForecastServer, make_http_server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves forecasts from a makani model package over HTTP.")
+    parser.add_argument("--package_dir", required=True, type=str, help="Directory containing the model package.")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", type=str, help="Device on which the model is kept.")
+    parser.add_argument("--host", default="127.0.0.1", type=str, help="Host to listen on.")
+    parser.add_argument("--port", default=8000, type=int, help="Port to listen on.")
+    parser.add_argument("--socket_path", default=None, type=str, help="If specified, listen on this Unix socket instead of host and port.")
+    parser.add_argument("--max_batch_size", default=8, type=int, help="Maximum number of concurrent requests which are batched into a single rollout.")
+    parser.add_argument("--batch_timeout", default=0.01, type=float, help="Time in seconds to wait for further requests before a rollout is started.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    model = load_model_package(LocalPackage(args.package_dir), pretrained=True, device=args.device)
+
+    with ForecastServer(model, device=args.device, max_batch_size=args.max_batch_size, batch_timeout=args.batch_timeout) as forecast_server:
+        http_server = make_http_server(forecast_server, host=args.host, port=args.port, socket_path=args.socket_path)
+        logging.info(f"Serving forecasts on {args.socket_path if args.socket_path is not None else f'{args.host}:{args.port}'}")
+        try:
+            http_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            http_server.server_close()
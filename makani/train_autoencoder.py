@@ -53,6 +53,7 @@ if __name__ == "__main__":
     # checkpoint format
     params["load_checkpoint"] = args.load_checkpoint
     params["save_checkpoint"] = args.save_checkpoint
+    params["async_checkpoint"] = args.async_checkpoint
 
     # make sure to reconfigure logger after the pytorch distributed init
     with Timer() as timer:
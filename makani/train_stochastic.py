@@ -60,6 +60,7 @@ if __name__ == "__main__":
     # checkpoint format
     params["load_checkpoint"] = args.load_checkpoint
     params["save_checkpoint"] = args.save_checkpoint
+    params["async_checkpoint"] = args.async_checkpoint
 
     # make sure to reconfigure logger after the pytorch distributed init
     with Timer() as timer:
@@ -127,6 +128,8 @@ if __name__ == "__main__":
     params["resuming"] = resuming
     params["amp_mode"] = args.amp_mode
     params["jit_mode"] = args.jit_mode
+    if args.compile_cache_dir is not None:
+        params["compile_cache_dir"] = args.compile_cache_dir
     params["skip_validation"] = args.skip_validation
     params["skip_training"] = args.skip_training
     params["enable_odirect"] = args.enable_odirect
@@ -13,9 +13,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .loss import LossHandler
-from .metric import MetricsHandler
-from .visualize import VisualizationWrapper
+from .lazy_imports import lazy_attributes
 
-from .training import Trainer, AutoencoderTrainer, EnsembleTrainer, StochasticTrainer
-from .inference import Inferencer
+# these modules pull in heavy dependencies, they are imported on first access
+_LAZY_ATTRIBUTES = {
+    "LossHandler": (".loss", "LossHandler"),
+    "MetricsHandler": (".metric", "MetricsHandler"),
+    "VisualizationWrapper": (".visualize", "VisualizationWrapper"),
+    "Trainer": (".training", "Trainer"),
+    "AutoencoderTrainer": (".training", "AutoencoderTrainer"),
+    "EnsembleTrainer": (".training", "EnsembleTrainer"),
+    "StochasticTrainer": (".training", "StochasticTrainer"),
+    "Inferencer": (".inference", "Inferencer"),
+}
+
+
+__getattr__, __dir__ = lazy_attributes(__name__, globals(), _LAZY_ATTRIBUTES)
@@ -37,7 +37,14 @@ def get_default_argument_parser(training=True):
 
     # performance options
     parser.add_argument("--amp_mode", default="none", type=str, choices=["none", "fp16", "bf16"], help="Specify the mixed precision mode which should be used.")
-    parser.add_argument("--jit_mode", default="none", type=str, choices=["none", "inductor"], help="Specify if and how to use torch compile.")
+    parser.add_argument(
+        "--jit_mode",
+        default="none",
+        type=str,
+        choices=["none", "inductor", "inductor_regional"],
+        help="Specify if and how to use torch compile. inductor_regional compiles the processor blocks of the model individually.",
+    )
+    parser.add_argument("--compile_cache_dir", default=None, type=str, help="Directory for the persistent compile cache, which speeds up compilation when jobs are restarted.")
     parser.add_argument("--checkpointing_level", default=0, type=int, help="How aggressively checkpointing is used")
     parser.add_argument("--print_timings_frequency", default=-1, type=int, help="Frequency at which to print timing information")
     if training:
@@ -57,8 +64,9 @@ def get_default_argument_parser(training=True):
 
     # checkpoint format
     if training:
-        parser.add_argument("--save_checkpoint", default="legacy", choices=["none", "flexible", "legacy"], type=str, help="Format in which to save checkpoints.")
-    parser.add_argument("--load_checkpoint", default="legacy", choices=["flexible", "legacy"], type=str, help="Format in which to load checkpoints.")
+        parser.add_argument("--save_checkpoint", default="legacy", choices=["none", "flexible", "legacy", "sharded", "indexed"], type=str, help="Format in which to save checkpoints.")
+        parser.add_argument("--async_checkpoint", action="store_true", help="Write checkpoints to disk in the background.")
+    parser.add_argument("--load_checkpoint", default="legacy", choices=["flexible", "legacy", "sharded", "indexed"], type=str, help="Format in which to load checkpoints.")
 
     # multistep stuff
     if training:
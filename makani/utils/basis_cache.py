@@ -0,0 +1,158 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import hashlib
+import inspect
+import importlib
+import functools
+import logging
+from typing import Optional
+
+import torch
+
+import torch_harmonics as th
+
+# precomputation routines of torch-harmonics which are cached on disk, together with the modules which reference them
+_CACHED_FUNCTIONS = {
+    "_precompute_legpoly": ["torch_harmonics.legendre", "torch_harmonics.sht", "torch_harmonics.distributed.distributed_sht"],
+    "_precompute_dlegpoly": ["torch_harmonics.legendre", "torch_harmonics.sht", "torch_harmonics.distributed.distributed_sht"],
+    "_precompute_convolution_tensor_s2": ["torch_harmonics.disco.convolution", "torch_harmonics.distributed.distributed_convolution"],
+}
+
+# original functions, stored while the cache is enabled
+_original_functions = {}
+_cache_dir = None
+
+
+def _normalize_argument(arg):
+    """
+    helper routine which converts arguments into a canonical, hashable representation. Tensors are represented by their
+    metadata and a hash of their content, filter basis objects by their type and their attributes, which include kernel
+    shape and basis type
+    """
+    if isinstance(arg, (bool, int, float, str, type(None))):
+        return arg
+    elif isinstance(arg, (tuple, list)):
+        return tuple(_normalize_argument(a) for a in arg)
+    elif isinstance(arg, dict):
+        return tuple(sorted((str(k), _normalize_argument(v)) for k, v in arg.items()))
+    elif isinstance(arg, torch.dtype):
+        return str(arg)
+    elif isinstance(arg, torch.Tensor):
+        data = arg.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes()
+        return ("Tensor", str(arg.dtype), tuple(arg.shape), hashlib.sha256(data).hexdigest())
+    elif hasattr(arg, "__dict__"):
+        attrs = sorted((k, _normalize_argument(v)) for k, v in vars(arg).items() if isinstance(v, (bool, int, float, str, tuple, list, dict, torch.dtype, type(None))))
+        return (type(arg).__name__, tuple(attrs))
+    else:
+        return (type(arg).__name__, repr(arg))
+
+
+def basis_cache_key(func_name: str, signature: inspect.Signature, *args, **kwargs) -> str:
+    """
+    Computes the content address of a precomputed tensor from the function name, the bound arguments and the library versions
+    """
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    arguments = tuple((k, _normalize_argument(v)) for k, v in bound.arguments.items())
+    key = repr((func_name, th.__version__, torch.__version__, arguments))
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _cached(func_name, func, cache_dir):
+    # torch-harmonics wraps the precomputation routines in its own cache, the signature of the original routine is used
+    # to bind the arguments, so that positional and keyword arguments map to the same key
+    signature = inspect.signature(inspect.unwrap(func))
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = basis_cache_key(func_name, signature, *args, **kwargs)
+        path = os.path.join(cache_dir, f"{func_name}_{key}.pt")
+
+        # the file is mapped copy-on-write, so that callers modifying the result in place do not affect the cache
+        if os.path.isfile(path):
+            try:
+                return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+            except Exception as err:
+                logging.warning(f"Could not load cached basis {path}, recomputing: {err}")
+
+        result = func(*args, **kwargs)
+
+        # write to a temporary file first, so that concurrent ranks never observe partially written files
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            torch.save(result, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as err:
+            logging.warning(f"Could not write cached basis {path}: {err}")
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+
+        return result
+
+    return wrapper
+
+
+def enable_basis_cache(cache_dir: str):
+    """
+    Enables the on-disk cache for the Legendre and DISCO basis tensors precomputed by torch-harmonics.
+    Entries are content-addressed by function name, arguments and library version, so that the cache can be shared between
+    runs, models and ranks. Tensors are memory-mapped on load. Has to be called before the modules are constructed.
+    """
+    global _cache_dir
+
+    cache_dir = os.path.abspath(cache_dir)
+    if _cache_dir == cache_dir:
+        return
+
+    disable_basis_cache()
+    os.makedirs(cache_dir, exist_ok=True)
+
+    for func_name, module_names in _CACHED_FUNCTIONS.items():
+        for module_name in module_names:
+            try:
+                module = importlib.import_module(module_name)
+            except ImportError:
+                continue
+
+            # older versions of torch-harmonics might not provide all routines
+            func = getattr(module, func_name, None)
+            if func is None:
+                continue
+
+            _original_functions[(module_name, func_name)] = func
+            setattr(module, func_name, _cached(func_name, func, cache_dir))
+
+    _cache_dir = cache_dir
+
+    return
+
+
+def disable_basis_cache():
+    """Restores the original precomputation routines"""
+    global _cache_dir
+
+    for (module_name, func_name), func in _original_functions.items():
+        setattr(importlib.import_module(module_name), func_name, func)
+
+    _original_functions.clear()
+    _cache_dir = None
+
+    return
+
+
+def get_basis_cache_dir() -> Optional[str]:
+    return _cache_dir
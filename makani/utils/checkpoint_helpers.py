@@ -16,18 +16,23 @@
 import os
 import glob
 import re
+import math
 
 from collections import OrderedDict
-from typing import Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Tuple, Callable
+
+import numpy as np
 
 import torch
 import torch.nn as nn
+import torch.distributed as dist
 from torch.optim import Optimizer
 
 from makani.utils import comm
 from makani.mpu.helpers import gather_uneven
 
-from physicsnemo.distributed.utils import split_tensor_along_dim
+from physicsnemo.distributed.utils import split_tensor_along_dim, compute_split_shapes
 
 
 def get_latest_checkpoint_version(checkpoint_path):
@@ -42,8 +47,9 @@ def get_latest_checkpoint_version(checkpoint_path):
     return latest_version
 
 
-def gather_model_state_dict(model: nn.Module, grads: Optional[bool]=False) -> OrderedDict:
-    # create empty dict to hold the state
+def gather_model_state_dict(model: nn.Module, grads: Optional[bool]=False, to_cpu: Optional[bool]=True) -> OrderedDict:
+    # create empty dict to hold the state. If to_cpu is False, the gathered tensors remain on the device, e.g. for the
+    # asynchronous checkpoint writer, which copies them to the host in a coalesced fashion
     state_dict = OrderedDict()
 
     # iterate over parameters and gather them from the ranks
@@ -55,7 +61,7 @@ def gather_model_state_dict(model: nn.Module, grads: Optional[bool]=False) -> Or
                 if group is not None:
                     weight = gather_uneven(weight, d, group)
 
-        state_dict[name] = weight.cpu()
+        state_dict[name] = weight.cpu() if to_cpu else weight
 
         if grads:
             if param.grad is not None:
@@ -64,7 +70,7 @@ def gather_model_state_dict(model: nn.Module, grads: Optional[bool]=False) -> Or
                     for d, group in enumerate(param.sharded_dims_mp):
                         if group is not None:
                             grad = gather_uneven(grad, d, group)
-                grad = grad.cpu()
+                grad = grad.cpu() if to_cpu else grad
             else:
                 grad = None
 
@@ -215,3 +221,432 @@ def prepend_prefix_to_state_dict(
             if len(key) >= 0:
                 newkey = prefix + key
                 state_dict._metadata[newkey] = state_dict._metadata.pop(key)
+
+
+def get_comm_grid() -> OrderedDict:
+    """
+    returns sizes and ranks of all model parallel communicators of the current rank
+    """
+    comm_dict = OrderedDict()
+    for cname in comm.get_model_comm_names():
+        comm_dict[cname] = {"size": comm.get_size(cname), "rank": comm.get_rank(cname)}
+    return comm_dict
+
+
+def get_sharding_manifest(comm_grid: OrderedDict) -> Dict[str, Any]:
+    """
+    collects the comm grids of all model parallel ranks. The manifest is stored with the first shard of a sharded checkpoint
+    and describes the layout of all shards, so that they can be reassembled in any other model parallel configuration
+    """
+    comm_grids = [comm_grid]
+    if dist.is_initialized() and (comm.get_size("model") > 1):
+        comm_grids = [None for _ in range(comm.get_size("model"))]
+        dist.all_gather_object(comm_grids, comm_grid, group=comm.get_group("model"))
+
+    return {"format_version": 1, "num_shards": len(comm_grids), "comm_grids": comm_grids}
+
+
+def _concat_blocks(blocks: Dict[tuple, torch.Tensor], dims: List[tuple]) -> torch.Tensor:
+    """
+    recursively concatenates blocks indexed by their coordinates along the sharded dimensions
+    """
+    if not dims:
+        return next(iter(blocks.values()))
+
+    dim = dims[0][0]
+    coords = sorted(set(key[0] for key in blocks.keys()))
+    parts = [_concat_blocks({key[1:]: block for key, block in blocks.items() if key[0] == c}, dims[1:]) for c in coords]
+
+    return torch.cat(parts, dim=dim)
+
+
+def _assemble_shards(tensors: List[torch.Tensor], comm_grids: List[Dict], sharded_dims_mp: List[Optional[str]]) -> torch.Tensor:
+    """
+    reassembles a full tensor from the local tensors of all shards. Shards which hold the same block, e.g. because
+    the tensor is replicated along some of the communicators, are only used once
+    """
+    dims = [(d, group) for d, group in enumerate(sharded_dims_mp) if (group is not None) and (comm_grids[0].get(group, {"size": 1})["size"] > 1)]
+
+    blocks = {}
+    for tensor, grid in zip(tensors, comm_grids):
+        coord = tuple(grid[group]["rank"] for _, group in dims)
+        blocks.setdefault(coord, tensor)
+
+    return _concat_blocks(blocks, dims)
+
+
+def _split_to_local(tensor: torch.Tensor, sharded_dims_mp: List[Optional[str]]) -> torch.Tensor:
+    """
+    extracts the local part of a full tensor according to the current model parallel layout
+    """
+    for d, group in enumerate(sharded_dims_mp):
+        # continue if there is nothing to do
+        if (group is None) or (comm.get_size(group) == 1):
+            continue
+
+        tensor = split_tensor_along_dim(tensor, dim=d, num_chunks=comm.get_size(group))[comm.get_rank(group)]
+
+    return tensor
+
+
+def _reshard_tensor(
+    key: str, tensors: List[torch.Tensor], comm_grids: List[Dict], sharded_dims_mp: Optional[List], local_sharded_dims_mp: Optional[List]
+) -> torch.Tensor:
+    if sharded_dims_mp is not None:
+        tensor = _assemble_shards(tensors, comm_grids, sharded_dims_mp)
+    else:
+        # entries which are not sharded, such as buffers, have to be replicated across all shards
+        tensor = tensors[0]
+        for shard, other in enumerate(tensors[1:], start=1):
+            if (other.shape != tensor.shape) or (other.dtype != tensor.dtype) or not torch.equal(other, tensor):
+                raise ValueError(f"Error, entry {key} is not sharded but differs between shard 0 and shard {shard}.")
+
+    if local_sharded_dims_mp is not None:
+        tensor = _split_to_local(tensor, local_sharded_dims_mp)
+
+    return tensor.clone()
+
+
+def reshard_model_state_dict(
+    shards: List[Dict[str, Any]], comm_grids: List[Dict], sharded_dims_mp: Dict[str, List], local_sharded_dims_mp: Dict[str, List]
+) -> OrderedDict:
+    """
+    assembles the model state dict for the local rank from the state dicts of all shards of a sharded checkpoint.
+    sharded_dims_mp describes the layout of the tensors in the checkpoint, local_sharded_dims_mp the layout of the current model.
+    Entries which are not sharded in the checkpoint, such as buffers, have to agree across all shards and are taken from the first shard
+    """
+    state_dict = OrderedDict()
+    for key in shards[0].keys():
+        tensors = [shard[key] for shard in shards]
+        state_dict[key] = _reshard_tensor(key, tensors, comm_grids, sharded_dims_mp.get(key, None), local_sharded_dims_mp.get(key, None))
+
+    # preserve metadata such as module versions
+    if hasattr(shards[0], "_metadata"):
+        state_dict._metadata = shards[0]._metadata
+
+    return state_dict
+
+
+def reshard_optimizer_state_dict(
+    shards: List[Dict[str, Any]], comm_grids: List[Dict], parameter_names: List[str], sharded_dims_mp: Dict[str, List], local_sharded_dims_mp: Dict[str, List]
+) -> Dict[str, Any]:
+    """
+    assembles the optimizer state dict for the local rank from the optimizer state dicts of all shards. Per-parameter states
+    which have the same shape as the parameter, such as the moments in Adam, follow the sharding of the parameter.
+    All other states, such as step counters, are taken from the first shard
+    """
+    optimizer_state_dict = {"param_groups": shards[0]["param_groups"], "state": {}}
+
+    for index, states in shards[0]["state"].items():
+        name = parameter_names[index]
+        optimizer_state_dict["state"][index] = {}
+        for key, value in states.items():
+            if isinstance(value, torch.Tensor) and (value.dim() > 0):
+                tensors = [shard["state"][index][key] for shard in shards]
+                value = _reshard_tensor(f"{name}.{key}", tensors, comm_grids, sharded_dims_mp.get(name, None), local_sharded_dims_mp.get(name, None))
+            optimizer_state_dict["state"][index][key] = value
+
+    return optimizer_state_dict
+
+
+def _map_tensors(obj: Any, fn) -> Any:
+    """
+    applies fn to all tensors in a nested structure of dicts, lists and tuples
+    """
+    if isinstance(obj, torch.Tensor):
+        return fn(obj)
+    elif isinstance(obj, dict):
+        result = obj.__class__()
+        for key, value in obj.items():
+            result[key] = _map_tensors(value, fn)
+        if hasattr(obj, "_metadata"):
+            result._metadata = obj._metadata
+        return result
+    elif isinstance(obj, (list, tuple)):
+        return obj.__class__(_map_tensors(value, fn) for value in obj)
+    else:
+        return obj
+
+
+def _write_checkpoint_file(store_dict: Dict[str, Any], checkpoint_fname: str, event: Optional[torch.cuda.Event] = None):
+    # wait for the device to host copies to complete
+    if event is not None:
+        event.synchronize()
+
+    # write to a temporary file first, so that a crash never leaves a truncated checkpoint behind
+    tmp_fname = checkpoint_fname + ".tmp"
+    torch.save(store_dict, tmp_fname)
+    os.replace(tmp_fname, checkpoint_fname)
+
+    return checkpoint_fname
+
+
+class AsyncCheckpointWriter(object):
+    """
+    Writes checkpoints off the training critical path. On save, all tensors of the checkpoint are copied into
+    one pinned host staging buffer per dtype. The copies are issued on a side stream without blocking the host,
+    the compute stream only waits for the copies before it can modify the parameters again. Serialization to disk
+    happens in a background thread. Only max_pending snapshots are kept in flight to bound the host memory footprint.
+    Staging buffers are returned to a pool once their snapshot is written and reused by subsequent saves of the same size.
+    """
+
+    def __init__(self, max_pending: Optional[int] = 2):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint_writer")
+        self._pending = []
+        self._staging_buffers = {}
+        self._stream = torch.cuda.Stream() if torch.cuda.is_available() else None
+
+    def _get_staging_buffer(self, dtype: torch.dtype, numel: int) -> torch.Tensor:
+        free_buffers = self._staging_buffers.get((dtype, numel), [])
+        if free_buffers:
+            return free_buffers.pop()
+        return torch.empty(numel, dtype=dtype, pin_memory=(self._stream is not None))
+
+    def _release_staging_buffers(self, buffers: Dict[torch.dtype, torch.Tensor]):
+        for dtype, buffer in buffers.items():
+            self._staging_buffers.setdefault((dtype, buffer.numel()), []).append(buffer)
+
+    def _finish(self, job):
+        # re-raises errors of the background thread. The staging buffers are only reused once the write has finished
+        future, buffers = job
+        try:
+            future.result()
+        finally:
+            self._release_staging_buffers(buffers)
+
+    def _snapshot(self, store_dict: Dict[str, Any]):
+        # collect all tensors and get staging buffers
+        tensors = []
+        _map_tensors(store_dict, tensors.append)
+
+        numels = OrderedDict()
+        for tensor in tensors:
+            numels[tensor.dtype] = numels.get(tensor.dtype, 0) + tensor.numel()
+        buffers = {dtype: self._get_staging_buffer(dtype, numel) for dtype, numel in numels.items()}
+        offsets = {dtype: 0 for dtype in numels.keys()}
+
+        def _copy_to_host(tensor):
+            offset = offsets[tensor.dtype]
+            offsets[tensor.dtype] = offset + tensor.numel()
+            host_tensor = buffers[tensor.dtype][offset : offset + tensor.numel()].view(tensor.shape)
+            host_tensor.copy_(tensor.detach(), non_blocking=True)
+            # keep attributes such as the sharding information
+            host_tensor.__dict__.update(tensor.__dict__)
+            return host_tensor
+
+        if (self._stream is not None) and any(tensor.is_cuda for tensor in tensors):
+            compute_stream = torch.cuda.current_stream()
+            self._stream.wait_stream(compute_stream)
+            with torch.cuda.stream(self._stream):
+                host_dict = _map_tensors(store_dict, _copy_to_host)
+                event = torch.cuda.Event()
+                event.record(self._stream)
+            # the compute stream must not modify the state before the copies are done
+            compute_stream.wait_stream(self._stream)
+        else:
+            host_dict = _map_tensors(store_dict, _copy_to_host)
+            event = None
+
+        return host_dict, event, buffers
+
+    def save(self, store_dict: Dict[str, Any], checkpoint_fname: str):
+        """
+        snapshots the checkpoint to host memory and schedules writing it to checkpoint_fname
+        """
+        # drop finished jobs, re-raising their errors, and wait if too many snapshots are in flight
+        pending = []
+        for job in self._pending:
+            if job[0].done():
+                self._finish(job)
+            else:
+                pending.append(job)
+        self._pending = pending
+        while len(self._pending) >= self.max_pending:
+            self._finish(self._pending.pop(0))
+
+        host_dict, event, buffers = self._snapshot(store_dict)
+        self._pending.append((self._executor.submit(_write_checkpoint_file, host_dict, checkpoint_fname, event), buffers))
+
+        return
+
+    def wait(self):
+        """
+        blocks until all scheduled checkpoints are written. Errors raised in the background thread are re-raised here
+        """
+        while self._pending:
+            self._finish(self._pending.pop(0))
+
+        return
+
+
+# alignment of the tensors in the data file of indexed checkpoints in bytes
+_INDEXED_CHECKPOINT_ALIGNMENT = 4096
+
+
+def _model_parallel_barrier():
+    if dist.is_initialized() and (comm.get_size("model") > 1):
+        dist.barrier(group=comm.get_group("model"))
+
+
+def _compute_block_layout(local_shapes: List[List[int]], comm_grids: List[Dict], sharded_dims_mp: Optional[List]) -> Tuple[List[int], List[List[int]], List[bool]]:
+    """
+    computes the global shape of a tensor from the local shapes on all model parallel ranks, as well as the offset of the
+    block held by each rank. Since blocks can be replicated across ranks, only the first rank holding a block is marked as writer
+    """
+    sharded_dims_mp = sharded_dims_mp if sharded_dims_mp is not None else []
+    dims = [(d, group) for d, group in enumerate(sharded_dims_mp) if (group is not None) and (comm_grids[0].get(group, {"size": 1})["size"] > 1)]
+    coords = [tuple(grid[group]["rank"] for _, group in dims) for grid in comm_grids]
+
+    global_shape = list(local_shapes[0])
+    offsets = [[0 for _ in global_shape] for _ in comm_grids]
+    for i, (d, _) in enumerate(dims):
+        # extent of the blocks along the sharded dimension
+        extents = {}
+        for coord, shape in zip(coords, local_shapes):
+            extents.setdefault(coord[i], shape[d])
+        global_shape[d] = sum(extents.values())
+
+        # start of each block
+        starts = {}
+        start = 0
+        for c in sorted(extents.keys()):
+            starts[c] = start
+            start += extents[c]
+        for rank, coord in enumerate(coords):
+            offsets[rank][d] = starts[coord[i]]
+
+    writers = []
+    for rank, coord in enumerate(coords):
+        writers.append(coord not in coords[:rank])
+
+    return global_shape, offsets, writers
+
+
+def _local_hyperslab(global_shape: List[int], sharded_dims_mp: Optional[List]) -> Tuple[List[int], List[int]]:
+    """
+    computes offset and shape of the part of a global tensor which is held by the local rank in the current model parallel layout
+    """
+    offsets = [0 for _ in global_shape]
+    shape = list(global_shape)
+
+    if sharded_dims_mp is not None:
+        for d, group in enumerate(sharded_dims_mp):
+            if (group is None) or (comm.get_size(group) == 1):
+                continue
+            split_shapes = compute_split_shapes(global_shape[d], comm.get_size(group))
+            offsets[d] = sum(split_shapes[: comm.get_rank(group)])
+            shape[d] = split_shapes[comm.get_rank(group)]
+
+    return offsets, shape
+
+
+def _byte_view(data: np.memmap, entry: Dict[str, Any], itemsize: int) -> np.ndarray:
+    """
+    returns a byte view of a tensor inside the data file. The last dimension is expressed in bytes, so that arbitrary dtypes
+    including bfloat16 can be handled
+    """
+    shape = entry["shape"] if len(entry["shape"]) > 0 else [1]
+    nbytes = math.prod(shape) * itemsize
+    return data[entry["offset"] : entry["offset"] + nbytes].reshape(*shape[:-1], shape[-1] * itemsize)
+
+
+def _byte_slices(offsets: List[int], shape: List[int], itemsize: int) -> tuple:
+    offsets = offsets if len(offsets) > 0 else [0]
+    shape = shape if len(shape) > 0 else [1]
+    slices = tuple(slice(o, o + n) for o, n in zip(offsets[:-1], shape[:-1]))
+    return slices + (slice(offsets[-1] * itemsize, (offsets[-1] + shape[-1]) * itemsize),)
+
+
+def save_indexed_checkpoint(checkpoint_fname: str, tensors: Dict[str, torch.Tensor], sharded_dims_mp: Dict[str, List], header: Dict[str, Any]):
+    """
+    Saves a checkpoint in indexed format. The tensors are stored in global layout in a raw data file next to the checkpoint file,
+    where each model parallel rank writes its own blocks directly. No tensors are gathered. The checkpoint file itself only contains
+    the header, i.e. all non-tensor states, as well as the tensor index which maps each tensor name to offset, shape, dtype and
+    sharding information. This allows each rank to memory map the data file and read only the hyperslab it needs on restore.
+    Has to be called collectively by all model parallel ranks.
+    """
+    comm_grid = get_comm_grid()
+    local_meta = OrderedDict((key, (list(tensor.shape), str(tensor.dtype).replace("torch.", ""))) for key, tensor in tensors.items())
+
+    # gather the metadata of all model parallel ranks
+    metas = [(comm_grid, local_meta)]
+    if dist.is_initialized() and (comm.get_size("model") > 1):
+        metas = [None for _ in range(comm.get_size("model"))]
+        dist.all_gather_object(metas, (comm_grid, local_meta), group=comm.get_group("model"))
+    comm_grids = [meta[0] for meta in metas]
+    mp_rank = comm.get_rank("model")
+
+    # build the index. All ranks compute the same index, no broadcast necessary
+    index = OrderedDict()
+    blocks = []
+    offset = 0
+    for key, (shape, dtype) in local_meta.items():
+        global_shape, block_offsets, writers = _compute_block_layout([meta[1][key][0] for meta in metas], comm_grids, sharded_dims_mp.get(key, None))
+        index[key] = {"offset": offset, "shape": global_shape, "dtype": dtype, "sharded_dims_mp": sharded_dims_mp.get(key, None)}
+        if writers[mp_rank] and (tensors[key].numel() > 0):
+            blocks.append((key, block_offsets[mp_rank]))
+        nbytes = math.prod(global_shape) * tensors[key].element_size()
+        offset += math.ceil(nbytes / _INDEXED_CHECKPOINT_ALIGNMENT) * _INDEXED_CHECKPOINT_ALIGNMENT
+
+    # the first rank writes the header and allocates the data file
+    data_fname = checkpoint_fname + ".data"
+    if mp_rank == 0:
+        with open(data_fname, "wb") as f:
+            f.truncate(offset)
+        header = dict(header)
+        header["tensor_index"] = index
+        header["data_file"] = os.path.basename(data_fname)
+        torch.save(header, checkpoint_fname)
+
+    _model_parallel_barrier()
+
+    # each rank writes its own blocks
+    if blocks:
+        data = np.memmap(data_fname, dtype=np.uint8, mode="r+", shape=(offset,))
+        for key, block_offsets in blocks:
+            tensor = tensors[key].detach().cpu().contiguous()
+            itemsize = tensor.element_size()
+            block = tensor.reshape(list(tensor.shape) if tensor.dim() > 0 else [1]).view(torch.uint8).numpy()
+            _byte_view(data, index[key], itemsize)[_byte_slices(block_offsets, list(tensor.shape), itemsize)] = block
+        data.flush()
+        del data
+
+    _model_parallel_barrier()
+
+    return
+
+
+def load_indexed_checkpoint(
+    checkpoint_fname: str, get_sharded_dims_mp: Optional[Callable[[str], Optional[List]]] = None, prefixes: Optional[List[str]] = None
+) -> Tuple[Dict[str, Any], OrderedDict]:
+    """
+    Loads a checkpoint in indexed format. The data file is memory mapped and for each tensor only the hyperslab corresponding to
+    the current model parallel layout is read. get_sharded_dims_mp maps a tensor name to the sharding of the tensor in the current
+    layout, tensors for which it returns None are read entirely. If prefixes are specified, only tensors whose name starts with one
+    of the prefixes are read. Returns the header and the dictionary of local tensors.
+    """
+    header = torch.load(checkpoint_fname, map_location="cpu", weights_only=False)
+    data_fname = os.path.join(os.path.dirname(checkpoint_fname), header["data_file"])
+    data = np.memmap(data_fname, dtype=np.uint8, mode="r")
+
+    tensors = OrderedDict()
+    for key, entry in header["tensor_index"].items():
+        if (prefixes is not None) and not any(key.startswith(prefix) for prefix in prefixes):
+            continue
+
+        dtype = getattr(torch, entry["dtype"])
+        sharded_dims_mp = get_sharded_dims_mp(key) if get_sharded_dims_mp is not None else None
+        offsets, shape = _local_hyperslab(entry["shape"], sharded_dims_mp)
+
+        if math.prod(shape) == 0:
+            tensors[key] = torch.empty(shape, dtype=dtype)
+            continue
+
+        itemsize = torch.empty((), dtype=dtype).element_size()
+        block = np.array(_byte_view(data, entry, itemsize)[_byte_slices(offsets, shape, itemsize)], copy=True, order="C")
+        tensors[key] = torch.from_numpy(block).view(dtype).reshape(shape)
+
+    del data
+
+    return header, tensors
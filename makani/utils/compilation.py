@@ -0,0 +1,149 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import hashlib
+import functools
+import logging
+from typing import Optional
+
+import torch
+import torch.nn as nn
+
+# parameters which determine the compiled graphs. Everything else is covered by the content hashing of inductor
+_COMPILE_CACHE_KEYS = [
+    "nettype",
+    "img_crop_shape_x",
+    "img_crop_shape_y",
+    "N_in_channels",
+    "N_out_channels",
+    "n_history",
+    "amp_mode",
+    "jit_mode",
+    "checkpointing_level",
+    "batch_size",
+    "ensemble_size",
+    "model_parallel_sizes",
+    "data_parallel_sizes",
+]
+
+# kernels decorated with compile_kernel are only compiled once this is enabled
+_kernel_compilation_enabled = False
+
+
+def compile_cache_key(params=None) -> str:
+    """
+    computes the key of the compile cache from the torch version and the parameters which determine the compiled graphs
+    """
+    config = {"torch": torch.__version__}
+    if params is not None:
+        config.update({key: params.get(key, None) for key in _COMPILE_CACHE_KEYS})
+
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def enable_compile_cache(cache_dir: str, params=None) -> str:
+    """
+    Enables the persistent on-disk caches of inductor and triton in a subdirectory of cache_dir which is keyed by the
+    configuration, so that restarted jobs pick up the compiled FX graphs, AOT autograd graphs and kernels of the previous run.
+    The caches are safe to share between ranks. Has to be called before the first compilation. Returns the cache directory.
+    """
+    cache_dir = os.path.join(os.path.abspath(cache_dir), compile_cache_key(params))
+    os.makedirs(cache_dir, exist_ok=True)
+
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = cache_dir
+    os.environ["TRITON_CACHE_DIR"] = os.path.join(cache_dir, "triton")
+
+    import torch._inductor.config as inductor_config
+
+    inductor_config.fx_graph_cache = True
+    if hasattr(inductor_config, "autotune_local_cache"):
+        inductor_config.autotune_local_cache = True
+
+    # caching of the joint forward and backward graphs is only available in recent versions
+    import torch._functorch.config as functorch_config
+
+    if hasattr(functorch_config, "enable_autograd_cache"):
+        functorch_config.enable_autograd_cache = True
+
+    return cache_dir
+
+
+def enable_kernel_compilation(enabled: Optional[bool] = True):
+    """enables the compilation of the kernels decorated with compile_kernel, e.g. the CRPS kernels"""
+    global _kernel_compilation_enabled
+    _kernel_compilation_enabled = enabled
+
+
+def compile_kernel(func):
+    """
+    Decorator for pointwise and reduction kernels which are compiled with dynamic shapes on first use if kernel compilation is
+    enabled, so that different ensemble sizes and chunks reuse the same compiled kernel.
+    """
+    compiled = None
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        nonlocal compiled
+        if not _kernel_compilation_enabled:
+            return func(*args, **kwargs)
+
+        if compiled is None:
+            compiled = torch.compile(func, dynamic=True)
+
+        return compiled(*args, **kwargs)
+
+    return wrapper
+
+
+def _get_regions(model: nn.Module):
+    """returns the repeated blocks of the model, i.e. the entries of all module lists named blocks"""
+    regions = []
+    for name, module in model.named_modules():
+        if isinstance(module, nn.ModuleList) and (name.split(".")[-1] == "blocks"):
+            regions += list(module)
+
+    return regions
+
+
+def compile_regions(model: nn.Module, dynamic_batch: Optional[bool] = True, **compile_kwargs) -> int:
+    """
+    Region-level compilation: compiles the processor blocks of the model in place instead of the whole model. Since identical
+    blocks share their code, the graph is traced and compiled once and reused across the blocks, while the encoder, decoder and
+    the DISCO and SHT code paths outside of the blocks remain in eager mode. With dynamic_batch, the leading dimension, which
+    holds the batch and ensemble members, is marked as dynamic to avoid recompilation for different batch or ensemble sizes.
+    Parameter names are unaffected, so that checkpoints remain compatible. Returns the number of compiled blocks.
+    """
+    regions = _get_regions(model)
+
+    for block in regions:
+        block.compile(**compile_kwargs)
+
+        # nn.Module.compile stores the compiled call in _compiled_call_impl. The dynamic dimension has to be marked on the input
+        # outside of the compiled region
+        if dynamic_batch:
+            compiled_call = block._compiled_call_impl
+
+            def call_with_dynamic_batch(x, *args, _compiled_call=compiled_call, **kwargs):
+                torch._dynamo.maybe_mark_dynamic(x, 0)
+                return _compiled_call(x, *args, **kwargs)
+
+            block._compiled_call_impl = call_with_dynamic_batch
+
+    if len(regions) == 0:
+        logging.warning(f"Model {type(model).__name__} does not have any blocks to compile.")
+
+    return len(regions)
@@ -36,6 +36,7 @@ import wandb
 from makani.utils.YParams import YParams
 from makani.utils.features import get_auxiliary_channels
 from makani.utils import comm
+from makani.utils.basis_cache import enable_basis_cache
 from makani.utils.dataloaders.data_helpers import get_data_normalization
 from makani.utils.checkpoint_helpers import (
     gather_model_state_dict,
@@ -43,6 +44,13 @@ from makani.utils.checkpoint_helpers import (
     gather_optimizer_state_dict,
     scatter_optimizer_state_dict,
     prepend_prefix_to_state_dict,
+    get_comm_grid,
+    get_sharding_manifest,
+    reshard_model_state_dict,
+    reshard_optimizer_state_dict,
+    save_indexed_checkpoint,
+    load_indexed_checkpoint,
+    AsyncCheckpointWriter,
 )
 
 # for flexible checkpoints
@@ -70,6 +78,10 @@ class Driver(metaclass=abc.ABCMeta):
         # update params
         self.params = self._set_default_parameters(params)
 
+        # cache the precomputed spectral and DISCO basis tensors on disk if requested
+        if self.params.get("basis_cache_dir", None) is not None:
+            enable_basis_cache(self.params.basis_cache_dir)
+
         # set up distributed communicators, even if it is a non-distributed instance
         self.world_rank = world_rank
         self.data_parallel_rank = comm.get_rank("data")
@@ -91,6 +103,9 @@ class Driver(metaclass=abc.ABCMeta):
         # set wandb
         self.log_to_wandb = self.params.log_to_wandb if (hasattr(params, "log_to_wandb") and params.log_to_wandb) else False
 
+        # checkpoints are written in the background if requested
+        self.checkpoint_writer = AsyncCheckpointWriter() if self.params.async_checkpoint else None
+
     def __del__(self):
         if hasattr(self, "log_to_wandb") and self.log_to_wandb:
             wandb.finish()
@@ -143,6 +158,9 @@ class Driver(metaclass=abc.ABCMeta):
         if not  hasattr(params, "checkpoint_num_versions"):
             params["checkpoint_num_versions"] = 3
 
+        if not hasattr(params, "async_checkpoint"):
+            params["async_checkpoint"] = False
+
         return params
 
     def _set_data_shapes(self, params, dataset):
@@ -360,6 +378,12 @@ class Driver(metaclass=abc.ABCMeta):
             elif checkpoint_mode == "flexible":
                 # new flexible mode allows to load models in arbitrary model-parallel configurations
                 Driver._restore_checkpoint_flexible(checkpoint_path, model, loss, optimizer, scheduler, counters, strict=strict)
+            elif checkpoint_mode == "sharded":
+                # sharded mode stores one file per model parallel rank but can be restored in arbitrary model-parallel configurations
+                Driver._restore_checkpoint_sharded(checkpoint_path, model, loss, optimizer, scheduler, counters, strict=strict)
+            elif checkpoint_mode == "indexed":
+                # indexed mode reads only the local part of each tensor from a memory mapped file
+                Driver._restore_checkpoint_indexed(checkpoint_path, model, loss, optimizer, scheduler, counters, strict=strict)
             else:
                 raise ValueError(f"Unknown checkoint mode {checkpoint_mode}.")
 
@@ -479,6 +503,127 @@ class Driver(metaclass=abc.ABCMeta):
 
         return
 
+    @staticmethod
+    def _restore_checkpoint_sharded(
+        checkpoint_path: str,
+        model: nn.Module,
+        loss: Optional[nn.Module] = None,
+        optimizer: Optional[optim.Optimizer] = None,
+        scheduler: Optional[lr_scheduler.LRScheduler] = None,
+        counters: Optional[Dict[str, int]] = None,
+        strict: bool = True,
+    ):
+        # the first shard holds the manifest which describes the layout of all shards
+        checkpoint = torch.load(checkpoint_path.format(mp_rank=0), map_location="cpu", weights_only=False, mmap=True)
+        manifest = checkpoint["manifest"]
+        comm_grids = manifest["comm_grids"]
+
+        # if the layout did not change, every rank only needs its own shard. Otherwise, all shards are opened.
+        # the files are memory mapped, so that only the data which is actually needed is read
+        mp_rank = comm.get_rank("model")
+        if (manifest["num_shards"] == comm.get_size("model")) and (comm_grids[mp_rank] == get_comm_grid()):
+            checkpoints = [torch.load(checkpoint_path.format(mp_rank=mp_rank), map_location="cpu", weights_only=False, mmap=True)]
+            comm_grids = [comm_grids[mp_rank]]
+            sharded_dims_mp = {}
+            local_sharded_dims_mp = {}
+        else:
+            checkpoints = [checkpoint] + [
+                torch.load(checkpoint_path.format(mp_rank=shard), map_location="cpu", weights_only=False, mmap=True) for shard in range(1, manifest["num_shards"])
+            ]
+            sharded_dims_mp = checkpoint["sharded_dims_mp"]
+            base_model = model.module if isinstance(model, nn.parallel.DistributedDataParallel) else model
+            local_sharded_dims_mp = {name: param.sharded_dims_mp for name, param in base_model.named_parameters() if hasattr(param, "sharded_dims_mp")}
+
+        state_dict = reshard_model_state_dict([ckpt["model_state"] for ckpt in checkpoints], comm_grids, sharded_dims_mp, local_sharded_dims_mp)
+
+        if isinstance(model, nn.parallel.DistributedDataParallel):
+            # prepend module prefix to state dict:
+            prepend_prefix_to_state_dict(state_dict, "module.")
+
+        # load state dict
+        model.load_state_dict(state_dict, strict=strict)
+
+        # the loss is also restored in the case that it has a state
+        if loss is not None:
+            loss.load_state_dict(checkpoint["loss_state_dict"])
+
+        # If finetuning, restore checkpoint does not load optimizer state, instead uses config specified lr.
+        if optimizer is not None:
+            optimizer_state_dict = reshard_optimizer_state_dict(
+                [ckpt["optimizer_state_dict"] for ckpt in checkpoints], comm_grids, checkpoint["parameter_names"], sharded_dims_mp, local_sharded_dims_mp
+            )
+            optimizer.load_state_dict(optimizer_state_dict)
+
+        if scheduler is not None:
+            scheduler.load_state_dict(checkpoint["scheduler_state_dict"])
+
+        if counters is not None:
+            counters["iters"] = checkpoint["iters"]
+            counters["start_epoch"] = checkpoint["epoch"]
+
+        return
+
+    @staticmethod
+    def _restore_checkpoint_indexed(
+        checkpoint_path: str,
+        model: nn.Module,
+        loss: Optional[nn.Module] = None,
+        optimizer: Optional[optim.Optimizer] = None,
+        scheduler: Optional[lr_scheduler.LRScheduler] = None,
+        counters: Optional[Dict[str, int]] = None,
+        strict: bool = True,
+    ):
+        # indexed checkpoints consist of a single header file and a data file
+        checkpoint_fname = checkpoint_path.format(mp_rank=0)
+
+        # sharding of the parameters in the current layout
+        base_model = model.module if isinstance(model, nn.parallel.DistributedDataParallel) else model
+        parameter_names = [name for name, _ in base_model.named_parameters()]
+        local_sharded_dims_mp = {name: param.sharded_dims_mp for name, param in base_model.named_parameters() if hasattr(param, "sharded_dims_mp")}
+
+        def get_sharded_dims_mp(key):
+            prefix, name = key.split(".", 1)
+            if prefix == "optimizer_state":
+                name = parameter_names[int(name.split(".", 1)[0])]
+            return local_sharded_dims_mp.get(name, None)
+
+        # only read the optimizer states if they are needed
+        prefixes = ["model_state."]
+        if optimizer is not None:
+            prefixes.append("optimizer_state.")
+        header, tensors = load_indexed_checkpoint(checkpoint_fname, get_sharded_dims_mp, prefixes=prefixes)
+
+        state_dict = OrderedDict((key.split(".", 1)[1], value) for key, value in tensors.items() if key.startswith("model_state."))
+
+        if isinstance(model, nn.parallel.DistributedDataParallel):
+            # prepend module prefix to state dict:
+            prepend_prefix_to_state_dict(state_dict, "module.")
+
+        # load state dict
+        model.load_state_dict(state_dict, strict=strict)
+
+        # the loss is also restored in the case that it has a state
+        if loss is not None:
+            loss.load_state_dict(header["loss_state_dict"])
+
+        # If finetuning, restore checkpoint does not load optimizer state, instead uses config specified lr.
+        if optimizer is not None:
+            optimizer_state_dict = header["optimizer_state_dict"]
+            for key, value in tensors.items():
+                if key.startswith("optimizer_state."):
+                    _, index, state_key = key.split(".", 2)
+                    optimizer_state_dict["state"][int(index)][state_key] = value
+            optimizer.load_state_dict(optimizer_state_dict)
+
+        if scheduler is not None:
+            scheduler.load_state_dict(header["scheduler_state_dict"])
+
+        if counters is not None:
+            counters["iters"] = header["iters"]
+            counters["start_epoch"] = header["epoch"]
+
+        return
+
     @staticmethod
     def save_checkpoint(
         checkpoint_path: str,
@@ -488,16 +633,23 @@ class Driver(metaclass=abc.ABCMeta):
         scheduler: Optional[lr_scheduler.LRScheduler] = None,
         counters: Optional[Dict[str, int]] = None,
         checkpoint_mode: str = "legacy",
+        checkpoint_writer: Optional[AsyncCheckpointWriter] = None,
     ):
         """
-        Save out checkpoint
+        Save out checkpoint. If a checkpoint writer is passed, the checkpoint is snapshotted to host memory
+        and written to disk in the background. Call checkpoint_writer.wait() to make sure that it has been written
         """
         with torch.no_grad():
             # legacy mode
             if checkpoint_mode == "legacy":
-                Driver._save_checkpoint_legacy(checkpoint_path, model, loss, optimizer, scheduler, counters)
+                Driver._save_checkpoint_legacy(checkpoint_path, model, loss, optimizer, scheduler, counters, checkpoint_writer)
             elif checkpoint_mode == "flexible":
-                Driver._save_checkpoint_flexible(checkpoint_path, model, loss, optimizer, scheduler, counters)
+                Driver._save_checkpoint_flexible(checkpoint_path, model, loss, optimizer, scheduler, counters, checkpoint_writer)
+            elif checkpoint_mode == "sharded":
+                Driver._save_checkpoint_sharded(checkpoint_path, model, loss, optimizer, scheduler, counters, checkpoint_writer)
+            elif checkpoint_mode == "indexed":
+                # each rank writes its blocks directly into the shared data file, so this mode is always synchronous
+                Driver._save_checkpoint_indexed(checkpoint_path, model, loss, optimizer, scheduler, counters)
             else:
                 raise ValueError(f"Unknown checkoint mode {checkpoint_mode}.")
 
@@ -514,6 +666,7 @@ class Driver(metaclass=abc.ABCMeta):
         optimizer: Optional[optim.Optimizer] = None,
         scheduler: Optional[lr_scheduler.LRScheduler] = None,
         counters: Optional[Dict[str, int]] = None,
+        checkpoint_writer: Optional[AsyncCheckpointWriter] = None,
     ):
         # maybe the logic regarding the mp rank should be moved to somewhere else?
         checkpoint_fname = checkpoint_path.format(mp_rank=comm.get_rank("model"))
@@ -534,13 +687,7 @@ class Driver(metaclass=abc.ABCMeta):
         store_dict = {"model_state": state_dict}
 
         # comm infrastructure:
-        comm_names = comm.get_model_comm_names()
-        comm_dict = OrderedDict()
-        for cname in comm_names:
-            rank = comm.get_rank(cname)
-            size = comm.get_size(cname)
-            comm_dict[cname] = {"size": size, "rank": rank}
-        store_dict["comm_grid"] = comm_dict
+        store_dict["comm_grid"] = get_comm_grid()
 
         if loss is not None:
             store_dict["loss_state_dict"] = loss.state_dict()
@@ -555,7 +702,7 @@ class Driver(metaclass=abc.ABCMeta):
             store_dict["iters"] = counters["iters"]
             store_dict["epoch"] = counters["epoch"]
 
-        torch.save(store_dict, checkpoint_fname)
+        Driver._write_checkpoint(store_dict, checkpoint_fname, checkpoint_writer)
 
         return
 
@@ -567,13 +714,14 @@ class Driver(metaclass=abc.ABCMeta):
         optimizer: Optional[optim.Optimizer] = None,
         scheduler: Optional[lr_scheduler.LRScheduler] = None,
         counters: Optional[Dict[str, int]] = None,
+        checkpoint_writer: Optional[AsyncCheckpointWriter] = None,
     ):
         # checkpoint name
         checkpoint_fname = checkpoint_path.format(mp_rank=0)
 
         # iterate over parameters and gather them from the ranks
         if comm.get_size("model") > 1:
-            state_dict = gather_model_state_dict(model)
+            state_dict = gather_model_state_dict(model, to_cpu=(checkpoint_writer is None))
         else:
             state_dict = model.state_dict()
 
@@ -601,6 +749,118 @@ class Driver(metaclass=abc.ABCMeta):
 
         # in flexible mode only rank 0 needs to save the data to disk
         if comm.get_world_rank() == 0:
+            Driver._write_checkpoint(store_dict, checkpoint_fname, checkpoint_writer)
+
+        return
+
+    @staticmethod
+    def _save_checkpoint_sharded(
+        checkpoint_path: str,
+        model: nn.Module,
+        loss: Optional[nn.Module] = None,
+        optimizer: Optional[optim.Optimizer] = None,
+        scheduler: Optional[lr_scheduler.LRScheduler] = None,
+        counters: Optional[Dict[str, int]] = None,
+        checkpoint_writer: Optional[AsyncCheckpointWriter] = None,
+    ):
+        # every model parallel rank writes its local shard, no communication of the weights is required
+        mp_rank = comm.get_rank("model")
+        checkpoint_fname = checkpoint_path.format(mp_rank=mp_rank)
+
+        # drop module prefix in case if DDP is being used
+        base_model = model.module if isinstance(model, nn.parallel.DistributedDataParallel) else model
+        state_dict = base_model.state_dict()
+
+        # sharding information is required to reassemble the shards
+        sharded_dims_mp = {name: param.sharded_dims_mp for name, param in base_model.named_parameters() if hasattr(param, "sharded_dims_mp")}
+        parameter_names = [name for name, _ in base_model.named_parameters()]
+        comm_grid = get_comm_grid()
+
+        store_dict = {"model_state": state_dict, "sharded_dims_mp": sharded_dims_mp, "parameter_names": parameter_names, "comm_grid": comm_grid}
+
+        # the manifest describes the layout of all shards and is stored with the first one
+        manifest = get_sharding_manifest(comm_grid)
+        if mp_rank == 0:
+            store_dict["manifest"] = manifest
+
+        if loss is not None:
+            store_dict["loss_state_dict"] = loss.state_dict()
+
+        if optimizer is not None:
+            store_dict["optimizer_state_dict"] = optimizer.state_dict()
+
+        if scheduler is not None:
+            store_dict["scheduler_state_dict"] = scheduler.state_dict()
+
+        if counters is not None:
+            store_dict["iters"] = counters["iters"]
+            store_dict["epoch"] = counters["epoch"]
+
+        Driver._write_checkpoint(store_dict, checkpoint_fname, checkpoint_writer)
+
+        return
+
+    @staticmethod
+    def _save_checkpoint_indexed(
+        checkpoint_path: str,
+        model: nn.Module,
+        loss: Optional[nn.Module] = None,
+        optimizer: Optional[optim.Optimizer] = None,
+        scheduler: Optional[lr_scheduler.LRScheduler] = None,
+        counters: Optional[Dict[str, int]] = None,
+    ):
+        # indexed checkpoints consist of a single header file and a data file
+        checkpoint_fname = checkpoint_path.format(mp_rank=0)
+
+        # drop module prefix in case if DDP is being used
+        base_model = model.module if isinstance(model, nn.parallel.DistributedDataParallel) else model
+        parameter_names = [name for name, _ in base_model.named_parameters()]
+        param_sharded_dims_mp = {name: param.sharded_dims_mp for name, param in base_model.named_parameters() if hasattr(param, "sharded_dims_mp")}
+
+        # collect all tensors which go into the data file
+        tensors = OrderedDict()
+        sharded_dims_mp = {}
+        for name, tensor in base_model.state_dict().items():
+            tensors[f"model_state.{name}"] = tensor
+            if name in param_sharded_dims_mp:
+                sharded_dims_mp[f"model_state.{name}"] = param_sharded_dims_mp[name]
+
+        header = {"parameter_names": parameter_names}
+
+        # per-parameter optimizer states go into the data file, everything else into the header
+        if optimizer is not None:
+            optimizer_state_dict = optimizer.state_dict()
+            optimizer_header = {"param_groups": optimizer_state_dict["param_groups"], "state": {}}
+            for index, states in optimizer_state_dict["state"].items():
+                optimizer_header["state"][index] = {}
+                for key, value in states.items():
+                    if isinstance(value, torch.Tensor) and (value.dim() > 0):
+                        tensors[f"optimizer_state.{index}.{key}"] = value
+                        if parameter_names[index] in param_sharded_dims_mp:
+                            sharded_dims_mp[f"optimizer_state.{index}.{key}"] = param_sharded_dims_mp[parameter_names[index]]
+                    else:
+                        optimizer_header["state"][index][key] = value
+            header["optimizer_state_dict"] = optimizer_header
+
+        if loss is not None:
+            header["loss_state_dict"] = loss.state_dict()
+
+        if scheduler is not None:
+            header["scheduler_state_dict"] = scheduler.state_dict()
+
+        if counters is not None:
+            header["iters"] = counters["iters"]
+            header["epoch"] = counters["epoch"]
+
+        save_indexed_checkpoint(checkpoint_fname, tensors, sharded_dims_mp, header)
+
+        return
+
+    @staticmethod
+    def _write_checkpoint(store_dict: Dict, checkpoint_fname: str, checkpoint_writer: Optional[AsyncCheckpointWriter] = None):
+        if checkpoint_writer is not None:
+            checkpoint_writer.save(store_dict, checkpoint_fname)
+        else:
             torch.save(store_dict, checkpoint_fname)
 
         return
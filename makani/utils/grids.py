@@ -13,6 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from typing import Optional
+
 import numpy as np
 import torch
 
@@ -158,10 +160,17 @@ class GridQuadrature(torch.nn.Module):
 
         self.register_buffer("quad_weight", quad_weight, persistent=False)
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
-        # integrate over last two axes only:
-        quad = torch.sum(x * self.quad_weight, dim=(-2, -1))
+    def reduce(self, quad: torch.Tensor) -> torch.Tensor:
+        # sum local partial integrals across spatial ranks
         if self.distributed and (comm.get_size("spatial") > 1):
             quad = reduce_from_parallel_region(quad.contiguous(), "spatial")
 
         return quad
+
+    def forward(self, x: torch.Tensor, reduce: Optional[bool] = True) -> torch.Tensor:
+        # integrate over last two axes only:
+        quad = torch.sum(x * self.quad_weight, dim=(-2, -1))
+        if reduce:
+            quad = self.reduce(quad)
+
+        return quad
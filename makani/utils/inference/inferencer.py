@@ -44,6 +44,7 @@ from makani.utils.dataloaders.data_helpers import get_date_from_string
 # inference specific stuff
 from makani.utils.inference.helpers import split_list, SortedIndexSampler, translate_date_sampler_to_timedelta_sampler
 from makani.utils.inference.rollout_buffer import RolloutBuffer, TemporalAverageBuffer, SpectrumAverageBuffer, ZonalSpectrumAverageBuffer
+from makani.utils.inference.transform_cache import SpectralTransformCache
 
 # checkpoint helpers
 from makani.utils.checkpoint_helpers import get_latest_checkpoint_version
@@ -202,6 +203,10 @@ class Inferencer(Driver):
             strict=self.params.get("strict_restore", True),
         )
 
+        # strip the training graph once the weights are restored
+        if self.params.get("optimize_for_inference", False) or (self.params.get("inference_weight_quantization", None) is not None):
+            self.model = model_registry.optimize_model_for_inference(self.model, self.params)
+
         # loss handler
         self.loss_obj = LossHandler(self.params)
         self.loss_obj = self.loss_obj.to(self.device)
@@ -390,6 +395,13 @@ class Inferencer(Driver):
         else:
             bias_buffer = None
 
+        # spectra can be computed on a coarser lead-time stride and share forward transforms with spectral losses
+        spectrum_lead_time_stride = self.params.get("spectrum_lead_time_stride", 1)
+        if (spectrum_file is not None) or (zonal_spectrum_file is not None):
+            transform_cache = SpectralTransformCache()
+        else:
+            transform_cache = None
+
         if spectrum_file is not None:
             # we use all channels for the spectral computation
             spectrum_channels = output_channels if output_channels else self.params.channel_names
@@ -406,6 +418,8 @@ class Inferencer(Driver):
                 output_channels=spectrum_channels,
                 output_file=spectrum_file,
                 spatial_distributed=True,
+                lead_time_stride=spectrum_lead_time_stride,
+                transform_cache=transform_cache,
             )
         else:
             spectrum_buffer = None
@@ -426,6 +440,8 @@ class Inferencer(Driver):
                 output_channels=zonal_spectrum_channels,
                 output_file=zonal_spectrum_file,
                 spatial_distributed=True,
+                lead_time_stride=spectrum_lead_time_stride,
+                transform_cache=transform_cache,
             )
         else:
             zonal_spectrum_buffer = None
@@ -438,7 +454,18 @@ class Inferencer(Driver):
             if self.climatology_dataset is None:
                 self.logger.warning("WeatherBench compatibility enabled but no climatology specified. Results may differ, please specify a wb2-compatible climatology.")
 
-        logs = self._inference_indexlist(indices, rollout_steps, batch_size, metrics=metrics, rollout_buffer=rollout_buffer, bias_buffer=bias_buffer, spectrum_buffer=spectrum_buffer, zonal_spectrum_buffer=zonal_spectrum_buffer, profiler=profiler)
+        logs = self._inference_indexlist(
+            indices,
+            rollout_steps,
+            batch_size,
+            metrics=metrics,
+            rollout_buffer=rollout_buffer,
+            bias_buffer=bias_buffer,
+            spectrum_buffer=spectrum_buffer,
+            zonal_spectrum_buffer=zonal_spectrum_buffer,
+            transform_cache=transform_cache,
+            profiler=profiler,
+        )
 
         if compute_metrics and not (metrics_file is None):
             if comm.get_rank("world") == 0:
@@ -464,6 +491,7 @@ class Inferencer(Driver):
         bias_buffer: Optional = None,
         spectrum_buffer: Optional = None,
         zonal_spectrum_buffer: Optional = None,
+        transform_cache: Optional[SpectralTransformCache] = None,
     ):
         """
         main routine that implements autoregressive inference over a number of indices
@@ -472,6 +500,9 @@ class Inferencer(Driver):
         # set to eval
         self._set_eval()
 
+        # share the forward transforms of the spectral losses with the spectrum buffers
+        self.loss_obj.set_transform_cache(transform_cache)
+
         # clear cache
         torch.cuda.empty_cache()
 
@@ -660,7 +691,7 @@ class Inferencer(Driver):
                             diff = diff.reshape(B*E, C, H, W).contiguous()
                             bias_buffer.update(diff, idte - 1)
 
-                        if (spectrum_buffer is not None):
+                        if (spectrum_buffer is not None) and spectrum_buffer.requires_update(idte - 1):
                             if pred.dim() == 4:
                                 prede = pred.unsqueeze(1)
                             else:
@@ -668,7 +699,7 @@ class Inferencer(Driver):
 
                             spectrum_buffer.update(prede, targ.unsqueeze(1), idte - 1)
 
-                        if (zonal_spectrum_buffer is not None):
+                        if (zonal_spectrum_buffer is not None) and zonal_spectrum_buffer.requires_update(idte - 1):
                             if pred.dim() == 4:
                                 prede = pred.unsqueeze(1)
                             else:
@@ -676,6 +707,10 @@ class Inferencer(Driver):
 
                             zonal_spectrum_buffer.update(prede, targ.unsqueeze(1), idte - 1)
 
+                        # coefficients are only valid for the current step
+                        if transform_cache is not None:
+                            transform_cache.reset()
+
                     if torch.cuda.is_available():
                         torch.cuda.nvtx.range_pop()
 
@@ -685,6 +720,9 @@ class Inferencer(Driver):
                     if profiler is not None:
                         profiler.step()
 
+        # detach the transform cache again
+        self.loss_obj.set_transform_cache(None)
+
         # barrier to ensure everyone is here before calling finalize
         if dist.is_initialized():
             dist.barrier(device_ids=[self.device.index])
@@ -744,31 +782,11 @@ class Inferencer(Driver):
 
         return
 
-    def score_model(
-            self, metrics_file: Optional[str] = None, output_channels: List[str] = [], output_file: Optional[str] = None, output_memory_buffer_size: Optional[int]=None, bias_file: Optional[str]=None, spectrum_file: Optional[str]=None, zonal_spectrum_file: Optional[str]=None, start_date=None, end_date=None, date_step=1, wb2_compatible=False, profiler=None
-    ):
+    def _get_local_sample_range(self, start_date=None, end_date=None, date_step=1):
         """
-        main routine for scoring models. Runs the inference over the entire dataset and computes the score. Then writes them to disk
+        converts the date range into the range of sample indices which are processed by this rank
         """
 
-        # log parameters
-        if self.log_to_screen:
-            # log memory usage so far
-            all_mem_gb = pynvml.nvmlDeviceGetMemoryInfo(self.nvml_handle).used / (1024.0 * 1024.0 * 1024.0)
-            max_mem_gb = torch.cuda.max_memory_allocated(device=self.device) / (1024.0 * 1024.0 * 1024.0)
-            self.logger.info(f"Scaffolding memory high watermark: {all_mem_gb} GB ({max_mem_gb} GB for pytorch)")
-            # announce training start
-            self.logger.info("Starting Scoring...")
-
-        # perform a barrier here to make sure everybody is ready
-        if dist.is_initialized():
-            dist.barrier(device_ids=[self.device.index])
-
-        try:
-            torch.cuda.reset_peak_memory_stats(self.device)
-        except ValueError:
-            pass
-
         # check if a date range is specified:
         if start_date is not None:
             start_date = get_date_from_string(start_date)
@@ -804,8 +822,6 @@ class Inferencer(Driver):
         end_date = self.valid_dataset.get_time_at_index(end_index)
         if self.log_to_screen:
             self.logger.info(f"Using date range: {start_date} to {end_date} with a step of {date_step} hours.")
-            if output_channels:
-                self.logger.info(f"Logging following channels: {output_channels}")
 
         # split the samples across ranks
         samples_local = split_list(list(range(start_index, end_index, step)), comm.get_size("batch"))[comm.get_rank("batch")]
@@ -814,6 +830,37 @@ class Inferencer(Driver):
         start = min(samples_local)
         end = max(samples_local) + 1
 
+        return start, end, step
+
+    def score_model(
+            self, metrics_file: Optional[str] = None, output_channels: List[str] = [], output_file: Optional[str] = None, output_memory_buffer_size: Optional[int]=None, bias_file: Optional[str]=None, spectrum_file: Optional[str]=None, zonal_spectrum_file: Optional[str]=None, start_date=None, end_date=None, date_step=1, wb2_compatible=False, profiler=None
+    ):
+        """
+        main routine for scoring models. Runs the inference over the entire dataset and computes the score. Then writes them to disk
+        """
+
+        # log parameters
+        if self.log_to_screen:
+            # log memory usage so far
+            all_mem_gb = pynvml.nvmlDeviceGetMemoryInfo(self.nvml_handle).used / (1024.0 * 1024.0 * 1024.0)
+            max_mem_gb = torch.cuda.max_memory_allocated(device=self.device) / (1024.0 * 1024.0 * 1024.0)
+            self.logger.info(f"Scaffolding memory high watermark: {all_mem_gb} GB ({max_mem_gb} GB for pytorch)")
+            # announce training start
+            self.logger.info("Starting Scoring...")
+
+        # perform a barrier here to make sure everybody is ready
+        if dist.is_initialized():
+            dist.barrier(device_ids=[self.device.index])
+
+        try:
+            torch.cuda.reset_peak_memory_stats(self.device)
+        except ValueError:
+            pass
+
+        start, end, step = self._get_local_sample_range(start_date, end_date, date_step)
+        if self.log_to_screen and output_channels:
+            self.logger.info(f"Logging following channels: {output_channels}")
+
         # start timer
         scoring_start = time.time()
 
@@ -842,3 +889,45 @@ class Inferencer(Driver):
         self.log_score(scoring_logs, scoring_end - scoring_start)
 
         return
+
+    def calibrate_weight_quantization(self, weight_quantization: str = "int8", start_date=None, end_date=None, date_step=1, wb2_compatible=False):
+        """
+        scores the model before and after weight-only quantization over the same initial conditions and reports the change of
+        the forecast skill and of the model memory. The model remains quantized afterwards. Returns the scoring logs of both runs
+        """
+        from makani.models.inference_optimization import quantize_weights
+
+        start, end, step = self._get_local_sample_range(start_date, end_date, date_step)
+        rollout_steps = self.params.get("valid_autoreg_steps", 0) + 1
+
+        def model_memory():
+            return sum(t.numel() * t.element_size() for t in list(self.model.parameters()) + list(self.model.buffers()))
+
+        # reference in full precision
+        memory_ref = model_memory()
+        logs_ref = self.inference_range(start, end, step, rollout_steps=rollout_steps, batch_size=self.params.batch_size, compute_metrics=True, wb2_compatible=wb2_compatible)
+
+        # quantize in place and score again
+        with torch.no_grad():
+            num_quantized = quantize_weights(self.model, dtype=weight_quantization)
+        memory_quant = model_memory()
+        logs_quant = self.inference_range(start, end, step, rollout_steps=rollout_steps, batch_size=self.params.batch_size, compute_metrics=True, wb2_compatible=wb2_compatible)
+
+        if self.log_to_screen:
+            separator = "".join(["-" for _ in range(50)])
+            self.logger.info(separator)
+            self.logger.info(f"Weight quantization summary ({weight_quantization}, {num_quantized} layers):")
+            self.logger.info(f"    model memory: {memory_ref / 1024**2:.2f} MB -> {memory_quant / 1024**2:.2f} MB ({memory_ref / memory_quant:.2f}x)")
+
+            metrics_ref = logs_ref.get("metrics", {})
+            metrics_quant = logs_quant.get("metrics", {})
+            keys = [k for k in metrics_ref.keys() if isinstance(metrics_ref[k], (int, float, np.floating)) and isinstance(metrics_quant.get(k, None), (int, float, np.floating))]
+            if keys:
+                max_len = max([len(k) for k in keys])
+                self.logger.info("Metrics (reference, quantized, delta):")
+                for key in keys:
+                    value_ref, value_quant = metrics_ref[key], metrics_quant[key]
+                    self.logger.info(f"    {key}: {' ' * (max_len - len(key))}{value_ref:.6g}, {value_quant:.6g}, {value_quant - value_ref:+.6g}")
+            self.logger.info(separator)
+
+        return logs_ref, logs_quant
@@ -26,9 +26,10 @@ import makani.utils.constants as const
 from torch import amp
 import torch.distributed as dist
 from makani.utils import comm
-from makani.models.common import RealFFT1
+from makani.models.common import RealFFT1, get_spectral_transform
 from makani.mpu.fft import DistributedRealFFT1
 from makani.utils.grids import grid_to_quadrature_rule, GridQuadrature
+from makani.utils.inference.transform_cache import SpectralTransformCache
 from physicsnemo.distributed.utils import compute_split_shapes, split_tensor_along_dim
 from physicsnemo.distributed.mappings import gather_from_parallel_region, reduce_from_parallel_region
 
@@ -37,6 +38,36 @@ import torch_harmonics as th
 import torch_harmonics.distributed as thd
 
 
+def _welford_update_kernel(data: torch.Tensor, scale: Optional[torch.Tensor], bias: Optional[torch.Tensor], mean: torch.Tensor, m2: torch.Tensor, count_new: torch.Tensor):
+    """
+    Fused single-pass update of running mean and M2 with a batch of samples along dim 0, which writes the results into
+    mean and m2 in place. The optional affine transform is applied on the fly. Sums are shifted by the running mean for
+    numerical stability: mean' = mean + s1 / n', m2' = m2 + s2 - s1^2 / n', with s1 = sum(x - mean) and s2 = sum((x - mean)^2).
+    If no samples have been seen yet, the running mean is not meaningful and the sums are shifted by the first sample instead,
+    to avoid cancellation for data with a large offset. The update formula is the same, since the old M2 and count vanish.
+    """
+    if scale is not None:
+        data = scale * data
+    if bias is not None:
+        data = data + bias
+
+    count_old = count_new - data.shape[0]
+    shift = torch.where(count_old > 0, mean, data[0])
+
+    delta = data - shift.unsqueeze(0)
+    s1 = torch.sum(delta, dim=0)
+    s2 = torch.sum(torch.square(delta), dim=0)
+
+    mean.copy_(shift + s1 / count_new)
+    m2.add_(s2 - torch.square(s1) / count_new)
+
+    return
+
+
+# compiled variant is used on GPU, CPU falls back to the eager kernel
+_welford_update_kernel_compiled = torch.compile(_welford_update_kernel)
+
+
 class DataBuffer(object, metaclass=ABCMeta):
     r"""
     DataBuffer class used as base class for online data analysis
@@ -385,6 +416,8 @@ class MeanStdBuffer(DataBuffer):
         List of channels to be recorded
     output_file: str, optional
         Outputfile to write to
+    fused_update: bool, optional
+        Use the fused single-pass Welford update instead of separate statistics and combine passes
     """
 
     def __init__(
@@ -398,9 +431,17 @@ class MeanStdBuffer(DataBuffer):
         bias: Optional[torch.Tensor] = None,
         output_channels: List[str] = [],
         output_file: Optional[str] = None,
+        fused_update: Optional[bool] = True,
     ):
         super().__init__(num_rollout_steps, rollout_dt, channel_names, device, scale, bias, output_channels, output_file)
 
+        # select the update kernel
+        self.fused_update = fused_update
+        if self.device.type == "cuda":
+            self._update_kernel = _welford_update_kernel_compiled
+        else:
+            self._update_kernel = _welford_update_kernel
+
         # rollout buffer on CPU has dimensions num_rollout_steps x num_channels x nlat x nlon
         pin_memory = self.device.type == "cuda"
         local_buffer_size = (self.num_rollout_steps, self.num_channels, *variable_shape)
@@ -440,6 +481,25 @@ class MeanStdBuffer(DataBuffer):
 
         return
 
+    def _welford_update(self, data, idt, scale=None, bias=None):
+        """fused in-place update of the running statistics with the batch of samples in data"""
+        if not self.fused_update:
+            if scale is not None:
+                data = scale * data
+            if bias is not None:
+                data = data + bias
+            mean, m2, count = self._compute_stats(data, dim=0)
+            self._welford_combine(mean, m2, count, idt)
+            return
+
+        # update counts first, the kernel needs the new count. We stay on the device to avoid syncs
+        self.num_samples_tracked[idt, ...] += data.shape[0]
+        count_new = self.num_samples_tracked[idt].to(dtype=torch.float32)
+
+        self._update_kernel(data, scale, bias, self.running_mean[idt], self.running_var[idt], count_new)
+
+        return
+
     def _aggregate_stats(self, group_name="data"):
         if comm.get_size(group_name) > 1:
             with torch.no_grad():
@@ -493,6 +553,8 @@ class TemporalAverageBuffer(MeanStdBuffer):
         List of channels to be recorded
     output_file: str, optional
         Outputfile to write to
+    fused_update: bool, optional
+        Use the fused single-pass Welford update
     """
     def __init__(self,
         num_rollout_steps: int,
@@ -506,7 +568,8 @@ class TemporalAverageBuffer(MeanStdBuffer):
         scale: Optional[torch.Tensor] = None,
         bias: Optional[torch.Tensor] = None,
 	    output_channels: List[str] = [],
-        output_file: Optional[str] = None):
+        output_file: Optional[str] = None,
+        fused_update: Optional[bool] = True):
 
         super().__init__(
             num_rollout_steps=num_rollout_steps,
@@ -518,6 +581,7 @@ class TemporalAverageBuffer(MeanStdBuffer):
             bias=bias,
             output_channels=output_channels,
             output_file=output_file,
+            fused_update=fused_update,
         )
 
         self.img_shape = img_shape
@@ -604,13 +668,11 @@ class TemporalAverageBuffer(MeanStdBuffer):
         """update local buffers"""
 
         with torch.no_grad():
-            data_projected = self.scale * data[..., self.channel_mask, :, :] + self.bias
+            # project channels, rescaling happens inside the fused update
+            data_projected = data[..., self.channel_mask, :, :]
 
-            # compute the local variance and mean over the local batch dimension
-            mean, m2, count = self._compute_stats(data_projected, dim=0)
-
-            # do distributed welford
-            self._welford_combine(mean, m2, count, idt)
+            # compute the local variance and mean over the local batch dimension and do welford
+            self._welford_update(data_projected, idt, scale=self.scale, bias=self.bias)
 
         return
 
@@ -658,6 +720,10 @@ class SpectrumAverageBuffer(MeanStdBuffer):
         List of channels to be recorded
     output_file: str, optional
         Outputfile to write to
+    lead_time_stride: int, optional
+        Only record spectra at every lead_time_stride-th rollout step
+    transform_cache: SpectralTransformCache, optional
+        Per-step cache of forward coefficients shared with other spectral consumers
     """
     def __init__(self,
         num_rollout_steps: int,
@@ -671,7 +737,15 @@ class SpectrumAverageBuffer(MeanStdBuffer):
         bias: Optional[torch.Tensor] = None,
         output_channels: List[str] = [],
         output_file: Optional[str] = None,
-        spatial_distributed: Optional[bool] = False):
+        spatial_distributed: Optional[bool] = False,
+        lead_time_stride: Optional[int] = 1,
+        transform_cache: Optional[SpectralTransformCache] = None):
+
+        # check lead time stride
+        if (lead_time_stride < 1) or (lead_time_stride > num_rollout_steps):
+            raise ValueError(f"Lead time stride has to be between 1 and {num_rollout_steps}, got {lead_time_stride}.")
+        self.lead_time_stride = lead_time_stride
+        self.transform_cache = transform_cache
 
         # instantiate SHT
         self.spatial_distributed = spatial_distributed
@@ -680,14 +754,14 @@ class SpectrumAverageBuffer(MeanStdBuffer):
                 polar_group = None if (comm.get_size("h") == 1) else comm.get_group("h")
                 azimuth_group = None if (comm.get_size("w") == 1) else comm.get_group("w")
                 thd.init(polar_group, azimuth_group)
-            self.sht = thd.DistributedRealSHT(*img_shape, grid=grid_type)
+            self.sht = get_spectral_transform(thd.DistributedRealSHT, *img_shape, grid=grid_type, dtype=torch.float32)
             self.lmax = self.sht.lmax
             self.lmax_local = self.sht.l_shapes[comm.get_rank("h")]
             # compute loffset
             offsets = [0] + np.cumsum(self.sht.l_shapes).tolist()
             self.lmax_offset = offsets[comm.get_rank("h")]
         else:
-            self.sht = th.RealSHT(*img_shape, grid=grid_type)
+            self.sht = get_spectral_transform(th.RealSHT, *img_shape, grid=grid_type, dtype=torch.float32)
             self.lmax = self.sht.lmax
             self.lmax_local = self.lmax
             self.lmax_offset = 0
@@ -699,9 +773,10 @@ class SpectrumAverageBuffer(MeanStdBuffer):
             enssize += 1
         variable_shape = (enssize, self.lmax_local)
 
+        # only strided lead times are recorded
         super().__init__(
-            num_rollout_steps=num_rollout_steps,
-            rollout_dt=rollout_dt,
+            num_rollout_steps=num_rollout_steps // self.lead_time_stride,
+            rollout_dt=rollout_dt * self.lead_time_stride,
             variable_shape=variable_shape,
             channel_names=channel_names,
             device=device,
@@ -717,20 +792,52 @@ class SpectrumAverageBuffer(MeanStdBuffer):
         self.bias = self.bias.reshape(1, 1, -1, 1, 1)
         self.scale = self.scale.reshape(1, 1, -1, 1, 1)
 
+        # coefficients of the constant field, used to apply the bias in spectral space
+        self.unit_coeffs = None
+
+    def requires_update(self, idt):
+        """check whether spectra are recorded at rollout step idt"""
+        return (idt + 1) % self.lead_time_stride == 0
+
+    def _transform(self, data, squeeze_ensemble=False):
+        """rescale, project and transform data. Uses the transform cache if available"""
+
+        if self.transform_cache is None:
+            datap = self.scale * data[..., self.channel_mask, :, :] + self.bias
+            with amp.autocast(device_type="cuda", enabled=False):
+                sdatap = self.sht(datap.to(torch.float32))
+            return sdatap
+
+        # the SHT is linear, so we can transform the normalized data once and apply scale and bias to the coefficients
+        if squeeze_ensemble:
+            sdata = self.transform_cache(self.sht, data.squeeze(1)).unsqueeze(1)
+        else:
+            sdata = self.transform_cache(self.sht, data)
+
+        if self.unit_coeffs is None:
+            ones = torch.ones((1, 1, self.num_channels, *data.shape[-2:]), dtype=torch.float32, device=self.device)
+            with amp.autocast(device_type="cuda", enabled=False):
+                self.unit_coeffs = self.sht(ones)
+
+        return self.scale * sdata[..., self.channel_mask, :, :] + self.bias * self.unit_coeffs
+
     def update(self, data, targ, idt):
         """update local buffers"""
 
-        with torch.no_grad():
-            if comm.get_rank("ensemble") == 0:
-                data = torch.cat([targ, data], dim=1)
+        if not self.requires_update(idt):
+            return
 
-            # rescale data and project channels
-            datap = self.scale * data[..., self.channel_mask, :, :] + self.bias
+        # compute index of strided lead time
+        idt = (idt + 1) // self.lead_time_stride - 1
+
+        with torch.no_grad():
 
             # perform SHT in FP32 to be safe
-            dtype = datap.dtype
+            dtype = torch.promote_types(data.dtype, self.scale.dtype)
             with amp.autocast(device_type="cuda", enabled=False):
-                sdatap = self.sht(datap.to(torch.float32))
+                sdatap = self._transform(data)
+                if comm.get_rank("ensemble") == 0:
+                    sdatap = torch.cat([self._transform(targ, squeeze_ensemble=True), sdatap], dim=1)
 
                 # compute power spectrum:
                 sdatap = torch.square(torch.abs(sdatap))
@@ -753,11 +860,8 @@ class SpectrumAverageBuffer(MeanStdBuffer):
             # swap E and C
             spect = spect.permute(0,2,1,3).contiguous()
 
-            # compute the local variance and mean over the local batch dimension
-            mean, m2, count = self._compute_stats(spect, dim=0)
-
-            # do distributed welford
-            self._welford_combine(mean, m2, count, idt)
+            # compute the local variance and mean over the local batch dimension and do welford
+            self._welford_update(spect, idt)
 
         return
 
@@ -875,6 +979,10 @@ class ZonalSpectrumAverageBuffer(MeanStdBuffer):
         List of channels to be recorded
     output_file: str, optional
         Outputfile to write to
+    lead_time_stride: int, optional
+        Only record spectra at every lead_time_stride-th rollout step
+    transform_cache: SpectralTransformCache, optional
+        Per-step cache of forward coefficients shared with other spectral consumers
     """
     def __init__(self,
         num_rollout_steps: int,
@@ -888,7 +996,15 @@ class ZonalSpectrumAverageBuffer(MeanStdBuffer):
         bias: Optional[torch.Tensor] = None,
         output_channels: List[str] = [],
         output_file: Optional[str] = None,
-        spatial_distributed: Optional[bool] = False):
+        spatial_distributed: Optional[bool] = False,
+        lead_time_stride: Optional[int] = 1,
+        transform_cache: Optional[SpectralTransformCache] = None):
+
+        # check lead time stride
+        if (lead_time_stride < 1) or (lead_time_stride > num_rollout_steps):
+            raise ValueError(f"Lead time stride has to be between 1 and {num_rollout_steps}, got {lead_time_stride}.")
+        self.lead_time_stride = lead_time_stride
+        self.transform_cache = transform_cache
 
         # instantiate SHT
         self.spatial_distributed = spatial_distributed and comm.get_size("spatial") > 1
@@ -928,9 +1044,10 @@ class ZonalSpectrumAverageBuffer(MeanStdBuffer):
             enssize += 1
         variable_shape = (enssize, self.nlat_local, self.mmax_local)
 
+        # only strided lead times are recorded
         super().__init__(
-            num_rollout_steps=num_rollout_steps,
-            rollout_dt=rollout_dt,
+            num_rollout_steps=num_rollout_steps // self.lead_time_stride,
+            rollout_dt=rollout_dt * self.lead_time_stride,
             variable_shape=variable_shape,
             channel_names=channel_names,
             device=device,
@@ -953,20 +1070,52 @@ class ZonalSpectrumAverageBuffer(MeanStdBuffer):
         # reshape:
         self.lat_weights = torch.reshape(self.lat_weights, (1,1,1,-1,1))
 
+        # coefficients of the constant field, used to apply the bias in spectral space
+        self.unit_coeffs = None
+
+    def requires_update(self, idt):
+        """check whether spectra are recorded at rollout step idt"""
+        return (idt + 1) % self.lead_time_stride == 0
+
+    def _transform(self, data, squeeze_ensemble=False):
+        """rescale, project and transform data. Uses the transform cache if available"""
+
+        if self.transform_cache is None:
+            datap = self.scale * data[..., self.channel_mask, :, :] + self.bias
+            with amp.autocast(device_type="cuda", enabled=False):
+                sdatap = self.rfft(datap.to(torch.float32), norm="forward")
+            return sdatap
+
+        # the FFT is linear, so we can transform the normalized data once and apply scale and bias to the coefficients
+        if squeeze_ensemble:
+            sdata = self.transform_cache(self.rfft, data.squeeze(1), norm="forward").unsqueeze(1)
+        else:
+            sdata = self.transform_cache(self.rfft, data, norm="forward")
+
+        if self.unit_coeffs is None:
+            ones = torch.ones((1, 1, self.num_channels, *data.shape[-2:]), dtype=torch.float32, device=self.device)
+            with amp.autocast(device_type="cuda", enabled=False):
+                self.unit_coeffs = self.rfft(ones, norm="forward")
+
+        return self.scale * sdata[..., self.channel_mask, :, :] + self.bias * self.unit_coeffs
+
     def update(self, data, targ, idt):
         """update local buffers"""
 
-        with torch.no_grad():
-            if comm.get_rank("ensemble") == 0:
-                data = torch.cat([targ, data], dim=1)
+        if not self.requires_update(idt):
+            return
 
-            # rescale data and project channels:
-            datap = self.scale * data[..., self.channel_mask, :, :] + self.bias
+        # compute index of strided lead time
+        idt = (idt + 1) // self.lead_time_stride - 1
+
+        with torch.no_grad():
 
             # distributed FFT
-            dtype = datap.dtype
+            dtype = torch.promote_types(data.dtype, self.scale.dtype)
             with amp.autocast(device_type="cuda", enabled=False):
-                sdatap = self.rfft(datap.to(torch.float32), norm="forward")
+                sdatap = self._transform(data)
+                if comm.get_rank("ensemble") == 0:
+                    sdatap = torch.cat([self._transform(targ, squeeze_ensemble=True), sdatap], dim=1)
 
                 # compute power spectrum:
                 spect = self.lat_weights * torch.square(torch.abs(sdatap))
@@ -983,11 +1132,8 @@ class ZonalSpectrumAverageBuffer(MeanStdBuffer):
             # swap E and C
             spect = spect.permute(0,2,1,3,4).contiguous()
 
-            # compute the local variance and mean over the local batch dimension
-            mean, m2, count = self._compute_stats(spect, dim=0)
-
-            # do distributed welford
-            self._welford_combine(mean, m2, count, idt)
+            # compute the local variance and mean over the local batch dimension and do welford
+            self._welford_update(spect, idt)
 
         return
 
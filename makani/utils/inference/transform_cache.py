@@ -0,0 +1,71 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Tuple, Dict, Any
+
+import torch
+import torch.nn as nn
+from torch import amp
+
+
+def _transform_signature(transform: nn.Module, kwargs: Dict[str, Any]) -> Tuple:
+    """
+    helper routine which computes a hashable signature for a transform. Two transforms with the same
+    signature produce identical coefficients, even if they are different module instances
+    """
+    attrs = tuple(getattr(transform, attr, None) for attr in ["nlat", "nlon", "lmax", "mmax", "grid", "norm", "csphase"])
+    return (type(transform).__name__, *attrs, tuple(sorted(kwargs.items())))
+
+
+class SpectralTransformCache(object):
+    r"""
+    Per-step cache for forward spectral coefficients (SHT or FFT). Consumers which transform the same tensor
+    with equivalent transforms during a single rollout step share the result instead of recomputing it.
+    Transforms are always evaluated in FP32 with autocast disabled.
+
+    Entries are keyed by the transform signature and the identity of the input tensor (storage pointer, shape,
+    strides, dtype and version counter). The cache keeps a reference to the input tensors, so that their storage
+    cannot be reused while the entry is alive. It is the responsibility of the owner to call reset at the end of each step.
+    """
+
+    def __init__(self):
+        self._cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def reset(self):
+        """drop all cached coefficients"""
+        self._cache.clear()
+        return
+
+    def __call__(self, transform: nn.Module, x: torch.Tensor, **kwargs) -> torch.Tensor:
+        key = (_transform_signature(transform, kwargs), str(x.device), x.dtype, x.data_ptr(), tuple(x.shape), tuple(x.stride()), x._version)
+
+        entry = self._cache.get(key, None)
+        if entry is not None:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        with amp.autocast(device_type="cuda", enabled=False):
+            coeffs = transform(x.to(torch.float32), **kwargs)
+
+        # store a reference to the input as well to make sure the key stays valid
+        self._cache[key] = (x, coeffs)
+
+        return coeffs
@@ -0,0 +1,40 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import importlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def lazy_attributes(package_name: str, package_globals: Dict[str, Any], attributes: Dict[str, Tuple[str, Optional[str]]]) -> Tuple[Callable, Callable]:
+    """
+    Returns the module level __getattr__ and __dir__ functions of a package, which import the given attributes on first access.
+    attributes maps the attribute name to the relative module name and the name of the attribute in that module, or None
+    if the module itself is the attribute. Imported attributes are stored in the globals of the package.
+    """
+
+    def __getattr__(name: str) -> Any:
+        if name in attributes:
+            module_name, attr_name = attributes[name]
+            attr = importlib.import_module(module_name, package_name)
+            if attr_name is not None:
+                attr = getattr(attr, attr_name)
+            package_globals[name] = attr
+            return attr
+        raise AttributeError(f"module {package_name!r} has no attribute {name!r}")
+
+    def __dir__() -> List[str]:
+        return sorted(set(package_globals.keys()) | set(attributes.keys()))
+
+    return __getattr__, __dir__
@@ -34,6 +34,7 @@ from torch_harmonics.quadrature import clenshaw_curtiss_weights, legendre_gauss_
 from .losses import LossType, GeometricLpLoss, SpectralH1Loss, SpectralAMSELoss, HydrostaticBalanceLoss
 from .losses import EnsembleCRPSLoss, EnsembleSpectralCRPSLoss, EnsembleNLLLoss, EnsembleMMDLoss
 from .losses import DriftRegularization
+from .losses.base_loss import SpectralBaseLoss
 
 
 class LossHandler(nn.Module):
@@ -252,6 +253,14 @@ class LossHandler(nn.Module):
     def is_distributed(self):
         return False
 
+    def set_transform_cache(self, transform_cache):
+        """
+        attaches a per-step spectral transform cache to all spectral losses. Pass None to detach it
+        """
+        for lfn in self.loss_fn:
+            if isinstance(lfn, SpectralBaseLoss):
+                lfn.transform_cache = transform_cache
+
     def _update_running_stats(self, x: torch.Tensor):
         """
         Uses Chan's parallel version of the Welford's algorithm [1]. For details see
@@ -56,11 +56,8 @@ class SpectralAMSELoss(SpectralBaseLoss):
     def forward(self, prd: torch.Tensor, tar: torch.Tensor, wgt: Optional[torch.Tensor] = None) -> torch.Tensor:
 
         # compute the sht
-        prd = prd.float()
-        tar = tar.float()
-        with amp.autocast(device_type="cuda", enabled=False):
-            xcoeffs = self.sht(prd)
-            ycoeffs = self.sht(tar)
+        xcoeffs = self.forward_transform(prd)
+        ycoeffs = self.forward_transform(tar)
         
         # compute the SHT:
         xcoeffssq = torch.square(torch.abs(xcoeffs))
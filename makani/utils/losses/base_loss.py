@@ -20,12 +20,14 @@ from abc import ABCMeta, abstractmethod
 
 import torch
 import torch.nn as nn
+from torch import amp
 
 import torch_harmonics as th
 import torch_harmonics.distributed as thd
 
 from makani.utils.grids import grid_to_quadrature_rule, GridQuadrature
 from makani.utils import comm
+from makani.models.common import get_spectral_transform
 
 
 def _compute_channel_weighting_helper(channel_names: List[str], channel_weight_type: str) -> torch.Tensor:
@@ -219,6 +221,74 @@ def _compute_channel_weighting_helper(channel_names: List[str], channel_weight_t
     return channel_weights
 
 
+class _ChunkedQuadratureSum(torch.autograd.Function):
+    """
+    Evaluates torch.sum(kernel(observations, forecasts) * quad_weights, dim=-1) in chunks along the last
+    (flattened spatial) dimension. Only the inputs are stored for the backward pass, the kernel is recomputed
+    chunk by chunk during backward. This way, the pointwise intermediates of the kernel, which for ensemble
+    scores scale with the ensemble size, never have to be materialized for the full field.
+    """
+
+    @staticmethod
+    @amp.custom_fwd(device_type="cuda")
+    def forward(ctx, kernel, chunk_size, observations, forecasts, quad_weights):
+        num_points = forecasts.shape[-1]
+
+        result = None
+        with torch.no_grad():
+            for start in range(0, num_points, chunk_size):
+                end = min(start + chunk_size, num_points)
+                chunk = torch.sum(kernel(observations[..., start:end], forecasts[..., start:end]) * quad_weights[..., start:end], dim=-1)
+                result = chunk if result is None else result + chunk
+
+        ctx.kernel = kernel
+        ctx.chunk_size = chunk_size
+        ctx.save_for_backward(observations, forecasts, quad_weights)
+
+        return result
+
+    @staticmethod
+    @amp.custom_bwd(device_type="cuda")
+    def backward(ctx, grad_output):
+        observations, forecasts, quad_weights = ctx.saved_tensors
+        inputs = (observations, forecasts, quad_weights)
+        needs_grad = ctx.needs_input_grad[2:]
+        num_points = forecasts.shape[-1]
+
+        grads = [torch.zeros_like(x) if req else None for x, req in zip(inputs, needs_grad)]
+        for start in range(0, num_points, ctx.chunk_size):
+            end = min(start + ctx.chunk_size, num_points)
+
+            # recompute the chunk with autograd enabled
+            with torch.enable_grad():
+                chunks = [x[..., start:end].detach().requires_grad_(req) for x, req in zip(inputs, needs_grad)]
+                result = torch.sum(ctx.kernel(chunks[0], chunks[1]) * chunks[2], dim=-1)
+                chunk_inputs = [x for x, req in zip(chunks, needs_grad) if req]
+                chunk_grads = torch.autograd.grad(result, chunk_inputs, grad_output, allow_unused=True)
+
+            # write the chunk gradients into the full gradient tensors
+            chunk_grads = iter(chunk_grads)
+            for grad, req in zip(grads, needs_grad):
+                if req:
+                    chunk_grad = next(chunk_grads)
+                    if chunk_grad is not None:
+                        grad[..., start:end] = chunk_grad
+
+        return None, None, *grads
+
+
+def _chunked_quadrature_sum(kernel, observations: torch.Tensor, forecasts: torch.Tensor, quad_weights: torch.Tensor, chunk_size: Optional[int] = None) -> torch.Tensor:
+    """
+    computes the quadrature weighted sum of a pointwise score kernel over the last dimension. If chunk_size is set,
+    the sum is computed chunk by chunk with recomputation in the backward pass, which bounds the memory footprint
+    of the kernel intermediates. The last dimension of quad_weights has to match the last dimension of the forecasts
+    """
+    if (chunk_size is None) or (chunk_size >= forecasts.shape[-1]):
+        return torch.sum(kernel(observations, forecasts) * quad_weights, dim=-1)
+
+    return _ChunkedQuadratureSum.apply(kernel, chunk_size, observations, forecasts, quad_weights)
+
+
 @dataclass
 class LossType(object):
     Deterministic = 1
@@ -307,9 +377,12 @@ class SpectralBaseLoss(nn.Module, metaclass=ABCMeta):
                 polar_group = None if (comm.get_size("h") == 1) else comm.get_group("h")
                 azimuth_group = None if (comm.get_size("w") == 1) else comm.get_group("w")
                 thd.init(polar_group, azimuth_group)
-            self.sht = thd.DistributedRealSHT(*img_shape, grid=grid_type)
+            self.sht = get_spectral_transform(thd.DistributedRealSHT, *img_shape, grid=grid_type, dtype=torch.float32)
         else:
-            self.sht = th.RealSHT(*img_shape, grid=grid_type).float()
+            self.sht = get_spectral_transform(th.RealSHT, *img_shape, grid=grid_type, dtype=torch.float32)
+
+        # optional per-step cache for sharing forward coefficients with other spectral consumers
+        self.transform_cache = None
 
     @property
     def type(self):
@@ -319,6 +392,18 @@ class SpectralBaseLoss(nn.Module, metaclass=ABCMeta):
     def n_channels(self):
         return len(self.n_channels)
 
+    def forward_transform(self, x: torch.Tensor) -> torch.Tensor:
+        """
+        computes the SHT in FP32. If a transform cache is attached, coefficients are looked up there
+        """
+        if self.transform_cache is not None:
+            return self.transform_cache(self.sht, x)
+
+        with amp.autocast(device_type="cuda", enabled=False):
+            xcoeffs = self.sht(x.float())
+
+        return xcoeffs
+
     @torch.compiler.disable(recursive=False)
     def compute_channel_weighting(self, channel_weight_type: str) -> torch.Tensor:
         return _compute_channel_weighting_helper(self.channel_names, channel_weight_type)
@@ -14,6 +14,7 @@
 # limitations under the License.
 
 from typing import Optional, Tuple, List
+from functools import partial
 
 import numpy as np
 import math
@@ -22,8 +23,9 @@ import torch
 import torch.nn as nn
 from torch import amp
 
-from makani.utils.losses.base_loss import GeometricBaseLoss, SpectralBaseLoss, LossType
+from makani.utils.losses.base_loss import GeometricBaseLoss, SpectralBaseLoss, LossType, _chunked_quadrature_sum
 from makani.utils import comm
+from makani.utils.compilation import compile_kernel
 
 # distributed stuff
 from physicsnemo.distributed.utils import compute_split_shapes, split_tensor_along_dim
@@ -43,12 +45,12 @@ def rankdata(x: torch.Tensor, dim: int) -> torch.Tensor:
     return rank
 
 
-# @torch.compile
 def _crps_ensemble_kernel(observation: torch.Tensor, forecasts: torch.Tensor, weights: torch.Tensor) -> torch.Tensor:
     """
     CRPS ensemble score from integrating the PDF piecewise
     compare https://github.com/properscoring/properscoring/blob/master/properscoring/_gufuncs.py#L7
-    disabling torch compile for the moment due to very long startup times when training large ensembles with ensemble parallelism
+    this kernel is not compiled, since the loop over the members is unrolled for every ensemble size. The vectorized
+    _crps_sorted_kernel is compiled instead
     """
 
     # beware: forecasts are assumed sorted in sorted order
@@ -108,6 +110,39 @@ def _crps_ensemble_kernel(observation: torch.Tensor, forecasts: torch.Tensor, we
     return torch.squeeze(integral, dim=0)
 
 
+@compile_kernel
+def _crps_sorted_kernel(observation: torch.Tensor, forecasts: torch.Tensor, weights: torch.Tensor) -> torch.Tensor:
+    """
+    CRPS ensemble score using the sorted cumulative sum formulation
+    CRPS = sum_i p_i |x_i - y| - sum_i p_i x_i (2 P_i - p_i - 1)
+    where x_i are the sorted members, p_i their normalized weights and P_i the cumulative weights.
+    This is equivalent to integrating the piecewise CDF as in _crps_ensemble_kernel, but vectorized
+    over the ensemble dimension and O(E log E). Forecasts do not need to be sorted and weights only need to be broadcastable.
+    NaN members are excluded from the score, the result is NaN if all members are NaN.
+    """
+
+    # sort the members, NaNs are sorted to the end
+    forecasts, idx = torch.sort(forecasts, dim=0)
+    weights = torch.take_along_dim(weights, idx, dim=0) if weights.shape[0] > 1 else weights
+
+    # get nanmask and zero out the weights of invalid members
+    nanmasks = torch.logical_or(torch.isnan(forecasts), torch.isnan(weights))
+    forecasts = torch.where(nanmasks, 0.0, forecasts)
+    nweights = torch.where(nanmasks, 0.0, weights)
+
+    # normalized weights and their cumulative sum
+    # if all members are NaN, the total weight is zero and the result is NaN
+    nweights = nweights / torch.sum(nweights, dim=0, keepdim=True)
+    cdf = torch.cumsum(nweights, dim=0)
+
+    # skill and spread terms
+    eskill = torch.sum(nweights * torch.abs(forecasts - observation.unsqueeze(0)), dim=0)
+    espread = torch.sum(nweights * forecasts * (2.0 * cdf - nweights - 1.0), dim=0)
+
+    return eskill - espread
+
+
+@compile_kernel
 def _crps_skillspread_kernel(observation: torch.Tensor, forecasts: torch.Tensor, weights: torch.Tensor, alpha: float) -> torch.Tensor:
     """
     alternative CRPS variant that uses spread and skill
@@ -119,19 +154,18 @@ def _crps_skillspread_kernel(observation: torch.Tensor, forecasts: torch.Tensor,
     nanmasks = torch.logical_or(torch.isnan(forecasts), torch.isnan(weights))
     nanmask = torch.sum(nanmasks, dim=0).bool()
 
-    # compute total weights
-    nweights = torch.where(nanmasks, 0.0, weights)
-    total_weight = torch.sum(nweights, dim=0, keepdim=True)
-
-    # get the ranks for the spread computation
-    rank = rankdata(forecasts, dim=0)
-
     #  ensemble size
     num_ensemble = forecasts.shape[0]
 
+    # the skill term is permutation invariant, compute it before sorting
+    eskill = (observation - forecasts).abs().mean(dim=0)
+
+    # sort the forecasts so that the rank is the position along the ensemble dimension
+    forecasts, _ = torch.sort(forecasts, dim=0)
+    rank = torch.arange(1, num_ensemble + 1, device=forecasts.device, dtype=forecasts.dtype).reshape(-1, *[1 for _ in range(forecasts.dim() - 1)])
+
     # get the ensemble spread (total_weight is ensemble size here)
     espread = 2 * torch.mean((2 * rank - num_ensemble - 1) * forecasts, dim=0) * (float(num_ensemble) - 1.0 + alpha) / float(num_ensemble * (num_ensemble - 1))
-    eskill = (observation - forecasts).abs().mean(dim=0)
 
     # crps = torch.where(nanmasks.sum(dim=0) != 0, torch.nan, eskill - 0.5 * espread)
     crps = eskill - 0.5 * espread
@@ -142,11 +176,11 @@ def _crps_skillspread_kernel(observation: torch.Tensor, forecasts: torch.Tensor,
     return crps
 
 
-# @torch.compile
+@compile_kernel
 def _crps_gauss_kernel(observation: torch.Tensor, forecasts: torch.Tensor, weights: torch.Tensor, eps: float) -> torch.Tensor:
     """
     CRPS Gauss score, assuming the input ensemble is gaussian distributed
-    disabling torch compile for the moment due to very long startup times when training large ensembles with ensemble parallelism
+    compiled with dynamic shapes if enabled, so that the ensemble size does not trigger recompilation
     """
 
     # compute mean var over observations
@@ -173,6 +207,13 @@ def _crps_gauss_kernel(observation: torch.Tensor, forecasts: torch.Tensor, weigh
     return crps
 
 
+def _crps_deterministic_kernel(observation: torch.Tensor, forecasts: torch.Tensor) -> torch.Tensor:
+    """
+    CRPS of a single member ensemble, which reduces to the absolute error
+    """
+    return torch.abs(observation - forecasts.squeeze(0))
+
+
 class EnsembleCRPSLoss(GeometricBaseLoss):
 
     def __init__(
@@ -189,6 +230,7 @@ class EnsembleCRPSLoss(GeometricBaseLoss):
         ensemble_weights: Optional[torch.Tensor] = None,
         alpha: Optional[float] = 1.0,
         eps: Optional[float] = 1.0e-5,
+        chunk_size: Optional[int] = None,
         **kwargs,
     ):
 
@@ -208,6 +250,11 @@ class EnsembleCRPSLoss(GeometricBaseLoss):
         self.alpha = alpha
         self.eps = eps
 
+        # number of spatial points processed at once by the CRPS kernels
+        if (chunk_size is not None) and (chunk_size < 1):
+            raise ValueError(f"chunk_size has to be positive but got {chunk_size}")
+        self.chunk_size = chunk_size
+
         if (self.crps_type != "skillspread") and (self.alpha < 1.0):
             raise NotImplementedError("The alpha parameter (almost fair CRPS factor) is only supported for the skillspread kernel.")
 
@@ -244,64 +291,55 @@ class EnsembleCRPSLoss(GeometricBaseLoss):
         # observations: batch, channels, lat, lon
         B, E, C, H, W = forecasts.shape
 
+        # transpose forecasts: ensemble, batch, channels, lat, lon
+        forecasts = torch.moveaxis(forecasts, 1, 0)
+
+        # now we need to transpose the forecasts into ensemble direction.
+        # ideally we split spatial dims
+        forecasts = forecasts.reshape(E, B, C, H * W)
+        if self.ensemble_distributed:
+            ensemble_shapes = [forecasts.shape[0] for _ in range(comm.get_size("ensemble"))]
+            forecasts = distributed_transpose.apply(forecasts, (-1, 0), ensemble_shapes, "ensemble")
+        # observations does not need a transpose, but just a split
+        observations = observations.reshape(B, C, H * W)
+        if self.ensemble_distributed:
+            observations = scatter_to_parallel_region(observations, -1, "ensemble")
+
+        # combine quadrature and spatial weights
+        quad_weights = self.quad_weight_split
+        if spatial_weights is not None:
+            spatial_weights_split = spatial_weights.flatten(start_dim=-2, end_dim=-1)
+            if self.ensemble_distributed:
+                spatial_weights_split = scatter_to_parallel_region(spatial_weights_split, -1, "ensemble")
+            quad_weights = quad_weights * spatial_weights_split
+
         # if ensemble dim is one dimensional then computing the score is quick:
         if (not self.ensemble_distributed) and (E == 1):
             # in this case, CRPS is straightforward
-            crps = torch.abs(observations - forecasts.squeeze(1)).reshape(B, C, H * W)
+            kernel = _crps_deterministic_kernel
         else:
-            # transpose forecasts: ensemble, batch, channels, lat, lon
-            forecasts = torch.moveaxis(forecasts, 1, 0)
-
-            # now we need to transpose the forecasts into ensemble direction.
-            # ideally we split spatial dims
-            forecasts = forecasts.reshape(E, B, C, H * W)
-            if self.ensemble_distributed:
-                ensemble_shapes = [forecasts.shape[0] for _ in range(comm.get_size("ensemble"))]
-                forecasts = distributed_transpose.apply(forecasts, (-1, 0), ensemble_shapes, "ensemble")
-            # observations does not need a transpose, but just a split
-            observations = observations.reshape(B, C, H * W)
-            if self.ensemble_distributed:
-                observations = scatter_to_parallel_region(observations, -1, "ensemble")
-            if spatial_weights is not None:
-                spatial_weights_split = spatial_weights.flatten(start_dim=-2, end_dim=-1)
-                spatial_weights_split = scatter_to_parallel_region(spatial_weights_split, -1, "ensemble")
+            # now, E dimension is local and spatial dim is split further
+            # the ensemble weights only need to be broadcastable to the forecasts
+            if self.ensemble_weights is not None:
+                ensemble_weights = self.ensemble_weights.reshape(-1, 1, 1, 1)
+            else:
+                ensemble_weights = torch.ones((1, 1, 1, 1), dtype=forecasts.dtype, device=forecasts.device)
 
-            # run appropriate crps kernel to compute it pointwise
+            # select appropriate crps kernel to compute it pointwise
             if self.crps_type == "cdf":
-                # now, E dimension is local and spatial dim is split further
-                # we need to sort the forecasts now
-                forecasts, idx = torch.sort(forecasts, dim=0)  # how does the sorting work out if it is batched
-                if self.ensemble_weights is not None:
-                    ensemble_weights = self.ensemble_weights[idx]
-                else:
-                    ensemble_weights = torch.ones_like(forecasts, device=forecasts.device)
-
-                # compute score
-                crps = _crps_ensemble_kernel(observations, forecasts, ensemble_weights)
+                # the sorted kernel takes care of sorting the forecasts and weights
+                kernel = partial(_crps_sorted_kernel, weights=ensemble_weights)
             elif self.crps_type == "skillspread":
                 if self.ensemble_weights is not None:
                     raise NotImplementedError("currently only constant ensemble weights are supported")
-                else:
-                    ensemble_weights = torch.ones_like(forecasts, device=forecasts.device)
-
-                # compute score
-                crps = _crps_skillspread_kernel(observations, forecasts, ensemble_weights, self.alpha)
+                kernel = partial(_crps_skillspread_kernel, weights=ensemble_weights, alpha=self.alpha)
             elif self.crps_type == "gauss":
-                if self.ensemble_weights is not None:
-                    ensemble_weights = self.ensemble_weights[idx]
-                else:
-                    ensemble_weights = torch.ones_like(forecasts, device=forecasts.device)
-
-                # compute score
-                crps = _crps_gauss_kernel(observations, forecasts, ensemble_weights, self.eps)
+                kernel = partial(_crps_gauss_kernel, weights=ensemble_weights, eps=self.eps)
             else:
                 raise ValueError(f"Unknown CRPS crps_type {self.crps_type}")
 
-        # perform ensemble and spatial average of crps score
-        if spatial_weights is not None:
-            crps = torch.sum(crps * self.quad_weight_split * spatial_weights_split, dim=-1)
-        else:
-            crps = torch.sum(crps * self.quad_weight_split, dim=-1)
+        # compute the score and perform the spatial average, chunked if requested
+        crps = _chunked_quadrature_sum(kernel, observations, forecasts, quad_weights, self.chunk_size)
 
         # since we split spatial dim into ensemble dim, we need to do an ensemble sum as well
         if self.ensemble_distributed:
@@ -332,6 +370,7 @@ class EnsembleSpectralCRPSLoss(SpectralBaseLoss):
         absolute: Optional[bool] = True,
         alpha: Optional[float] = 1.0,
         eps: Optional[float] = 1.0e-5,
+        chunk_size: Optional[int] = None,
         **kwargs,
     ):
 
@@ -350,6 +389,11 @@ class EnsembleSpectralCRPSLoss(SpectralBaseLoss):
         self.alpha = alpha
         self.eps = eps
 
+        # number of spectral coefficients processed at once by the CRPS kernels
+        if (chunk_size is not None) and (chunk_size < 1):
+            raise ValueError(f"chunk_size has to be positive but got {chunk_size}")
+        self.chunk_size = chunk_size
+
         if (self.crps_type != "skillspread") and (self.alpha < 1.0):
             raise NotImplementedError("The alpha parameter (almost fair CRPS factor) is only supported for the skillspread kernel.")
 
@@ -406,11 +450,8 @@ class EnsembleSpectralCRPSLoss(SpectralBaseLoss):
 
         # before anything else compute the transform
         # as the CDF definition doesn't generalize well to more than one-dimensional variables, we treat complex and imaginary part as the same
-        forecasts = forecasts.float()
-        observations = observations.float()
-        with amp.autocast(device_type="cuda", enabled=False):
-            forecasts = self.sht(forecasts) / 4.0 / math.pi
-            observations = self.sht(observations) / 4.0 / math.pi
+        forecasts = self.forward_transform(forecasts) / 4.0 / math.pi
+        observations = self.forward_transform(observations) / 4.0 / math.pi
 
         if self.absolute:
             forecasts = torch.abs(forecasts).to(dtype)
@@ -435,64 +476,52 @@ class EnsembleSpectralCRPSLoss(SpectralBaseLoss):
         else:
             spectral_weights = spectral_weights * self.lm_weights
 
+        # transpose forecasts: ensemble, batch, channels, lat, lon
+        forecasts = torch.movedim(forecasts, 1, 0)
+
+        # now we need to transpose the forecasts into ensemble direction.
+        # ideally we split spatial dims
+        forecasts = forecasts.reshape(E, B, C, H * W)
+        if self.ensemble_distributed:
+            ensemble_shapes = [forecasts.shape[0] for _ in range(comm.get_size("ensemble"))]
+            forecasts = distributed_transpose.apply(forecasts, (-1, 0), ensemble_shapes, "ensemble")
+        # observations does not need a transpose, but just a split
+        observations = observations.reshape(B, C, H * W)
+        if self.ensemble_distributed:
+            observations = scatter_to_parallel_region(observations, -1, "ensemble")
+
+        # tile in complex dim, then flatten last 3 dims
+        spectral_weights_split = spectral_weights.reshape(1, 1, H * W)
+        if self.ensemble_distributed:
+            spectral_weights_split = scatter_to_parallel_region(spectral_weights_split, -1, "ensemble")
+
         # if ensemble dim is one dimensional then computing the score is quick:
         if (not self.ensemble_distributed) and (E == 1):
             # in this case, CRPS is straightforward
-            crps = torch.abs(observations - forecasts.squeeze(1)).reshape(B, C, H * W)
-            spectral_weights_split = spectral_weights.reshape(1, 1, H * W)
+            kernel = _crps_deterministic_kernel
         else:
-            # transpose forecasts: ensemble, batch, channels, lat, lon
-            forecasts = torch.movedim(forecasts, 1, 0)
-
-            # now we need to transpose the forecasts into ensemble direction.
-            # ideally we split spatial dims
-            forecasts = forecasts.reshape(E, B, C, H * W)
-            if self.ensemble_distributed:
-                ensemble_shapes = [forecasts.shape[0] for _ in range(comm.get_size("ensemble"))]
-                forecasts = distributed_transpose.apply(forecasts, (-1, 0), ensemble_shapes, "ensemble")
-            # observations does not need a transpose, but just a split
-            observations = observations.reshape(B, C, H * W)
-            if self.ensemble_distributed:
-                observations = scatter_to_parallel_region(observations, -1, "ensemble")
-
-            # tile in complex dim, then flatten last 3 dims
-            spectral_weights_split = spectral_weights.reshape(1, 1, H * W)
-            if self.ensemble_distributed:
-                spectral_weights_split = scatter_to_parallel_region(spectral_weights_split, -1, "ensemble")
+            # now, E dimension is local and spatial dim is split further
+            # the ensemble weights only need to be broadcastable to the forecasts
+            if self.ensemble_weights is not None:
+                ensemble_weights = self.ensemble_weights.reshape(-1, 1, 1, 1)
+            else:
+                ensemble_weights = torch.ones((1, 1, 1, 1), dtype=forecasts.dtype, device=forecasts.device)
 
-            # run appropriate crps kernel to compute it pointwise
+            # select appropriate crps kernel to compute it pointwise
             if self.crps_type == "cdf":
-                # now, E dimension is local and spatial dim is split further
-                # we need to sort the forecasts now
-                forecasts, idx = torch.sort(forecasts, dim=0)
-                if self.ensemble_weights is not None:
-                    ensemble_weights = self.ensemble_weights[idx]
-                else:
-                    ensemble_weights = torch.ones_like(forecasts, device=forecasts.device)
-
-                # compute score
-                crps = _crps_ensemble_kernel(observations, forecasts, ensemble_weights)
+                # the sorted kernel takes care of sorting the forecasts and weights
+                kernel = partial(_crps_sorted_kernel, weights=ensemble_weights)
             elif self.crps_type == "skillspread":
                 if self.ensemble_weights is not None:
                     raise NotImplementedError("currently only constant ensemble weights are supported")
-                else:
-                    ensemble_weights = torch.ones_like(forecasts, device=forecasts.device)
-
-                # compute score
-                crps = _crps_skillspread_kernel(observations, forecasts, ensemble_weights, self.alpha)
+                kernel = partial(_crps_skillspread_kernel, weights=ensemble_weights, alpha=self.alpha)
             elif self.crps_type == "gauss":
-                if self.ensemble_weights is not None:
-                    ensemble_weights = self.ensemble_weights[idx]
-                else:
-                    ensemble_weights = torch.ones_like(forecasts, device=forecasts.device)
-
-                # compute score
-                crps = _crps_gauss_kernel(observations, forecasts, ensemble_weights, self.eps)
+                kernel = partial(_crps_gauss_kernel, weights=ensemble_weights, eps=self.eps)
             else:
                 raise ValueError(f"Unknown CRPS crps_type {self.crps_type}")
 
-        # perform spatial average of crps score
-        crps = torch.sum(crps * spectral_weights_split, dim=-1)
+        # compute the score and perform spatial average of crps score, chunked if requested
+        crps = _chunked_quadrature_sum(kernel, observations, forecasts, spectral_weights_split, self.chunk_size)
 
         if self.spatial_distributed:
             crps = reduce_from_parallel_region(crps, "spatial")
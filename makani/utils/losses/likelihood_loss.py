@@ -14,13 +14,14 @@
 # limitations under the License.
 
 from typing import Optional, Tuple, List
+from functools import partial
 
 import numpy as np
 
 import torch
 import torch.nn as nn
 
-from makani.utils.losses.base_loss import GeometricBaseLoss, LossType
+from makani.utils.losses.base_loss import GeometricBaseLoss, LossType, _chunked_quadrature_sum
 from makani.utils import comm
 
 # distributed stuff
@@ -59,6 +60,7 @@ class EnsembleNLLLoss(GeometricBaseLoss):
         spatial_distributed: Optional[bool] = False,
         ensemble_distributed: Optional[bool] = False,
         eps: Optional[float] = 1.0e-5,
+        chunk_size: Optional[int] = None,
         **kwargs,
     ):
 
@@ -76,6 +78,11 @@ class EnsembleNLLLoss(GeometricBaseLoss):
         self.ensemble_distributed = ensemble_distributed and comm.is_distributed("ensemble") and (comm.get_size("ensemble") > 1)
         self.eps = eps
 
+        # number of spatial points processed at once when evaluating the likelihood
+        if (chunk_size is not None) and (chunk_size < 1):
+            raise ValueError(f"chunk_size has to be positive but got {chunk_size}")
+        self.chunk_size = chunk_size
+
         # we also need a variant of the weights split in ensemble direction:
         quad_weight_split = self.quadrature.quad_weight.reshape(1, 1, -1)
         if self.ensemble_distributed:
@@ -108,17 +115,18 @@ class EnsembleNLLLoss(GeometricBaseLoss):
         observations = observations.reshape(B, C, H * W)
         if self.ensemble_distributed:
             observations = scatter_to_parallel_region(observations, -1, "ensemble")
+
+        # combine quadrature and spatial weights
+        quad_weights = self.quad_weight_split
         if spatial_weights is not None:
             spatial_weights_split = spatial_weights.flatten(-2, -1)
-            spatial_weights_split = scatter_to_parallel_region(spatial_weights_split, -1, "ensemble")
+            if self.ensemble_distributed:
+                spatial_weights_split = scatter_to_parallel_region(spatial_weights_split, -1, "ensemble")
+            quad_weights = quad_weights * spatial_weights_split
 
-        likelihood = _log_likelihood_kernel(observations, forecasts, self.eps)
+        # compute the log likelihood and perform the spatial average, chunked if requested
+        likelihood = _chunked_quadrature_sum(partial(_log_likelihood_kernel, eps=self.eps), observations, forecasts, quad_weights, self.chunk_size)
 
-        # perform spatial average of log likelihood score
-        if spatial_weights is not None:
-            likelihood = torch.sum(likelihood * self.quad_weight_split * spatial_weights_split, dim=-1)
-        else:
-            likelihood = torch.sum(likelihood * self.quad_weight_split, dim=-1)
         if self.ensemble_distributed:
             likelihood = reduce_from_parallel_region(likelihood, "ensemble")
 
@@ -21,7 +21,7 @@ import torch
 import torch.nn as nn
 from torch.cuda import amp
 
-from makani.utils.losses.base_loss import GeometricBaseLoss, SpectralBaseLoss, LossType
+from makani.utils.losses.base_loss import GeometricBaseLoss, SpectralBaseLoss, LossType, _chunked_quadrature_sum
 from makani.utils import comm
 
 # distributed stuff
@@ -66,6 +66,10 @@ def _mmd2_ensemble_kernel(observation: torch.Tensor, forecasts: torch.Tensor) ->
     return mmd2
 
 
+def _mmd_deterministic_kernel(observation: torch.Tensor, forecasts: torch.Tensor) -> torch.Tensor:
+    return _mmd_rbf_kernel(observation, forecasts.squeeze(0))
+
+
 class EnsembleMMDLoss(GeometricBaseLoss):
     r"""
     Computes the maximum mean discrepancy loss for a specific kernel. For details see [1]
@@ -84,6 +88,7 @@ class EnsembleMMDLoss(GeometricBaseLoss):
         pole_mask: Optional[int] = 0,
         spatial_distributed: Optional[bool] = False,
         ensemble_distributed: Optional[bool] = False,
+        chunk_size: Optional[int] = None,
         **kwargs,
     ):
 
@@ -102,6 +107,11 @@ class EnsembleMMDLoss(GeometricBaseLoss):
         self.spatial_distributed = comm.is_distributed("spatial") and spatial_distributed
         self.ensemble_distributed = comm.is_distributed("ensemble") and (comm.get_size("ensemble") > 1) and ensemble_distributed
 
+        # number of spatial points processed at once when evaluating the pairwise kernels
+        if (chunk_size is not None) and (chunk_size < 1):
+            raise ValueError(f"chunk_size has to be positive but got {chunk_size}")
+        self.chunk_size = chunk_size
+
         # we also need a variant of the weights split in ensemble direction:
         quad_weight_split = self.quadrature.quad_weight.reshape(1, 1, -1)
         if self.ensemble_distributed:
@@ -128,36 +138,38 @@ class EnsembleMMDLoss(GeometricBaseLoss):
         # observations: batch, channels, lat, lon
         B, E, C, H, W = forecasts.shape
 
-        # if ensemble dim is one dimensional then computing the score is quick:
-        if (not self.ensemble_distributed) and (forecasts.shape[1] == 1):
-            # in this case, CRPS is straightforward
-            mmd = _mmd_rbf_kernel(observations, forecasts.squeeze(1)).reshape(B, C, H * W)
-        else:
-            # transpose forecasts: ensemble, batch, channels, lat, lon
-            forecasts = torch.moveaxis(forecasts, 1, 0)
+        # transpose forecasts: ensemble, batch, channels, lat, lon
+        forecasts = torch.moveaxis(forecasts, 1, 0)
 
-            # now we need to transpose the forecasts into ensemble direction.
-            # ideally we split spatial dims
-            forecasts = forecasts.reshape(E, B, C, H * W)
-            if self.ensemble_distributed:
-                ensemble_shapes = [forecasts.shape[0] for _ in range(comm.get_size("ensemble"))]
-                forecasts = distributed_transpose.apply(forecasts, (-1, 0), ensemble_shapes, "ensemble")
-            # observations does not need a transpose, but just a split
-            observations = observations.reshape(B, C, H * W)
+        # now we need to transpose the forecasts into ensemble direction.
+        # ideally we split spatial dims
+        forecasts = forecasts.reshape(E, B, C, H * W)
+        if self.ensemble_distributed:
+            ensemble_shapes = [forecasts.shape[0] for _ in range(comm.get_size("ensemble"))]
+            forecasts = distributed_transpose.apply(forecasts, (-1, 0), ensemble_shapes, "ensemble")
+        # observations does not need a transpose, but just a split
+        observations = observations.reshape(B, C, H * W)
+        if self.ensemble_distributed:
+            observations = scatter_to_parallel_region(observations, -1, "ensemble")
+
+        # combine quadrature and spatial weights
+        quad_weights = self.quad_weight_split
+        if spatial_weights is not None:
+            spatial_weights_split = spatial_weights.flatten(-2, -1)
             if self.ensemble_distributed:
-                observations = scatter_to_parallel_region(observations, -1, "ensemble")
-            if spatial_weights is not None:
-                spatial_weights_split = spatial_weights.flatten(-2, -1)
                 spatial_weights_split = scatter_to_parallel_region(spatial_weights_split, -1, "ensemble")
+            quad_weights = quad_weights * spatial_weights_split
 
-            # now, E dimension is local and spatial dim is split further. Compute the mmd
-            mmd = _mmd2_ensemble_kernel(observations, forecasts)
-
-        # perform spatial average of crps score
-        if spatial_weights is not None:
-            mmd = torch.sum(mmd * self.quad_weight_split * spatial_weights_split, dim=-1)
+        # if ensemble dim is one dimensional then computing the score is quick:
+        if (not self.ensemble_distributed) and (E == 1):
+            kernel = _mmd_deterministic_kernel
         else:
-            mmd = torch.sum(mmd * self.quad_weight_split, dim=-1)
+            # now, E dimension is local and spatial dim is split further
+            kernel = _mmd2_ensemble_kernel
+
+        # compute the mmd and perform the spatial average, chunked if requested
+        mmd = _chunked_quadrature_sum(kernel, observations, forecasts, quad_weights, self.chunk_size)
+
         if self.ensemble_distributed:
             mmd = reduce_from_parallel_region(mmd, "ensemble")
 
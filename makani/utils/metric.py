@@ -15,6 +15,7 @@
 
 from typing import Optional
 from functools import partial
+import math
 
 import h5py as h5
 
@@ -101,6 +102,19 @@ class MetricRollout:
                 self.rollout_integral.fill_(0.0)
         return
 
+    def _accumulate(self, metric: torch.Tensor, idt: int, batch_size: int):
+
+        if hasattr(self, "scale"):
+            metric = metric * self.scale
+
+        vals = torch.stack([self.rollout_curve[idt, ...], metric], dim=0)
+        counts = torch.stack([self.rollout_counter[idt], torch.tensor(batch_size, device=self.rollout_counter.device, dtype=self.rollout_counter.dtype)], dim=0)
+        vals, counts = self.metric_func.combine(vals, counts, dim=0)
+        self.rollout_curve[idt, ...].copy_(vals)
+        self.rollout_counter[idt].copy_(counts)
+
+        return
+
     def update(self, inp: torch.Tensor, tar: torch.Tensor, idt: int, wgt: Optional[torch.Tensor] = None):
 
         # check dimension
@@ -110,14 +124,29 @@ class MetricRollout:
         # compute metric
         metric = self.metric_func(inpp, tarp, wgt)
 
-        if hasattr(self, "scale"):
-            metric = metric * self.scale
+        self._accumulate(metric, idt, inp.shape[0])
 
-        vals = torch.stack([self.rollout_curve[idt, ...], metric], dim=0)
-        counts = torch.stack([self.rollout_counter[idt], torch.tensor(inp.shape[0], device=self.rollout_counter.device, dtype=self.rollout_counter.dtype)], dim=0)
-        vals, counts = self.metric_func.combine(vals, counts, dim=0)
-        self.rollout_curve[idt, ...].copy_(vals)
-        self.rollout_counter[idt].copy_(counts)
+        return
+
+    @property
+    def supports_partial_sums(self):
+        return self.metric_func.supports_partial_sums
+
+    def partial_sums(self, inp: torch.Tensor, tar: torch.Tensor, wgt: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """local quadrature sums which still need to be reduced across spatial ranks"""
+
+        # check dimension
+        inpp = inp[..., self.channel_mask, :, :]
+        tarp = tar[..., self.channel_mask, :, :]
+
+        return self.metric_func.partial_sums(inpp, tarp, wgt)
+
+    def update_from_partial_sums(self, sums: torch.Tensor, idt: int, batch_size: int):
+        """update from spatially reduced partial sums"""
+
+        metric = self.metric_func.from_partial_sums(sums)
+
+        self._accumulate(metric, idt, batch_size)
 
         return
 
@@ -221,6 +250,7 @@ class MetricsHandler:
         ssr_var_names=["u10m", "t2m", "u500", "z500", "q500", "sp"],
         rh_var_names=[],
         wb2_compatible=False,
+        deferred_reduction=None,
     ):
 
         self.device = device
@@ -231,6 +261,13 @@ class MetricsHandler:
         self.spatial_distributed = comm.is_distributed("spatial") and (comm.get_size("spatial") > 1)
         self.ensemble_distributed = comm.is_distributed("ensemble") and (comm.get_size("ensemble") > 1)
 
+        # in deferred mode, metrics which support it only compute local partial sums in update. These are
+        # reduced across spatial ranks in a single asynchronous collective, which is completed on the next update
+        if deferred_reduction is None:
+            deferred_reduction = params.get("deferred_metric_reduction", False)
+        self.deferred_reduction = deferred_reduction
+        self.pending_reduction = None
+
         # set a stream
         if self.device.type == "cuda":
             self.stream = torch.Stream(device='cuda')
@@ -402,6 +439,7 @@ class MetricsHandler:
                 batch_reduction="sum",
                 spatial_distributed=self.spatial_distributed,
                 ensemble_distributed=self.ensemble_distributed,
+                chunk_size=params.get("crps_chunk_size", None),
             )
 
             self.metric_handles.append(
@@ -540,6 +578,13 @@ class MetricsHandler:
     def zero_buffers(self):
         """set buffers to zero"""
 
+        # make sure no outstanding reduction writes into the buffers later
+        if self.pending_reduction is not None:
+            req = self.pending_reduction[0]
+            if req is not None:
+                req.wait()
+            self.pending_reduction = None
+
         with torch.no_grad():
             self.valid_buffer.fill_(0)
 
@@ -548,9 +593,49 @@ class MetricsHandler:
 
         return
 
+    def _launch_deferred_reduction(self, handles, prediction, target, idt, weight=None):
+        """computes local partial sums of all handles and reduces them in a single asynchronous collective"""
+
+        with torch.no_grad():
+            sums = [handle.partial_sums(prediction, target, weight) for handle in handles]
+            shapes = [s.shape for s in sums]
+
+            # flatten into a single contiguous bucket
+            bucket = torch.cat([s.reshape(-1).to(torch.float32) for s in sums], dim=0)
+
+            req = None
+            if self.spatial_distributed:
+                req = dist.all_reduce(bucket, op=dist.ReduceOp.SUM, group=comm.get_group("spatial"), async_op=True)
+
+        self.pending_reduction = (req, bucket, handles, shapes, idt, prediction.shape[0])
+
+        return
+
+    def _complete_deferred_reduction(self):
+        """waits for an outstanding reduction and updates the corresponding metrics"""
+
+        if self.pending_reduction is None:
+            return
+
+        req, bucket, handles, shapes, idt, batch_size = self.pending_reduction
+        self.pending_reduction = None
+
+        if req is not None:
+            req.wait()
+
+        with torch.no_grad():
+            sums = torch.split(bucket, [math.prod(shape) for shape in shapes], dim=0)
+            for handle, s, shape in zip(handles, sums, shapes):
+                handle.update_from_partial_sums(s.reshape(shape), idt, batch_size)
+
+        return
+
     def update(self, prediction, target, loss, idt, weight=None):
         """update function to update buffers on each autoregressive rollout step"""
 
+        # complete the reduction of the previous step, which was overlapped with the current step
+        self._complete_deferred_reduction()
+
         if prediction.dim() == 5:
             prediction_mean = torch.mean(prediction, dim=1)
             if self.ensemble_distributed:
@@ -559,14 +644,21 @@ class MetricsHandler:
             prediction_mean = prediction
             prediction = prediction.unsqueeze(1)
 
+        deferred_handles = []
         for handle in self.metric_handles:
             if handle.type == LossType.Deterministic:
-                handle.update(prediction_mean, target, idt, weight)
+                if self.deferred_reduction and handle.supports_partial_sums:
+                    deferred_handles.append(handle)
+                else:
+                    handle.update(prediction_mean, target, idt, weight)
             elif handle.type == LossType.Probabilistic:
                 handle.update(prediction, target, idt, weight)
             else:
                 raise NotImplementedError(f"Error, LossType {handle.type} not implemented.")
 
+        if deferred_handles:
+            self._launch_deferred_reduction(deferred_handles, prediction_mean, target, idt, weight)
+
         # only update this at the first step
         if idt == 0:
             self.valid_steps += 1.0
@@ -574,9 +666,36 @@ class MetricsHandler:
 
         return
 
+    def _reduce_bucketed(self):
+        """gathers the validation loss and all metric buffers across the batch group in a single collective"""
+
+        tensors = [self.valid_buffer]
+        for handle in self.metric_handles:
+            tensors += [handle.rollout_curve, handle.rollout_counter]
+        sizes = [t.numel() for t in tensors]
+
+        # flatten into a single contiguous bucket
+        bucket = torch.cat([t.reshape(-1) for t in tensors], dim=0)
+        bucketlist = [torch.empty_like(bucket) for _ in range(comm.get_size("batch"))]
+        req = dist.all_gather(bucketlist, bucket, group=comm.get_group("batch"), async_op=True)
+        req.wait()
+
+        # unpack: the loss is summed, the metrics are combined with their respective rules
+        chunks = torch.split(torch.stack(bucketlist, dim=0), sizes, dim=1)
+        self.valid_buffer.copy_(torch.sum(chunks[0], dim=0))
+        for idx, handle in enumerate(self.metric_handles):
+            vals = chunks[2 * idx + 1].reshape(-1, *handle.rollout_curve.shape)
+            counts = chunks[2 * idx + 2].reshape(-1, *handle.rollout_counter.shape)
+            handle._combine_helper(list(torch.unbind(vals, dim=0)), list(torch.unbind(counts, dim=0)))
+
+        return
+
     def finalize(self):
         """Finalize routine to gather all of the metrics to rank 0 and assemble logs"""
 
+        # complete outstanding deferred reductions
+        self._complete_deferred_reduction()
+
         # sync here
         if dist.is_initialized():
             dist.barrier(device_ids=[self.device.index])
@@ -590,11 +709,7 @@ class MetricsHandler:
             with torch.cuda.stream(self.stream):
 
                 if dist.is_initialized():
-                    req = dist.all_reduce(self.valid_buffer, op=dist.ReduceOp.SUM, group=comm.get_group("batch"), async_op=True)
-                    req.wait()
-
-                for handle in self.metric_handles:
-                    handle.reduce(non_blocking=True)
+                    self._reduce_bucketed()
 
             # finalize computations
             with torch.cuda.stream(self.stream):
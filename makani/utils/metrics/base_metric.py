@@ -99,6 +99,39 @@ class GeometricBaseMetric(nn.Module, metaclass=ABCMeta):
     def type(self):
         return LossType.Deterministic
 
+    @property
+    def supports_partial_sums(self) -> bool:
+        """
+        Whether the metric can be evaluated from local quadrature sums, see partial_sums.
+        """
+        return False
+
+    def partial_sums(self, x: torch.Tensor, y: torch.Tensor, weight: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """
+        Computes the local quadrature sums the metric is built from, stacked along the last dimension. The sums are not
+        reduced across spatial ranks, so that the caller can reduce the sums of several metrics in a single collective.
+        """
+        raise NotImplementedError(f"Metric {self.__class__.__name__} does not support evaluation from partial sums.")
+
+    def from_partial_sums(self, sums: torch.Tensor) -> torch.Tensor:
+        """
+        Evaluates the metric from spatially reduced partial sums, including channel and batch reductions.
+        """
+        raise NotImplementedError(f"Metric {self.__class__.__name__} does not support evaluation from partial sums.")
+
+    def _reduce_channels_and_batch(self, vals: torch.Tensor) -> torch.Tensor:
+        if self.channel_reduction == "mean":
+            vals = torch.mean(vals, dim=1)
+        elif self.channel_reduction == "sum":
+            vals = torch.sum(vals, dim=1)
+
+        if self.batch_reduction == "mean":
+            vals = torch.mean(vals, dim=0)
+        elif self.batch_reduction == "sum":
+            vals = torch.sum(vals, dim=0)
+
+        return vals
+
     def combine(self, vals: torch.Tensor, counts: torch.Tensor, dim: Optional[int]=0) -> Tuple[torch.Tensor, torch.Tensor]:
         """
         Defines how to combine multiple metrics result using Welford.
@@ -49,26 +49,30 @@ class GeometricL1(GeometricBaseMetric):
             spatial_distributed=spatial_distributed
         )
 
-    def forward(self, x: torch.Tensor, y: torch.Tensor, weight: Optional[torch.Tensor] = None) -> torch.Tensor:
+    @property
+    def supports_partial_sums(self):
+        return True
+
+    def partial_sums(self, x: torch.Tensor, y: torch.Tensor, weight: Optional[torch.Tensor] = None) -> torch.Tensor:
 
         if weight is not None:
-            diff = self.quadrature(torch.abs(x - y) * weight)
+            diff = self.quadrature(torch.abs(x - y) * weight, reduce=False)
         else:
-            diff = self.quadrature(torch.abs(x - y))
+            diff = self.quadrature(torch.abs(x - y), reduce=False)
 
-        # reduce:
-        if self.channel_reduction == "mean":
-            diff = torch.mean(diff, dim=1)
-        elif self.channel_reduction == "sum":
-            diff = torch.sum(diff, dim=1)
+        return diff.unsqueeze(-1)
 
-        if self.batch_reduction == "mean":
-            diff = torch.mean(diff, dim=0)
-        elif self.batch_reduction == "sum":
-            diff = torch.sum(diff, dim=0)
+    def from_partial_sums(self, sums: torch.Tensor) -> torch.Tensor:
+
+        # reduce:
+        diff = self._reduce_channels_and_batch(sums[..., 0])
 
         return diff
 
+    def forward(self, x: torch.Tensor, y: torch.Tensor, weight: Optional[torch.Tensor] = None) -> torch.Tensor:
+        sums = self.quadrature.reduce(self.partial_sums(x, y, weight))
+        return self.from_partial_sums(sums)
+
 
 class GeometricRMSE(GeometricBaseMetric):
     def __init__(
@@ -107,30 +111,33 @@ class GeometricRMSE(GeometricBaseMetric):
         else:
             return vals / torch.sqrt(counts)
 
-    def forward(self, x: torch.Tensor, y: torch.Tensor, weight: Optional[torch.Tensor] = None) -> torch.Tensor:
+    @property
+    def supports_partial_sums(self):
+        return True
+
+    def partial_sums(self, x: torch.Tensor, y: torch.Tensor, weight: Optional[torch.Tensor] = None) -> torch.Tensor:
 
         if weight is not None:
-            diff = self.quadrature(torch.square(x - y) * weight)
+            diff = self.quadrature(torch.square(x - y) * weight, reduce=False)
         else:
-            diff = self.quadrature(torch.square(x - y))
+            diff = self.quadrature(torch.square(x - y), reduce=False)
 
-        # reduce channels:
-        if self.channel_reduction == "mean":
-            diff = torch.mean(diff, dim=1)
-        elif self.channel_reduction == "sum":
-            diff = torch.sum(diff, dim=1)
+        return diff.unsqueeze(-1)
 
-        # reduce batch:
-        if self.batch_reduction == "mean":
-            diff = torch.mean(diff, dim=0)
-        elif self.batch_reduction == "sum":
-            diff = torch.sum(diff, dim=0)
+    def from_partial_sums(self, sums: torch.Tensor) -> torch.Tensor:
+
+        # reduce channels and batch:
+        diff = self._reduce_channels_and_batch(sums[..., 0])
 
         # compute square root:
         result = torch.sqrt(diff)
 
         return result
 
+    def forward(self, x: torch.Tensor, y: torch.Tensor, weight: Optional[torch.Tensor] = None) -> torch.Tensor:
+        sums = self.quadrature.reduce(self.partial_sums(x, y, weight))
+        return self.from_partial_sums(sums)
+
 
 class GeometricACC(GeometricBaseMetric):
     def __init__(
@@ -175,42 +182,47 @@ class GeometricACC(GeometricBaseMetric):
         else:
             return super().finalize(vals, counts)
 
-    def forward(self, x: torch.Tensor, y: torch.Tensor, weight: Optional[torch.Tensor] = None) -> torch.Tensor:
+    @property
+    def supports_partial_sums(self):
+        return True
+
+    def partial_sums(self, x: torch.Tensor, y: torch.Tensor, weight: Optional[torch.Tensor] = None) -> torch.Tensor:
 
         if hasattr(self, "bias"):
             x = x - self.bias
             y = y - self.bias
 
         if weight is not None:
-            cov_xy = self.quadrature(x * y * weight)
-            var_x = self.quadrature(torch.square(x) * weight)
-            var_y = self.quadrature(torch.square(y) * weight)
+            cov_xy = self.quadrature(x * y * weight, reduce=False)
+            var_x = self.quadrature(torch.square(x) * weight, reduce=False)
+            var_y = self.quadrature(torch.square(y) * weight, reduce=False)
         else:
-            cov_xy = self.quadrature(x * y)
-            var_x = self.quadrature(torch.square(x))
-            var_y = self.quadrature(torch.square(y))
+            cov_xy = self.quadrature(x * y, reduce=False)
+            var_x = self.quadrature(torch.square(x), reduce=False)
+            var_y = self.quadrature(torch.square(y), reduce=False)
+
+        # stack along dim -1 so that all three integrals are reduced together
+        return torch.stack([cov_xy, var_x, var_y], dim=-1)
+
+    def from_partial_sums(self, sums: torch.Tensor) -> torch.Tensor:
 
         # compute ratio
         if self.method == "macro":
+            cov_xy, var_x, var_y = torch.unbind(sums, dim=-1)
             acc = cov_xy / (torch.sqrt(var_x * var_y) + self.eps)
         else:
-            # stack along dim -1:
             # we form the ratio in the finalization step
-            acc = torch.stack([cov_xy, var_x, var_y], dim=-1)
-        
-        # reduce
-        if self.channel_reduction == "mean":
-            acc = torch.mean(acc, dim=1)
-        elif self.channel_reduction == "sum":
-            acc = torch.sum(acc, dim=1)
+            acc = sums
 
-        if self.batch_reduction == "mean":
-            acc = torch.mean(acc, dim=0)
-        elif self.batch_reduction == "sum":
-            acc = torch.sum(acc, dim=0)
+        # reduce
+        acc = self._reduce_channels_and_batch(acc)
 
         return acc
 
+    def forward(self, x: torch.Tensor, y: torch.Tensor, weight: Optional[torch.Tensor] = None) -> torch.Tensor:
+        sums = self.quadrature.reduce(self.partial_sums(x, y, weight))
+        return self.from_partial_sums(sums)
+
 
 class GeometricPCC(GeometricBaseMetric):
     def __init__(
@@ -494,6 +506,7 @@ class GeometricCRPS(torch.nn.Module):
         ensemble_weights: Optional[torch.Tensor] = None,
         spatial_distributed: Optional[bool] = False,
         ensemble_distributed: Optional[bool] = False,
+        chunk_size: Optional[int] = None,
         **kwargs,
     ):
         super().__init__()
@@ -509,6 +522,7 @@ class GeometricCRPS(torch.nn.Module):
             spatial_distributed=spatial_distributed,
             ensemble_distributed=ensemble_distributed,
             ensemble_weights=ensemble_weights,
+            chunk_size=chunk_size,
         )
 
         self.channel_reduction = channel_reduction
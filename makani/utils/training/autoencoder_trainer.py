@@ -190,6 +190,8 @@ class AutoencoderTrainer(Driver):
                     find_unused_parameters=self.params["enable_grad_anomaly_detection"],
                     gradient_as_bucket_view=True,
                     static_graph=False,
+                    gradient_compression=self.params.get("gradient_compression", "none"),
+                    gradient_compression_parameters=self.params.get("gradient_compression_parameters", None),
                     verbose=True,
                 )
 
@@ -392,13 +394,17 @@ class AutoencoderTrainer(Driver):
                 checkpoint_path = self.params.checkpoint_path.format(checkpoint_version=self.checkpoint_version_current, mp_rank="{mp_rank}")
 
                 # checkpoint at the end of every epoch
-                self.save_checkpoint(checkpoint_path, self.model, self.loss_obj, self.optimizer, self.scheduler, counters, checkpoint_mode=checkpoint_mode)
+                self.save_checkpoint(checkpoint_path, self.model, self.loss_obj, self.optimizer, self.scheduler, counters, checkpoint_mode=checkpoint_mode, checkpoint_writer=self.checkpoint_writer)
 
                 # save best checkpoint
                 best_checkpoint_path = self.params.best_checkpoint_path.format(mp_rank=comm.get_rank("model"))
                 best_checkpoint_saved = os.path.isfile(best_checkpoint_path)
+                # the best checkpoint might still be in flight in the asynchronous writer
+                if (not best_checkpoint_saved) and (self.checkpoint_writer is not None):
+                    self.checkpoint_writer.wait()
+                    best_checkpoint_saved = os.path.isfile(best_checkpoint_path)
                 if (not self.params.get("skip_validation", False)) and ((not best_checkpoint_saved) or (valid_logs["base"]["validation loss"] <= best_valid_loss)):
-                    self.save_checkpoint(self.params.best_checkpoint_path, self.model, self.loss_obj, self.optimizer, self.scheduler, counters, checkpoint_mode=checkpoint_mode)
+                    self.save_checkpoint(self.params.best_checkpoint_path, self.model, self.loss_obj, self.optimizer, self.scheduler, counters, checkpoint_mode=checkpoint_mode, checkpoint_writer=self.checkpoint_writer)
                     best_valid_loss = valid_logs["base"]["validation loss"]
 
                 # time how long it took
@@ -431,6 +437,10 @@ class AutoencoderTrainer(Driver):
             if self.params.get("skip_training", False):
                 break
 
+        # make sure that all checkpoints are written
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.wait()
+
         # training done
         training_end = time.time()
         if self.log_to_screen:
@@ -17,6 +17,7 @@ import os
 import sys
 import gc
 import time
+from contextlib import nullcontext
 from typing import Optional
 import numpy as np
 from tqdm import tqdm
@@ -201,6 +202,9 @@ class EnsembleTrainer(Trainer):
         # gradient clipping
         self.max_grad_norm = self.params.get("optimizer_max_grad_norm", -1.0)
 
+        # stream the ensemble members through forward and backward one at a time
+        self.ensemble_streaming = self.params.get("ensemble_streaming", False)
+
         # we need this further down
         with Timer() as timer:
             capture_stream = None
@@ -218,6 +222,8 @@ class EnsembleTrainer(Trainer):
                         find_unused_parameters=self.params["enable_grad_anomaly_detection"],
                         gradient_as_bucket_view=True,
                         static_graph=False,
+                        gradient_compression=self.params.get("gradient_compression", "none"),
+                        gradient_compression_parameters=self.params.get("gradient_compression_parameters", None),
                         verbose=True,
                     )
 
@@ -432,14 +438,18 @@ class EnsembleTrainer(Trainer):
                 checkpoint_path = self.params.checkpoint_path.format(checkpoint_version=self.checkpoint_version_current, mp_rank="{mp_rank}")
 
                 # checkpoint at the end of every epoch
-                self.save_checkpoint(checkpoint_path, self.model, self.loss_obj, self.model_optimizer, self.model_scheduler, counters, checkpoint_mode=checkpoint_mode)
+                self.save_checkpoint(checkpoint_path, self.model, self.loss_obj, self.model_optimizer, self.model_scheduler, counters, checkpoint_mode=checkpoint_mode, checkpoint_writer=self.checkpoint_writer)
 
                 # save best checkpoint
                 best_checkpoint_path = self.params.best_checkpoint_path.format(mp_rank=comm.get_rank("model"))
                 best_model_checkpoint_saved = os.path.isfile(best_checkpoint_path)
+                # the best checkpoint might still be in flight in the asynchronous writer
+                if (not best_model_checkpoint_saved) and (self.checkpoint_writer is not None):
+                    self.checkpoint_writer.wait()
+                    best_model_checkpoint_saved = os.path.isfile(best_checkpoint_path)
                 if (not self.params.get("skip_validation", False)) and ((not best_model_checkpoint_saved) or (valid_logs["base"]["validation loss"] <= best_valid_loss)):
                     self.save_checkpoint(
-                        self.params.best_checkpoint_path, self.model, self.loss_obj, self.model_optimizer, self.model_scheduler, counters, checkpoint_mode=checkpoint_mode
+                        self.params.best_checkpoint_path, self.model, self.loss_obj, self.model_optimizer, self.model_scheduler, counters, checkpoint_mode=checkpoint_mode, checkpoint_writer=self.checkpoint_writer
                     )
                     best_valid_loss = valid_logs["base"]["validation loss"]
 
@@ -473,6 +483,10 @@ class EnsembleTrainer(Trainer):
             if self.params.get("skip_training", False):
                 break
 
+        # make sure that all checkpoints are written
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.wait()
+
         # training done
         training_end = time.time()
         if self.log_to_screen:
@@ -495,6 +509,62 @@ class EnsembleTrainer(Trainer):
 
         return pred, loss
 
+    def _get_rng_state(self):
+        cpu_state = torch.get_rng_state()
+        gpu_state = torch.cuda.get_rng_state(self.device) if self.device.type == "cuda" else None
+        noise_state = (self.preprocessor.get_internal_state(tensor=True), self.preprocessor.get_internal_state(tensor=False))
+        return cpu_state, gpu_state, noise_state
+
+    def _set_rng_state(self, state):
+        cpu_state, gpu_state, noise_state = state
+        torch.set_rng_state(cpu_state)
+        if gpu_state is not None:
+            torch.cuda.set_rng_state(gpu_state, self.device)
+        self.preprocessor.set_internal_state(noise_state[0])
+        self.preprocessor.set_internal_state(noise_state[1])
+
+    def _ensemble_step_streaming(self, inp: torch.Tensor, tar: torch.Tensor, loss_scaling_fact: float, do_update: bool):
+        """
+        Two-pass variant of the ensemble step, which keeps the activation memory constant in the ensemble size. The first pass
+        computes all member predictions without autograd graphs and obtains the gradient of the loss w.r.t. the predictions.
+        Since ensemble losses such as the fair CRPS couple the members only through their predictions, the second pass can then
+        recompute each member with the same random state and backpropagate its slice of the gradient, one member at a time.
+        The backward pass is carried out inside this routine.
+        """
+        num_members = self.params.local_ensemble_size
+
+        # first pass: predictions and random states of all members
+        rng_states = []
+        predlist = []
+        with torch.no_grad():
+            for _ in range(num_members):
+                rng_states.append(self._get_rng_state())
+                with amp.autocast(device_type="cuda", enabled=self.amp_enabled, dtype=self.amp_dtype):
+                    predlist.append(self.model_train(inp))
+        final_rng_state = self._get_rng_state()
+
+        # gradient of the loss w.r.t. the predictions
+        pred = torch.stack(predlist, dim=1).requires_grad_(True)
+        with amp.autocast(device_type="cuda", enabled=self.amp_enabled, dtype=self.amp_dtype):
+            loss = self.loss_obj(pred, tar) * loss_scaling_fact
+        self.gscaler.scale(loss).backward()
+        pred_grad = pred.grad
+        del predlist
+
+        # second pass: recompute and backpropagate member by member. Only the last member triggers the gradient reduction
+        for e in range(num_members):
+            sync = do_update and (e == num_members - 1)
+            with nullcontext() if (sync or not hasattr(self.model_train, "no_sync")) else self.model_train.no_sync():
+                self._set_rng_state(rng_states[e])
+                with amp.autocast(device_type="cuda", enabled=self.amp_enabled, dtype=self.amp_dtype):
+                    pred_member = self.model_train(inp)
+                pred_member.backward(pred_grad[:, e, ...])
+
+        # continue with the random state after the first pass
+        self._set_rng_state(final_rng_state)
+
+        return pred.detach(), loss.detach()
+
     def train_one_epoch(self, profiler=None):
         self.epoch += 1
         total_data_bytes = 0
@@ -536,18 +606,22 @@ class EnsembleTrainer(Trainer):
             if self.params["gradient_accumulation_steps"] > 1:
                 loss_scaling_fact = 1.0 / np.float32(self.params["gradient_accumulation_steps"])
 
-            # accumulate loss into this tensor
-            with amp.autocast(device_type="cuda", enabled=self.amp_enabled, dtype=self.amp_dtype):
+            if self.ensemble_streaming:
+                # forward and backward pass are carried out member by member
+                pred, loss = self._ensemble_step_streaming(inp, tar, loss_scaling_fact, do_update)
+            else:
+                # accumulate loss into this tensor
+                with amp.autocast(device_type="cuda", enabled=self.amp_enabled, dtype=self.amp_dtype):
 
-                if do_update:
-                    pred, loss = self._ensemble_step(inp, tar)
-                else:
-                    with self.model_train.no_sync():
+                    if do_update:
                         pred, loss = self._ensemble_step(inp, tar)
-                loss = loss * loss_scaling_fact
+                    else:
+                        with self.model_train.no_sync():
+                            pred, loss = self._ensemble_step(inp, tar)
+                    loss = loss * loss_scaling_fact
 
-            # backward pass
-            self.gscaler.scale(loss).backward()
+                # backward pass
+                self.gscaler.scale(loss).backward()
 
             # increment accumulated loss
             accumulated_loss[0] += loss.detach().clone() * inp.shape[0]
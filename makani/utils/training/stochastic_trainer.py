@@ -36,6 +36,7 @@ import wandb
 
 # makani depenedencies
 from makani.utils import LossHandler, MetricsHandler
+from makani.utils.compilation import enable_compile_cache, enable_kernel_compilation, compile_regions
 from makani.utils.driver import Driver
 from makani.utils.training import Trainer
 from makani.utils.dataloader import get_dataloader
@@ -201,6 +202,8 @@ class StochasticTrainer(Driver):
                     find_unused_parameters=self.params["enable_grad_anomaly_detection"],
                     gradient_as_bucket_view=True,
                     static_graph=False,
+                    gradient_compression=self.params.get("gradient_compression", "none"),
+                    gradient_compression_parameters=self.params.get("gradient_compression_parameters", None),
                     verbose=True,
                 )
 
@@ -321,11 +324,27 @@ class StochasticTrainer(Driver):
     # jit stuff
     def _compile_model(self, inp_shape):
 
+        if self.params.jit_mode in ["inductor", "inductor_regional"]:
+            # persistent cache for the compiled graphs and kernels, which is reused when the job is restarted
+            if self.params.get("compile_cache_dir", None) is not None:
+                cache_dir = enable_compile_cache(self.params.compile_cache_dir, self.params)
+                if self.log_to_screen:
+                    self.logger.info(f"Using compile cache {cache_dir}")
+
+            enable_kernel_compilation()
+
         if self.params.jit_mode == "inductor":
             self.model = torch.compile(self.model)
             self.model_train = self.model
             self.model_eval = self.model
 
+        elif self.params.jit_mode == "inductor_regional":
+            num_regions = compile_regions(self.model)
+            if self.log_to_screen:
+                self.logger.info(f"Compiled {num_regions} model blocks")
+            self.model_train = self.model
+            self.model_eval = self.model
+
         else:
             self.model_train = self.model
             self.model_eval = self.model
@@ -411,13 +430,17 @@ class StochasticTrainer(Driver):
                 checkpoint_path = self.params.checkpoint_path.format(checkpoint_version=self.checkpoint_version_current, mp_rank="{mp_rank}")
 
                 # checkpoint at the end of every epoch
-                self.save_checkpoint(checkpoint_path, self.model, self.loss_obj, self.optimizer, self.scheduler, counters, checkpoint_mode=checkpoint_mode)
+                self.save_checkpoint(checkpoint_path, self.model, self.loss_obj, self.optimizer, self.scheduler, counters, checkpoint_mode=checkpoint_mode, checkpoint_writer=self.checkpoint_writer)
 
                 # save best checkpoint
                 best_checkpoint_path = self.params.best_checkpoint_path.format(mp_rank=comm.get_rank("model"))
                 best_checkpoint_saved = os.path.isfile(best_checkpoint_path)
+                # the best checkpoint might still be in flight in the asynchronous writer
+                if (not best_checkpoint_saved) and (self.checkpoint_writer is not None):
+                    self.checkpoint_writer.wait()
+                    best_checkpoint_saved = os.path.isfile(best_checkpoint_path)
                 if (not self.params.get("skip_validation", False)) and ((not best_checkpoint_saved) or (valid_logs["base"]["validation loss"] <= best_valid_loss)):
-                    self.save_checkpoint(self.params.best_checkpoint_path, self.model, self.loss_obj, self.optimizer, self.scheduler, counters, checkpoint_mode=checkpoint_mode)
+                    self.save_checkpoint(self.params.best_checkpoint_path, self.model, self.loss_obj, self.optimizer, self.scheduler, counters, checkpoint_mode=checkpoint_mode, checkpoint_writer=self.checkpoint_writer)
                     best_valid_loss = valid_logs["base"]["validation loss"]
 
                 # time how long it took
@@ -450,6 +473,10 @@ class StochasticTrainer(Driver):
             if self.params.get("skip_training", False):
                 break
 
+        # make sure that all checkpoints are written
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.wait()
+
         # training done
         training_end = time.time()
         if self.log_to_screen:
@@ -632,13 +659,20 @@ class StochasticTrainer(Driver):
                         # FW pass
                         predlist = []
                         with amp.autocast(device_type="cuda", enabled=self.amp_enabled, dtype=self.amp_dtype):
+                            # evaluate all ensemble members in a single batched trajectory if requested
+                            if self.params.get("stochastic_interpolation_batched", False):
+                                predlist = list(torch.unbind(self.model_eval(torch.stack(inptlist, dim=1), n_steps=self.params.stochastic_interpolation_steps), dim=1))
+
                             for ic in range(self.params.local_ensemble_size):
                                 # retrieve input
                                 inpt = inptlist[ic]
 
                                 # forward pass
-                                pred = self.model_eval(inpt, n_steps=self.params.stochastic_interpolation_steps)
-                                predlist.append(pred)
+                                if len(predlist) <= ic:
+                                    pred = self.model_eval(inpt, n_steps=self.params.stochastic_interpolation_steps)
+                                    predlist.append(pred)
+                                else:
+                                    pred = predlist[ic]
 
                                 # append input to prediction
                                 inptlist[ic] = self.preprocessor.append_history(inpt, pred, idt, update_state=(ic == 0))
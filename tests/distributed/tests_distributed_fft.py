@@ -219,10 +219,12 @@ class TestDistributedRealFFT(unittest.TestCase):
             [361, 720, 0,  1, 10, 1e-6],
             [256, 512, 4, 32,  8, 1e-6],
             [361, 720, 4,  1, 10, 1e-6],
+            [256, 512, 0, 32,  8, 1e-6, 4],
+            [361, 720, 0,  1, 10, 1e-6, 3],
         ],
         skip_on_empty=True,
     )
-    def test_distributed_fft2_3(self, nlat, nlon, nalt, batch_size, num_chan, tol, verbose=False):
+    def test_distributed_fft2_3(self, nlat, nlon, nalt, batch_size, num_chan, tol, pipeline_chunks=1, verbose=False):
         B, C, D, H, W = batch_size, num_chan, nalt, nlat, nlon
 
         # set up handles
@@ -231,7 +233,7 @@ class TestDistributedRealFFT(unittest.TestCase):
             forward_transform_dist = DistributedRealFFT3(nd=D, nh=H, nw=W).to(self.device)
         else:
             forward_transform_local = RealFFT2(nlat=H, nlon=W).to(self.device)
-            forward_transform_dist = DistributedRealFFT2(nlat=H, nlon=W).to(self.device)
+            forward_transform_dist = DistributedRealFFT2(nlat=H, nlon=W, pipeline_chunks=pipeline_chunks).to(self.device)
 
         # create tensors
         if D > 0:
@@ -290,10 +292,12 @@ class TestDistributedRealFFT(unittest.TestCase):
             [361, 720, 0,  1, 10, 5e-6],
             [256, 512, 4, 32,  8, 5e-6],
             [361, 720, 4,  1, 10, 5e-6],
+            [256, 512, 0, 32,  8, 5e-6, 4],
+            [361, 720, 0,  1, 10, 5e-6, 3],
         ],
         skip_on_empty=True,
     )
-    def test_distributed_ifft2_3(self, nlat, nlon, nalt, batch_size, num_chan, tol, verbose=True):
+    def test_distributed_ifft2_3(self, nlat, nlon, nalt, batch_size, num_chan, tol, pipeline_chunks=1, verbose=True):
         B, C, D, H, W = batch_size, num_chan, nalt, nlat, nlon
 
         if D > 0:
@@ -303,7 +307,7 @@ class TestDistributedRealFFT(unittest.TestCase):
         else:
             forward_transform_local = RealFFT2(nlat=H, nlon=W).to(self.device)
             backward_transform_local = InverseRealFFT2(nlat=H, nlon=W).to(self.device)
-            backward_transform_dist = DistributedInverseRealFFT2(nlat=H, nlon=W).to(self.device)
+            backward_transform_dist = DistributedInverseRealFFT2(nlat=H, nlon=W, pipeline_chunks=pipeline_chunks).to(self.device)
 
         # create tensors
         if D > 0:
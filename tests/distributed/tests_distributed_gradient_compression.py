@@ -0,0 +1,260 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import sys
+import os
+import unittest
+from parameterized import parameterized
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.distributed as dist
+
+from makani.utils import comm
+from makani.mpu.mappings import init_gradient_reduction_hooks
+from makani.mpu.gradient_compression import GradientCompressor, Fp8Compressor, get_gradient_compressor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+from ..testutils import compare_tensors
+
+
+class TestDistributedGradientCompression(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from mpi4py import MPI
+        cls.mpi_comm = MPI.COMM_WORLD.Dup()
+        cls.mpi_comm_rank = cls.mpi_comm.Get_rank()
+        cls.mpi_comm_size = cls.mpi_comm.Get_size()
+
+        if torch.cuda.is_available():
+            if cls.mpi_comm_rank == 0:
+                print("Running test on GPU")
+            local_rank = cls.mpi_comm_rank % torch.cuda.device_count()
+            cls.device = torch.device(f"cuda:{local_rank}")
+            torch.cuda.set_device(cls.device)
+            torch.cuda.manual_seed(333)
+        else:
+            if cls.mpi_comm_rank == 0:
+                print("Running test on CPU")
+            cls.device = torch.device("cpu")
+        torch.manual_seed(333)
+
+        return
+
+
+    def _init_comms(self):
+
+        # set up distributed
+        self.grid_size_h = int(os.getenv("GRID_H", 1))
+        self.grid_size_w = int(os.getenv("GRID_W", 1))
+        self.grid_size_e = int(os.getenv("GRID_E", 1))
+
+        # init groups
+        comm.init(
+            model_parallel_sizes=[self.grid_size_h, self.grid_size_w, 1, 1],
+            model_parallel_names=["h", "w", "fin", "fout"],
+            data_parallel_sizes=[self.grid_size_e, -1],
+            data_parallel_names=["ensemble", "batch"],
+        )
+        self.world_rank = comm.get_world_rank()
+        self.world_size = comm.get_world_size()
+
+        # store comm group parameters
+        self.data_group = comm.get_group("data")
+        self.data_rank = comm.get_rank("data")
+        self.data_size = comm.get_size("data")
+        self.model_size = comm.get_size("model")
+
+        if self.world_rank == 0:
+            print(f"Running distributed tests on grid H x W x E = {self.grid_size_h} x {self.grid_size_w} x {self.grid_size_e}")
+
+        return
+
+
+    def _destroy_comms(self):
+        comm.cleanup()
+        return
+
+
+    def _init_seed(self, seed):
+        torch.manual_seed(seed)
+        if torch.cuda.is_available():
+            torch.cuda.manual_seed(seed)
+        return
+
+
+    def _get_model(self):
+        # identical initialization on all ranks
+        self._init_seed(333)
+        model = nn.Sequential(nn.Linear(64, 128), nn.GELU(), nn.Linear(128, 32)).to(self.device)
+
+        return model
+
+
+    def _get_gradients(self, model, inp):
+        model.zero_grad(set_to_none=True)
+        loss = torch.sum(torch.square(model(inp)))
+        loss.backward()
+
+        return [param.grad.clone() for param in model.parameters()]
+
+
+    def _compare_gradients(self, msg, grads, grads_ref, tol, verbose=False):
+        # the quantization error is relative to the largest entry of the bucket, hence the flattened comparison
+        grad = torch.cat([g.reshape(-1) for g in grads])
+        grad_ref = torch.cat([g.reshape(-1) for g in grads_ref])
+        atol = tol * grad_ref.abs().max().item()
+
+        return compare_tensors(msg, grad, grad_ref, atol=atol, rtol=0.0, verbose=verbose)
+
+
+    @parameterized.expand(
+        [
+            ("none", 1e-6, 1e-5),
+            ("bf16", 1e-2, 0.0),
+            ("fp8", 1e-1, 0.0),
+        ],
+        skip_on_empty=True,
+    )
+    def test_distributed_compressed_reduction(self, gradient_compression, atol, rtol, verbose=False):
+        """
+        Tests the compressed reductions against a full precision all-reduce
+        """
+        self._init_comms()
+
+        # the error feedback is tested separately
+        parameters = {"error_feedback": False} if gradient_compression == "fp8" else {}
+        compressor = get_gradient_compressor(gradient_compression, process_group=self.data_group, **parameters)
+        if gradient_compression == "none":
+            self.assertTrue(compressor is None)
+            compressor = GradientCompressor(process_group=self.data_group)
+
+        # the size is chosen such that it is not divisible by the number of ranks
+        self._init_seed(333 + self.data_rank)
+        tensor = 2.0 * torch.rand(1031, dtype=torch.float32, device=self.device) - 1.0
+
+        tensor_ref = tensor.clone()
+        dist.all_reduce(tensor_ref, op=dist.ReduceOp.SUM, group=self.data_group)
+        tensor_ref = tensor_ref / float(self.data_size)
+
+        fut = compressor.reduce(tensor, key=0)
+        result = fut.wait()[0]
+
+        # the reduction is carried out in place
+        self.assertEqual(result.data_ptr(), tensor.data_ptr())
+        self.assertTrue(compare_tensors(f"{gradient_compression} reduction", result, tensor_ref, atol=atol, rtol=rtol, verbose=verbose))
+
+        self._destroy_comms()
+
+
+    def test_distributed_fp8_error_feedback(self, verbose=False):
+        """
+        Tests that the quantization error of a bucket is carried over to the next reduction of the same bucket only
+        """
+        self._init_comms()
+
+        compressor = Fp8Compressor(process_group=self.data_group, error_feedback=True)
+
+        self._init_seed(333 + self.data_rank)
+        numel = 1031
+        tensor1 = 2.0 * torch.rand(numel, dtype=torch.float32, device=self.device) - 1.0
+        tensor2 = 2.0 * torch.rand(numel, dtype=torch.float32, device=self.device) - 1.0
+
+        # pad and split the same way the compressor does
+        chunk_size = (numel + self.data_size - 1) // self.data_size
+        def pad(tensor):
+            return F.pad(tensor, (0, chunk_size * self.data_size - numel)).reshape(self.data_size, chunk_size)
+
+        def quantization_error(x):
+            xq, scale = Fp8Compressor._quantize(x)
+            return x - xq.to(torch.float32) * scale
+
+        # first reduction stores the residual
+        compressor.reduce(tensor1.clone(), key=0).wait()
+        residual1 = compressor.residuals[0].clone()
+        self.assertEqual(residual1.shape, (self.data_size, chunk_size))
+        self.assertTrue(compare_tensors("residual first call", residual1, quantization_error(pad(tensor1)), atol=0.0, rtol=0.0, verbose=verbose))
+
+        # the second reduction of the same bucket adds the residual of the first one
+        compressor.reduce(tensor2.clone(), key=0).wait()
+        residual2 = compressor.residuals[0]
+        self.assertTrue(compare_tensors("residual second call", residual2, quantization_error(pad(tensor2) + residual1), atol=0.0, rtol=0.0, verbose=verbose))
+
+        # other buckets do not see the residual
+        compressor.reduce(tensor2.clone(), key=1).wait()
+        self.assertTrue(compare_tensors("residual other bucket", compressor.residuals[1], quantization_error(pad(tensor2)), atol=0.0, rtol=0.0, verbose=verbose))
+
+        self._destroy_comms()
+
+
+    @parameterized.expand(
+        [
+            ("bf16", 1e-2),
+            ("fp8", 1e-1),
+        ],
+        skip_on_empty=True,
+    )
+    def test_distributed_compression_hooks(self, gradient_compression, tol, verbose=False):
+        """
+        Tests the gradients of a DDP model with compressed reductions against the uncompressed ones. The model is shared between
+        all model ranks, so that this also covers the multiplicity scaling
+        """
+        self._init_comms()
+
+        model_ref = init_gradient_reduction_hooks(self._get_model(), device=self.device, gradient_compression="none")
+        model = init_gradient_reduction_hooks(self._get_model(), device=self.device, gradient_compression=gradient_compression)
+
+        # the inputs only differ between data parallel ranks
+        self._init_seed(444 + self.data_rank)
+        inp = torch.randn(8, 64, dtype=torch.float32, device=self.device)
+
+        grads_ref = self._get_gradients(model_ref, inp)
+        grads = self._get_gradients(model, inp)
+
+        self.assertTrue(self._compare_gradients(f"{gradient_compression} gradients", grads, grads_ref, tol=tol, verbose=verbose))
+
+        self._destroy_comms()
+
+
+    def test_distributed_shared_parameter_multiplicity(self, verbose=False):
+        """
+        Tests that gradients of parameters which are shared between all model ranks are summed over the model ranks and averaged over the data ranks
+        """
+        self._init_comms()
+
+        model_local = self._get_model()
+        model = init_gradient_reduction_hooks(self._get_model(), device=self.device, gradient_compression="bf16")
+
+        self._init_seed(444 + self.data_rank)
+        inp = torch.randn(8, 64, dtype=torch.float32, device=self.device)
+
+        # full precision reference computed from the local gradients
+        grads_ref = self._get_gradients(model_local, inp)
+        for grad_ref in grads_ref:
+            dist.all_reduce(grad_ref, op=dist.ReduceOp.SUM, group=self.data_group)
+            grad_ref.mul_(float(self.model_size) / float(self.data_size))
+
+        grads = self._get_gradients(model, inp)
+
+        self.assertTrue(self._compare_gradients("shared gradients", grads, grads_ref, tol=1e-2, verbose=verbose))
+
+        self._destroy_comms()
+
+
+if __name__ == '__main__':
+    unittest.main()
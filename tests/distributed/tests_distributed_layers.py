@@ -109,10 +109,11 @@ class TestDistributedLayers(unittest.TestCase):
             [181, 360,  91, 180, 1, 10, 5e-5],
             [128, 256, 256, 512, 32,  8, 5e-5],
             [ 91, 180, 181, 360, 1, 10, 5e-5],
+            [128, 256, 256, 512, 32,  8, 5e-5, 4],
         ],
         skip_on_empty=True,
     )
-    def test_distributed_spectral_conv(self, nlat_in, nlon_in, nlat_out, nlon_out, batch_size, num_chan, tol, verbose=True):
+    def test_distributed_spectral_conv(self, nlat_in, nlon_in, nlat_out, nlon_out, batch_size, num_chan, tol, reduction_buffer_count=1, verbose=True):
         B, C, Hi, Wi, Ho, Wo = batch_size, num_chan, nlat_in, nlon_in, nlat_out, nlon_out
 
         from makani.models.common import SpectralConv
@@ -151,7 +152,7 @@ class TestDistributedLayers(unittest.TestCase):
         spect_conv_dist = init_gradient_reduction_hooks(
             spect_conv_dist,
             device=self.device,
-            reduction_buffer_count=1,
+            reduction_buffer_count=reduction_buffer_count,
             broadcast_buffers=False,
             find_unused_parameters=False,
             gradient_as_bucket_view=True,
@@ -15,13 +15,16 @@
 
 import sys
 import os
+import tempfile
 import unittest
 from parameterized import parameterized
 
 import torch
 
-from makani.models.networks.pangu import EarthAttention3D
+from makani.models.networks.pangu import EarthAttention3D, Transformer3DBlock
 from makani.models.common.layers import SeededDropout2d
+from makani.models.common.factorizations import QuantizedWeight
+from makani.utils.basis_cache import enable_basis_cache, disable_basis_cache
 
 from makani.utils import functions as fn
 
@@ -141,6 +144,175 @@ class TestLayers(unittest.TestCase):
                     self.assertTrue(compare_tensors(f"weight gradient {skey}", sgrad, ngrad, atol=atol, rtol=rtol, verbose=verbose))
 
 
+    @parameterized.expand(
+        [
+            ((2, 6, 12), (0, 0, 0), 1e-6, 1e-5),
+            ((3, 8, 20), (0, 0, 0), 1e-6, 1e-5),
+            ((3, 8, 20), (1, 3, 6), 1e-6, 1e-5),
+        ], skip_on_empty=True
+    )
+    def test_transformer_3d_block_fused(self, input_resolution, shift_size, atol, rtol, verbose=True):
+        """
+        Tests that the fused window partition in the Pangu transformer block matches the unfused implementation
+        """
+        num_channels = 16
+        window_size = (2, 6, 12)
+
+        blk_ref = Transformer3DBlock(dim=num_channels, input_resolution=input_resolution, num_heads=2, window_size=window_size, shift_size=shift_size).to(self.device)
+        blk_fused = Transformer3DBlock(dim=num_channels, input_resolution=input_resolution, num_heads=2, window_size=window_size, shift_size=shift_size, fused_window_partition=True).to(self.device)
+        blk_fused.load_state_dict(blk_ref.state_dict())
+
+        inp_shape = (self.params.batch_size, input_resolution[0] * input_resolution[1] * input_resolution[2], num_channels)
+        inp = torch.randn(*inp_shape, dtype=torch.float32, device=self.device)
+
+        outputs = []
+        igrads = []
+        for blk in [blk_ref, blk_fused]:
+            inp_tmp = inp.detach().clone()
+            inp_tmp.requires_grad = True
+            out = blk(inp_tmp)
+            torch.sum(out).backward()
+            outputs.append(out.detach())
+            igrads.append(inp_tmp.grad.clone())
+
+        with self.subTest(desc="output"):
+            self.assertTrue(compare_tensors("output", outputs[1], outputs[0], atol=atol, rtol=rtol, verbose=verbose))
+
+        with self.subTest(desc="input gradient"):
+            self.assertTrue(compare_tensors("input gradient", igrads[1], igrads[0], atol=atol, rtol=rtol, verbose=verbose))
+
+        for (name, p_ref), p_fused in zip(blk_ref.named_parameters(), blk_fused.parameters()):
+            with self.subTest(desc=f"weight gradient {name}"):
+                self.assertTrue(compare_tensors(f"weight gradient {name}", p_fused.grad, p_ref.grad, atol=atol, rtol=rtol, verbose=verbose))
+
+    def test_earth_attention_bias_cache(self):
+        """
+        Tests that the materialized attention bias is cached in inference and invalidated when the weights change
+        """
+        blk = Transformer3DBlock(dim=16, input_resolution=(2, 6, 24), num_heads=2, window_size=(2, 6, 12), shift_size=(1, 3, 6)).to(self.device)
+        blk.eval()
+
+        with torch.no_grad():
+            bias1 = blk.attn.get_attention_bias(blk.attn_mask)
+            bias2 = blk.attn.get_attention_bias(blk.attn_mask)
+            self.assertTrue(bias1 is bias2)
+
+            blk.attn.earth_position_bias_table.add_(1.0)
+            bias3 = blk.attn.get_attention_bias(blk.attn_mask)
+            self.assertFalse(bias3 is bias1)
+            self.assertTrue(compare_tensors("bias", bias3, bias1 + 1.0, atol=1e-6, rtol=1e-6))
+
+        # no caching in training
+        blk.train()
+        self.assertFalse(blk.attn.get_attention_bias(blk.attn_mask) is blk.attn.get_attention_bias(blk.attn_mask))
+
+    def test_philox_noise(self):
+        """
+        Tests that the counter-based noise is reproducible from the seed and step counter and independent across streams
+        """
+        from makani.models.noise import philox_normal, DiffusionNoiseS2
+
+        # batched generation matches the generation of the individual streams
+        z = philox_normal((4, 3, 5), seed=333, step=7, device=self.device)
+        z1 = philox_normal((1, 3, 5), seed=333, step=7, stream_offset=1, device=self.device)
+        self.assertTrue(compare_tensors("stream", z1[0], z[1], atol=0.0, rtol=0.0))
+        self.assertFalse(torch.allclose(z[0], z[1]))
+
+        # moments
+        z = philox_normal((2, 100000), seed=333, step=0, device=self.device)
+        self.assertTrue(abs(z.mean().item()) < 1e-2)
+        self.assertTrue(abs(z.std().item() - 1.0) < 1e-2)
+
+        # the noise can be replayed from the rng state
+        noise = DiffusionNoiseS2(img_shape=(16, 32), batch_size=2, num_channels=2, num_time_steps=1, rng_type="philox").to(self.device)
+        noise.update(replace_state=True)
+        rng_state = noise.get_rng_state()
+        tensor_state = noise.get_tensor_state()
+        noise.update()
+        ref = noise()
+
+        noise.reset()
+        noise.set_tensor_state(tensor_state)
+        noise.set_rng_state(*rng_state)
+        noise.update()
+        self.assertTrue(compare_tensors("noise", noise(), ref, atol=0.0, rtol=0.0))
+
+    @parameterized.expand(
+        [
+            (torch.float32, (16, 8, 1, 1)),
+            (torch.complex64, (1, 8, 16, 12, 7)),
+        ],
+        skip_on_empty=True,
+    )
+    def test_quantized_weight(self, dtype, shape):
+        """
+        Tests that the per-channel int8 quantization error is bounded by half the quantization step
+        """
+        weight = torch.randn(shape, dtype=dtype, device=self.device)
+        qweight = QuantizedWeight(weight, reduce_dims=(1,), dtype="int8")
+
+        self.assertEqual(qweight.qweight.dtype, torch.int8)
+        self.assertEqual(tuple(qweight.shape), shape)
+
+        dequant = qweight.to_tensor()
+        self.assertEqual(dequant.dtype, dtype)
+
+        err = torch.view_as_real(dequant - weight) if weight.is_complex() else (dequant - weight)
+        self.assertTrue(torch.all(err.abs() <= 0.5 * qweight.scale + 1e-6))
+
+    def test_diffusion_noise_update(self):
+        """
+        Tests the closed form discount matrix and the fused in-place update of the diffusion noise against reference implementations
+        """
+        import numpy as np
+        from makani.models.noise import philox_normal, toep, DiffusionNoiseS2
+
+        num_time_steps = 3
+        noise = DiffusionNoiseS2(img_shape=(16, 32), batch_size=2, num_channels=2, num_time_steps=num_time_steps, lambd=[0.5, 2.0], rng_type="philox").to(self.device)
+
+        # discount matrix
+        discount_ref = []
+        for phi_tmp in noise.phi.reshape(-1).tolist():
+            phivec = np.power(phi_tmp, np.arange(0, num_time_steps))
+            discount_ref.append(torch.as_tensor(toep(phivec, np.zeros(num_time_steps))).to(dtype=torch.float32))
+        discount_ref = torch.stack(discount_ref, dim=0).to(self.device)
+        self.assertTrue(compare_tensors("discount", noise.discount, discount_ref, atol=0.0, rtol=0.0))
+
+        # AR(1) update
+        noise.update(replace_state=True)
+        state = noise.get_tensor_state()
+        seed, step = noise.get_rng_state()[0].tolist()
+        noise.update()
+
+        eta = philox_normal(state[:, :1].shape, seed=seed, step=step, device=self.device)
+        state_ref = torch.cat([state[:, 1:], noise.phi * state[:, -1:] + noise.sigma_l * eta], dim=1)
+        self.assertTrue(compare_tensors("state", noise.get_tensor_state(), state_ref, atol=1e-6, rtol=1e-5))
+
+    def test_learnable_noise_backward(self):
+        """
+        Tests the backward pass of the white noise with learnable sigma_l when the internal state is updated in place during the forward pass
+        """
+        from makani.models.noise import IsotropicGaussianRandomFieldS2
+
+        noise = IsotropicGaussianRandomFieldS2(img_shape=(16, 32), batch_size=2, num_channels=2, num_time_steps=1, alpha=2.0, learnable=True).to(self.device)
+        noise.update()
+        state = noise.get_tensor_state()
+
+        # the state is updated after the forward pass, which must not affect the gradient
+        out = noise(update_internal_state=True)
+        torch.sum(torch.square(out)).backward()
+        grad = noise.sigma_l.grad.clone()
+        self.assertFalse(torch.equal(noise.get_tensor_state(), state))
+
+        # reference without update
+        noise.sigma_l.grad = None
+        noise.set_tensor_state(state)
+        out_ref = noise()
+        torch.sum(torch.square(out_ref)).backward()
+
+        self.assertTrue(compare_tensors("output", out, out_ref, atol=0.0, rtol=0.0))
+        self.assertTrue(compare_tensors("sigma_l gradient", grad, noise.sigma_l.grad, atol=0.0, rtol=0.0))
+
     def test_seeded_dropout2d_deterministic_mask(self, atol=1e-8, rtol=1e-8, verbose=True):
         """Two dropout layers with the same seed should produce identical masks."""
         torch.manual_seed(123)
@@ -154,6 +326,37 @@ class TestLayers(unittest.TestCase):
 
         self.assertTrue(compare_tensors("output", out1, out2, atol=atol, rtol=rtol, verbose=verbose))
 
+    def test_basis_cache(self, verbose=True):
+        """
+        Tests that DISCO and SHT modules constructed from the on-disk basis cache match freshly computed ones
+        """
+        import torch_harmonics as th
+
+        def make_modules():
+            conv = th.DiscreteContinuousConvS2(4, 4, in_shape=(18, 36), out_shape=(9, 18), kernel_shape=(3, 3), basis_type="morlet", grid_in="equiangular", grid_out="equiangular", bias=False)
+            sht = th.RealSHT(18, 36, grid="equiangular")
+            isht = th.InverseRealSHT(18, 36, grid="equiangular")
+            return conv, sht, isht
+
+        # reference without cache
+        ref_modules = make_modules()
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            try:
+                enable_basis_cache(cache_dir)
+
+                # first construction populates the cache, the second one loads from it
+                make_modules()
+                self.assertTrue(len(os.listdir(cache_dir)) > 0)
+                modules = make_modules()
+            finally:
+                disable_basis_cache()
+
+        for ref_module, module in zip(ref_modules, modules):
+            for (name, ref_buffer), (_, buffer) in zip(ref_module.named_buffers(), module.named_buffers()):
+                with self.subTest(desc=f"{type(module).__name__} {name}"):
+                    self.assertTrue(compare_tensors(name, buffer, ref_buffer, atol=0.0, rtol=0.0, verbose=verbose))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -24,7 +24,8 @@ import numpy as np
 import torch
 
 from makani.utils import LossHandler
-from makani.utils.losses import EnsembleCRPSLoss
+from makani.utils.losses import EnsembleCRPSLoss, EnsembleMMDLoss, EnsembleNLLLoss
+from makani.utils.losses.crps_loss import _crps_ensemble_kernel, _crps_sorted_kernel, _crps_skillspread_kernel
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from .testutils import get_default_parameters, compare_tensors, compare_arrays
@@ -296,6 +297,81 @@ class TestLosses(unittest.TestCase):
     
                 self.assertTrue(compare_arrays("output", result, result_proper))
 
+    def test_crps_kernels(self):
+        ensemble_size = 16
+        num_points = 1000
+
+        # generate forecasts with a few invalid members and an observation
+        forecasts = torch.randn((ensemble_size, self.params.batch_size, self.params.N_in_channels, num_points), dtype=torch.float64)
+        forecasts[3, 0, 0, :100] = torch.nan
+        forecasts[:, 0, 0, 100:110] = torch.nan
+        observation = torch.randn((self.params.batch_size, self.params.N_in_channels, num_points), dtype=torch.float64)
+        weights = torch.rand((ensemble_size, 1, 1, 1), dtype=torch.float64) + 0.5
+
+        # reference: sorted piecewise integration of the CDF
+        sorted_forecasts, idx = torch.sort(forecasts, dim=0)
+        sorted_weights = torch.take_along_dim(weights, idx, dim=0)
+        result_ref = _crps_ensemble_kernel(observation, sorted_forecasts, sorted_weights)
+
+        with self.subTest(desc="sorted kernel"):
+            result = _crps_sorted_kernel(observation, forecasts, weights)
+            # points where all members are invalid have to be NaN
+            self.assertTrue(torch.equal(torch.isnan(result), torch.isnan(result_ref)))
+            self.assertTrue(compare_tensors("output", torch.nan_to_num(result), torch.nan_to_num(result_ref)))
+
+        # skillspread kernel without nans against the rank based formula
+        forecasts = torch.nan_to_num(forecasts)
+        weights = torch.ones_like(weights)
+        with self.subTest(desc="skillspread kernel"):
+            result = _crps_skillspread_kernel(observation, forecasts, weights, 1.0)
+            rank = torch.argsort(torch.argsort(forecasts, dim=0), dim=0) + 1
+            espread = torch.mean((2 * rank - ensemble_size - 1) * forecasts, dim=0) / float(ensemble_size - 1)
+            result_ref = torch.mean(torch.abs(forecasts - observation), dim=0) - espread
+            self.assertTrue(compare_tensors("output", result, result_ref))
+
+    @parameterized.expand(
+        [
+            (EnsembleCRPSLoss, {"crps_type": "cdf"}),
+            (EnsembleCRPSLoss, {"crps_type": "skillspread"}),
+            (EnsembleMMDLoss, {"squared": True}),
+            (EnsembleNLLLoss, {}),
+        ],
+        skip_on_empty=True,
+    )
+    def test_chunked_ensemble_losses(self, loss_handle, loss_params):
+        ensemble_size = 8
+        chunk_size = 100
+
+        loss_kwargs = dict(
+            img_shape=(self.params.img_shape_x, self.params.img_shape_y),
+            crop_shape=(self.params.img_shape_x, self.params.img_shape_y),
+            crop_offset=(0, 0),
+            channel_names=self.params.channel_names,
+            grid_type=self.params.model_grid_type,
+            pole_mask=0,
+            spatial_distributed=False,
+            ensemble_distributed=False,
+            **loss_params,
+        )
+        loss_func = loss_handle(**loss_kwargs)
+        loss_func_chunked = loss_handle(**loss_kwargs, chunk_size=chunk_size)
+
+        inp = torch.randn((self.params.batch_size, ensemble_size, self.params.N_in_channels, self.params.img_shape_x, self.params.img_shape_y), dtype=torch.float32)
+        tar = torch.randn((self.params.batch_size, self.params.N_in_channels, self.params.img_shape_x, self.params.img_shape_y), dtype=torch.float32)
+        spatial_weights = torch.rand_like(tar)
+
+        results = []
+        for lfunc in [loss_func, loss_func_chunked]:
+            inp_clone = inp.clone().requires_grad_(True)
+            tar_clone = tar.clone().requires_grad_(True)
+            loss = lfunc(inp_clone, tar_clone, spatial_weights)
+            loss.sum().backward()
+            results.append((loss.detach(), inp_clone.grad, tar_clone.grad))
+
+        for desc, ref, res in zip(["output", "forecast gradient", "observation gradient"], results[0], results[1]):
+            with self.subTest(desc=desc):
+                self.assertTrue(compare_tensors(desc, res, ref, atol=1e-6, rtol=1e-5))
+
     def test_gauss_crps(self):
     
         # protext against sigma=0
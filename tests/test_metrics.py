@@ -628,6 +628,55 @@ class TestMetricsHandler(unittest.TestCase):
         with self.subTest(desc="rollouts"):
             self.assertTrue(compare_arrays("rollouts", data_full, data_split, rtol=1e-6, atol=1e-6, verbose=verbose))
 
+    @parameterized.expand(_metric_handler_params[:1], skip_on_empty=True)
+    def test_deferred_reduction(self, grid_type, batch_size, ensemble_size, num_rollout_steps, bred, verbose=False):
+
+        # create dummy climatology
+        num_steps = 2
+        num_channels = len(self.params.channel_names)
+        clim = torch.zeros(1, num_channels, self.params.img_local_shape_x, self.params.img_local_shape_y)
+
+        # update parameters
+        self.params.batch_size = batch_size
+        self.params.ensemble_size = ensemble_size
+
+        handlers = []
+        for deferred_reduction in [False, True]:
+            metric_handler = MetricsHandler(self.params,
+                                            clim,
+                                            num_rollout_steps,
+                                            self.device,
+                                            l1_var_names=self.params.channel_names,
+                                            rmse_var_names=self.params.channel_names,
+                                            acc_var_names=self.params.channel_names,
+                                            crps_var_names=self.params.channel_names,
+                                            spread_var_names=[],
+                                            ssr_var_names=[],
+                                            rh_var_names=[],
+                                            wb2_compatible=False,
+                                            deferred_reduction=deferred_reduction)
+            metric_handler.initialize_buffers()
+            metric_handler.zero_buffers()
+            handlers.append(metric_handler)
+
+        for _ in range(num_steps):
+            inp = torch.randn((num_rollout_steps, batch_size, ensemble_size, num_channels, self.params.img_local_shape_x, self.params.img_local_shape_y),
+                              dtype=torch.float32, device=self.device)
+            tar = torch.randn((num_rollout_steps, batch_size, num_channels, self.params.img_local_shape_x, self.params.img_local_shape_y),
+                              dtype=torch.float32, device=self.device)
+            for idt in range(num_rollout_steps):
+                loss = torch.mean(torch.abs(torch.mean(inp[idt], dim=1)-tar[idt]))
+                for metric_handler in handlers:
+                    metric_handler.update(inp[idt], tar[idt], loss, idt)
+
+        logs_ref, logs_deferred = [metric_handler.finalize() for metric_handler in handlers]
+
+        for key in logs_ref["metrics"].keys():
+            if key == "rollouts":
+                continue
+            with self.subTest(desc=key):
+                self.assertTrue(compare_arrays(key, np.asarray(logs_deferred["metrics"][key]), np.asarray(logs_ref["metrics"][key]), rtol=1e-6, atol=1e-6, verbose=verbose))
+
 
 # TODO: ssr test comparing to xskillcore
     
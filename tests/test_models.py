@@ -19,6 +19,7 @@ import unittest
 from parameterized import parameterized
 
 import torch
+import torch.nn as nn
 
 from makani.models import model_registry
 from makani.utils import checkpoint_helpers
@@ -187,6 +188,471 @@ class TestModels(unittest.TestCase):
                     with self.subTest(desc=f"weight gradient {key}"):
                         self.assertTrue(compare_tensors(f"weight gradient {key}", wgrad_double, wgrad_single, atol, rtol, verbose))
 
+    @parameterized.expand(
+        [
+            ({}, {"multistep_checkpointing": True}, 1e-6, 1e-6),
+            ({}, {"multistep_activation_offload": True, "multistep_offload_keep_steps": 1}, 1e-6, 1e-6),
+            ({}, {"multistep_checkpointing": True, "multistep_activation_offload": True, "multistep_offload_keep_steps": 0}, 1e-6, 1e-6),
+            ({"multistep_truncation_steps": 2}, {"multistep_truncation_steps": 2, "multistep_checkpointing": True}, 1e-6, 1e-6),
+        ],
+        skip_on_empty=True,
+    )
+    def test_multistep_memory_options(self, ref_options, options, atol, rtol, verbose=True):
+        """
+        Tests that the memory saving options of the multistep wrapper produce the same outputs and gradients as the reference
+        """
+        self.params.nettype = "SFNO"
+        self.params.n_future = 2
+
+        # reference model
+        for key, value in ref_options.items():
+            self.params[key] = value
+        model_ref = model_registry.get_model(self.params, multistep=True).to(self.device)
+
+        # model with the memory saving options enabled
+        for key, value in options.items():
+            self.params[key] = value
+        model = model_registry.get_model(self.params, multistep=True).to(self.device)
+        model.load_state_dict(model_ref.state_dict())
+
+        inp_shape = (self.params.batch_size, self.params.N_in_channels, self.params.img_shape_x, self.params.img_shape_y)
+        inp = torch.randn(*inp_shape, dtype=torch.float32, device=self.device)
+
+        outputs = []
+        igrads = []
+        for mod in [model_ref, model]:
+            inp_tmp = inp.detach().clone()
+            inp_tmp.requires_grad = True
+            out = mod(inp_tmp)
+            torch.sum(out).backward()
+            outputs.append(out.detach())
+            igrads.append(inp_tmp.grad.clone())
+
+        with self.subTest(desc="output"):
+            self.assertTrue(compare_tensors("output", outputs[1], outputs[0], atol, rtol, verbose))
+
+        with self.subTest(desc="input gradient"):
+            self.assertTrue(compare_tensors("input gradient", igrads[1], igrads[0], atol, rtol, verbose))
+
+        for (name, p_ref), p in zip(model_ref.named_parameters(), model.parameters()):
+            with self.subTest(desc=f"weight gradient {name}"):
+                self.assertTrue(compare_tensors(f"weight gradient {name}", p.grad, p_ref.grad, atol, rtol, verbose))
+
+    def test_spectral_transform_sharing(self):
+        """
+        Tests that models with identical spectral transforms share the same instance and hence the precomputed weights
+        """
+        self.params.nettype = "SFNO"
+
+        model1 = model_registry.get_model(self.params, multistep=False).to(self.device)
+        model2 = model_registry.get_model(self.params, multistep=False).to(self.device)
+
+        self.assertTrue(model1.model.trans is model2.model.trans)
+        self.assertTrue(model1.model.itrans is model2.model.itrans)
+        self.assertTrue(model1.model.trans.weights.data_ptr() == model2.model.trans.weights.data_ptr())
+
+        # transforms requested without dtype, e.g. by losses and spectrum buffers, share the instance of the networks
+        from makani.models.common import get_spectral_transform
+
+        trans = model1.model.trans
+        self.assertTrue(get_spectral_transform(type(trans), trans.nlat, trans.nlon, lmax=trans.lmax, mmax=trans.mmax, grid=trans.grid) is trans)
+
+        # losses request the transform without modes, which resolves to the same instance as an explicit request with the default modes
+        import torch_harmonics as th
+
+        loss_trans = get_spectral_transform(th.RealSHT, self.params.img_shape_x, self.params.img_shape_y, grid="equiangular", dtype=torch.float32)
+        self.assertTrue(get_spectral_transform(th.RealSHT, self.params.img_shape_x, self.params.img_shape_y, lmax=loss_trans.lmax, mmax=loss_trans.mmax, grid="equiangular", dtype=torch.float32) is loss_trans)
+
+        # the resolved modes agree with the defaults of torch-harmonics
+        ref_trans = th.RealSHT(self.params.img_shape_x, self.params.img_shape_y, grid="equiangular")
+        self.assertEqual((loss_trans.lmax, loss_trans.mmax), (ref_trans.lmax, ref_trans.mmax))
+
+        # the forward pass should be unaffected by the sharing
+        inp = torch.randn(self.params.batch_size, self.params.N_in_channels, self.params.img_shape_x, self.params.img_shape_y, dtype=torch.float32, device=self.device)
+        model2.load_state_dict(model1.state_dict())
+        with torch.no_grad():
+            self.assertTrue(compare_tensors("output", model2(inp), model1(inp), atol=0.0, rtol=0.0))
+
+    @parameterized.expand(
+        [
+            ("euler",),
+            ("heun",),
+            ("srk",),
+            ("adaptive",),
+        ],
+        skip_on_empty=True,
+    )
+    def test_stochastic_interpolant_sampler(self, sampler, atol=1e-5, rtol=1e-5, verbose=True):
+        """
+        Tests that the batched multi-sample mode of the stochastic interpolant samplers matches the evaluation of the individual samples
+        """
+        self.params.nettype = "SFNO"
+        self.params.N_in_predicted_channels = self.params.N_in_channels
+        self.params.N_static_channels = 0
+        self.params.N_dynamic_channels = 0
+
+        # without noise, the trajectories are deterministic
+        self.params.noise_epsilon = 0.0
+        self.params.stochastic_interpolation_sampler = sampler
+
+        model = model_registry.get_model(self.params, use_stochastic_interpolation=True).to(self.device)
+        model.eval()
+
+        n_samples = 2
+        inp = torch.randn(self.params.batch_size, n_samples, self.params.N_in_channels, self.params.img_shape_x, self.params.img_shape_y, dtype=torch.float32, device=self.device)
+
+        with torch.no_grad():
+            out = model(inp, n_steps=2)
+            self.assertEqual(out.shape, inp.shape)
+
+            # the adaptive sampler controls the step size of the whole batch, so that only fixed step samplers are expected to match
+            for i in range(n_samples if sampler != "adaptive" else 0):
+                out_ref = model(inp[:, i], n_steps=2)
+                with self.subTest(desc=f"sample {i}"):
+                    self.assertTrue(compare_tensors(f"sample {i}", out[:, i], out_ref, atol, rtol, verbose))
+
+            # expanding a single input should produce identical samples
+            out = model(inp[:, 0], n_samples=n_samples, n_steps=2)
+            self.assertTrue(compare_tensors("expanded samples", out[:, 1], out[:, 0], atol, rtol, verbose))
+
+    def test_forecast_server(self):
+        """
+        Tests that the batched rollouts of the forecast server match sequential rollouts of the model wrapper, both through the python and the HTTP interface
+        """
+        import json
+        import base64
+        import datetime
+        import tempfile
+        import threading
+        import http.client
+        import numpy as np
+        from makani.models.model_package import ModelWrapper
+        from makani.models.model_serving import ForecastServer, make_http_server
+
+        self.params.nettype = "DebugNet"
+        self.params.normalization = "zscore"
+        self.params.dhours = 6
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.params.global_means_path = os.path.join(tmpdir, "global_means.npy")
+            self.params.global_stds_path = os.path.join(tmpdir, "global_stds.npy")
+            np.save(self.params.global_means_path, np.random.randn(1, self.params.N_in_channels, 1, 1).astype(np.float32))
+            np.save(self.params.global_stds_path, np.random.rand(1, self.params.N_in_channels, 1, 1).astype(np.float32) + 0.5)
+
+            model = ModelWrapper(model_registry.get_model(self.params, multistep=False), params=self.params)
+
+        # make the model non-trivial
+        with torch.no_grad():
+            model.model.model.factor.fill_(0.5)
+
+        time = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        inps = [torch.randn(self.params.N_in_channels, self.params.img_shape_x, self.params.img_shape_y, dtype=torch.float32) for _ in range(3)]
+        steps = [1, 3, 2]
+
+        # reference: sequential rollouts
+        refs = []
+        with torch.no_grad():
+            for inp, n_steps in zip(inps, steps):
+                x = inp.unsqueeze(0)
+                ref = []
+                for step in range(n_steps):
+                    x = model(x, time, normalized_data=False)
+                    ref.append(x[0].clone())
+                refs.append(ref)
+
+        with ForecastServer(model, device="cpu", max_batch_size=4, batch_timeout=0.5) as server:
+            streams = [server.submit(inp, time, n_steps=n_steps, normalized_data=False) for inp, n_steps in zip(inps, steps)]
+
+            for i, (stream, ref) in enumerate(zip(streams, refs)):
+                result = stream.result()
+                self.assertEqual(len(result), len(ref))
+                for step, valid_time, pred in result:
+                    self.assertEqual(valid_time, time + step * datetime.timedelta(hours=model.timestep))
+                    self.assertTrue(compare_tensors(f"request {i} step {step}", pred, ref[step - 1], atol=1e-6, rtol=1e-6))
+
+            # HTTP interface
+            http_server = make_http_server(server, host="127.0.0.1", port=0)
+            thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", http_server.server_address[1])
+                arr = inps[1].numpy()
+                body = {"time": time.isoformat(), "steps": steps[1], "normalized": False, "shape": list(arr.shape), "dtype": str(arr.dtype), "data": base64.b64encode(arr.tobytes()).decode("ascii")}
+                conn.request("POST", "/forecast", body=json.dumps(body), headers={"Content-Type": "application/json"})
+                response = conn.getresponse()
+                self.assertEqual(response.status, 200)
+                lines = [json.loads(line) for line in response.read().decode("utf-8").splitlines()]
+                self.assertEqual(len(lines), steps[1])
+                for line in lines:
+                    pred = torch.from_numpy(np.frombuffer(base64.b64decode(line["data"]), dtype=line["dtype"]).reshape(line["shape"]).copy())
+                    self.assertTrue(compare_tensors(f"http step {line['step']}", pred, refs[1][line["step"] - 1], atol=1e-6, rtol=1e-6))
+                conn.close()
+            finally:
+                http_server.shutdown()
+                http_server.server_close()
+
+    @parameterized.expand(
+        [
+            ("SFNO", False),
+            ("DebugNet", True),
+        ],
+        skip_on_empty=True,
+    )
+    def test_model_package_fast_start(self, nettype, export, atol=1e-6, rtol=1e-6, verbose=True):
+        """
+        Tests that the fast start path of load_model_package produces the same model as the regular path
+        """
+        import tempfile
+        import numpy as np
+        from makani.models.model_package import LocalPackage, save_model_package, load_model_package, export_model_package
+
+        self.params.nettype = nettype
+        self.params.normalization = "zscore"
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            data_dir = os.path.join(tmpdir, "data")
+            package_dir = os.path.join(tmpdir, "package")
+            os.makedirs(data_dir)
+            os.makedirs(os.path.join(package_dir, os.path.dirname(LocalPackage.MODEL_PACKAGE_CHECKPOINT_PATH)))
+
+            self.params.global_means_path = os.path.join(data_dir, LocalPackage.MEANS_FILE)
+            self.params.global_stds_path = os.path.join(data_dir, LocalPackage.STDS_FILE)
+            np.save(self.params.global_means_path, np.random.randn(1, self.params.N_in_channels, 1, 1).astype(np.float32))
+            np.save(self.params.global_stds_path, np.random.rand(1, self.params.N_in_channels, 1, 1).astype(np.float32) + 0.5)
+
+            # create the package
+            self.params.experiment_dir = package_dir
+            save_model_package(self.params)
+            model = model_registry.get_model(self.params, multistep=False)
+            torch.save({"model_state": model.state_dict()}, os.path.join(package_dir, LocalPackage.MODEL_PACKAGE_CHECKPOINT_PATH))
+
+            package = LocalPackage(package_dir)
+            model_ref = load_model_package(package, device=self.device)
+
+            if export:
+                export_model_package(model_ref, package_dir)
+                self.assertTrue(os.path.isfile(package.get(LocalPackage.EXPORTED_MODEL_FILE)))
+
+            model_fast = load_model_package(package, device=self.device, fast_start=True)
+
+            if not export:
+                for (name, p_ref), p in zip(model_ref.named_parameters(), model_fast.named_parameters()):
+                    self.assertFalse(p[1].is_meta)
+                    self.assertTrue(compare_tensors(f"parameter {name}", p[1], p_ref, atol=0.0, rtol=0.0))
+
+            inp = torch.randn(self.params.batch_size, self.params.N_in_channels, self.params.img_shape_x, self.params.img_shape_y, dtype=torch.float32, device=self.device)
+            with torch.no_grad():
+                out_ref = model_ref(inp, None, normalized_data=False)
+                out_fast = model_fast(inp, None, normalized_data=False)
+
+            self.assertTrue(compare_tensors("output", out_fast, out_ref, atol, rtol, verbose))
+
+    @parameterized.expand(
+        [
+            ("SFNO", {"path_drop_rate": 0.1, "mlp_drop_rate": 0.1, "pos_drop_rate": 0.1}, False, False),
+            ("SFNO", {"path_drop_rate": 0.1}, True, True),
+            ("FCN3", {"use_mlp": True, "mlp_drop_rate": 0.1}, False, False),
+            ("SNO", {"use_mlp": True}, False, True),
+        ],
+        skip_on_empty=True,
+    )
+    def test_optimize_for_inference(self, nettype, options, bias_correction, channels_last, atol=1e-5, rtol=1e-5, verbose=True):
+        """
+        Tests that the inference transformations preserve the output of the model in evaluation mode
+        """
+        import tempfile
+        import h5py
+        from makani.models.common.layers import DropPath, LayerScale
+
+        self.params.nettype = nettype
+        for key, value in options.items():
+            self.params[key] = value
+        self.params.inference_channels_last = channels_last
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            if bias_correction:
+                self.params.bias_correction = os.path.join(tmpdir, "bias_correction.h5")
+                with h5py.File(self.params.bias_correction, "w") as f:
+                    f["mean"] = torch.randn(1, 1, self.params.N_out_channels, 1, 1).numpy()
+
+            model = model_registry.get_model(self.params, multistep=False).to(self.device)
+            model.eval()
+
+        inp = torch.randn(self.params.batch_size, self.params.N_in_channels, self.params.img_shape_x, self.params.img_shape_y, dtype=torch.float32, device=self.device)
+        with torch.no_grad():
+            out_ref = model(inp)
+
+        model = model_registry.optimize_model_for_inference(model, self.params)
+
+        for name, module in model.named_modules():
+            self.assertFalse(isinstance(module, (torch.nn.Dropout, DropPath, LayerScale)), msg=f"module {name} was not removed")
+        if bias_correction:
+            self.assertFalse(hasattr(model.preprocessor, "bias_correction"))
+
+        with torch.no_grad():
+            out = model(inp)
+
+        self.assertTrue(compare_tensors("output", out, out_ref, atol, rtol, verbose))
+
+    def test_fold_layer_scale(self):
+        """
+        Tests that layer scales are only folded in blocks which apply them, i.e. blocks with a skip connection
+        """
+        from makani.models.common import MLP, LayerScale
+        from makani.models.inference_optimization import fold_layer_scale
+
+        class Block(nn.Module):
+            def __init__(self, skip):
+                super().__init__()
+                self.mlp = MLP(in_features=4, hidden_features=8, out_features=4)
+                self.drop_path = nn.Identity()
+                self.layer_scale = LayerScale(4)
+                if skip:
+                    self.skip = nn.Identity()
+
+            def forward(self, x):
+                dx = self.mlp(x)
+                if hasattr(self, "skip"):
+                    return self.skip(x) + self.layer_scale(dx)
+                return dx
+
+        inp = torch.randn(2, 4, 8, 16, dtype=torch.float32, device=self.device)
+        for skip in [True, False]:
+            block = Block(skip).to(self.device).eval()
+            with torch.no_grad():
+                out_ref = block(inp)
+                num_folded = fold_layer_scale(block)
+                out = block(inp)
+
+            self.assertEqual(num_folded, 1 if skip else 0)
+            self.assertTrue(compare_tensors(f"output skip={skip}", out, out_ref, atol=1e-6, rtol=1e-5))
+
+    @parameterized.expand(
+        [
+            ("SFNO", {}, "int8", 2e-2),
+            ("SFNO", {}, "fp8", 1e-1),
+            ("FCN3", {"use_mlp": True}, "int8", 2e-2),
+        ],
+        skip_on_empty=True,
+    )
+    def test_weight_quantization(self, nettype, options, weight_quantization, tol, verbose=True):
+        """
+        Tests that weight-only quantization reduces the size of the model while keeping the output close to the full precision model
+        """
+        self.params.nettype = nettype
+        for key, value in options.items():
+            self.params[key] = value
+        self.params.inference_weight_quantization = weight_quantization
+
+        model = model_registry.get_model(self.params, multistep=False).to(self.device)
+        model.eval()
+
+        def model_memory():
+            return sum(t.numel() * t.element_size() for t in model.state_dict().values())
+
+        inp = torch.randn(self.params.batch_size, self.params.N_in_channels, self.params.img_shape_x, self.params.img_shape_y, dtype=torch.float32, device=self.device)
+        with torch.no_grad():
+            out_ref = model(inp)
+        memory_ref = model_memory()
+
+        model = model_registry.optimize_model_for_inference(model, self.params)
+        with torch.no_grad():
+            out = model(inp)
+        memory_quant = model_memory()
+
+        err = (torch.linalg.norm(out - out_ref) / torch.linalg.norm(out_ref)).item()
+        if verbose:
+            print(f"relative error: {err}, memory: {memory_ref} -> {memory_quant} bytes")
+
+        self.assertLess(err, tol)
+        self.assertLess(memory_quant, 0.5 * memory_ref)
+
+    @parameterized.expand(
+        [
+            ("SFNO",),
+            ("FCN3",),
+        ],
+        skip_on_empty=True,
+    )
+    def test_regional_compilation(self, nettype, atol=1e-5, rtol=1e-5, verbose=True):
+        """
+        Tests that compiling the model blocks individually preserves the output for varying batch sizes
+        """
+        from makani.utils.compilation import compile_regions
+
+        self.params.nettype = nettype
+
+        model = model_registry.get_model(self.params, multistep=False).to(self.device)
+        model.eval()
+
+        inp = torch.randn(self.params.batch_size, self.params.N_in_channels, self.params.img_shape_x, self.params.img_shape_y, dtype=torch.float32, device=self.device)
+        with torch.no_grad():
+            out_ref = model(inp)
+
+        # the eager backend only exercises the tracing, which keeps the test fast
+        num_regions = compile_regions(model, backend="eager")
+        self.assertEqual(num_regions, len(model.model.blocks))
+
+        with torch.no_grad():
+            out = model(inp)
+            out_half = model(inp[: self.params.batch_size // 2])
+
+        self.assertTrue(compare_tensors("output", out, out_ref, atol, rtol, verbose))
+        self.assertTrue(compare_tensors("output half batch", out_half, out_ref[: self.params.batch_size // 2], atol, rtol, verbose))
+
+    def test_history_buffer(self):
+        """
+        Tests that the circular history buffer produces the same windows as shifting the history with torch.cat
+        """
+        from makani.models.preprocessor_helpers import HistoryBuffer
+
+        n_history = 3
+        num_frames = n_history + 1
+        channels = 5
+        shape = (self.params.batch_size, num_frames * channels, self.params.img_shape_x, self.params.img_shape_y)
+
+        x = torch.randn(shape, dtype=torch.float32, device=self.device)
+        hbuff = HistoryBuffer(x, num_frames)
+        hbuff.reset(x)
+
+        ref = x.clone()
+        for step in range(2 * num_frames + 1):
+            frame = torch.randn((shape[0], channels, shape[2], shape[3]), dtype=torch.float32, device=self.device)
+            ref = torch.cat([ref[:, channels:], frame], dim=1)
+
+            hbuff.append(frame)
+            window = hbuff.window()
+
+            self.assertTrue(hbuff.is_window(window))
+            self.assertEqual(window.data_ptr(), hbuff.buffer[:, hbuff.start].data_ptr())
+            self.assertTrue(compare_tensors(f"history window step {step}", window, ref, atol=0.0, rtol=0.0))
+
+    def test_append_history_inference_mode(self):
+        """
+        Tests the buffered history update of the preprocessor in inference mode, followed by a rollout outside of inference mode
+        """
+        from makani.models.preprocessor import Preprocessor2D
+
+        self.params.n_history = 2
+        num_frames = self.params.n_history + 1
+        channels = self.params.N_in_channels
+        preprocessor = Preprocessor2D(self.params).to(self.device)
+        preprocessor.eval()
+
+        shape = (self.params.batch_size, num_frames * channels, self.params.img_shape_x, self.params.img_shape_y)
+        x = torch.randn(shape, dtype=torch.float32, device=self.device)
+
+        for mode, context in [("inference mode", torch.inference_mode), ("no grad", torch.no_grad)]:
+            inp = x.clone()
+            ref = x.clone()
+            for step in range(2 * num_frames + 1):
+                frame = torch.randn((shape[0], channels, shape[2], shape[3]), dtype=torch.float32, device=self.device)
+                ref = torch.cat([ref[:, channels:], frame], dim=1)
+
+                with context():
+                    inp = preprocessor.append_history(inp, frame, step)
+
+                self.assertTrue(compare_tensors(f"{mode} history step {step}", inp, ref, atol=0.0, rtol=0.0))
 
 
 if __name__ == "__main__":
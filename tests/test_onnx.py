@@ -0,0 +1,139 @@
+# SPDX-FileCopyrightText: Copyright (c) 2025 NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import importlib.util
+import unittest
+from parameterized import parameterized
+
+import torch
+import torch.nn as nn
+
+from .testutils import compare_tensors
+
+_have_onnxruntime = (importlib.util.find_spec("onnxruntime") is not None) and (importlib.util.find_spec("onnx") is not None)
+
+
+class _TinyPangu(nn.Module):
+    """tiny stand-in for the Pangu ONNX model with the same input and output names"""
+
+    def forward(self, atmospheric, surface):
+        return atmospheric + 1.0, 2.0 * surface
+
+
+@unittest.skipUnless(_have_onnxruntime, "onnxruntime is not installed")
+class TestOnnx(unittest.TestCase):
+
+    def setUp(self):
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        torch.manual_seed(333)
+
+        # interleaved surface and atmospheric channels to test the reordering
+        self.channel_names = ["u10m", "z500", "t500", "v10m", "z850", "t850", "t2m"]
+        self.n_atmo_chans, self.n_atmo_groups, self.n_surf = 2, 2, 3
+        self.lat, self.lon = 8, 16
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.onnx_file = os.path.join(self.tmpdir.name, "pangu.onnx")
+
+        atmospheric = torch.randn(self.n_atmo_chans, self.n_atmo_groups, self.lat, self.lon)
+        surface = torch.randn(self.n_surf, self.lat, self.lon)
+        torch.onnx.export(_TinyPangu(), (atmospheric, surface), self.onnx_file, input_names=["input", "input_surface"], output_names=["output", "output_surface"])
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _get_model(self, **kwargs):
+        from makani.models.networks.pangu_onnx import PanguOnnx
+
+        return PanguOnnx(channel_names=self.channel_names, onnx_file=self.onnx_file, **kwargs).to(self.device)
+
+    @parameterized.expand([(False,), (True,)], skip_on_empty=True)
+    def test_io_binding(self, reuse_outputs, verbose=True):
+        """
+        Tests that the IO binding path produces the same outputs as the numpy path and that the channel ordering is consistent with prepare_input and prepare_output
+        """
+        model_ref = self._get_model(onnx_io_binding=False)
+        model = self._get_model(onnx_io_binding=True, onnx_reuse_outputs=reuse_outputs)
+
+        inp = torch.randn(1, len(self.channel_names), self.lat, self.lon, dtype=torch.float32, device=self.device)
+
+        # reference from the reordering helpers
+        surface, atmospheric = model_ref.prepare_input(inp)
+        out_expected = model_ref.prepare_output(2.0 * surface, atmospheric + 1.0)
+
+        with torch.no_grad():
+            out_ref = model_ref(inp)
+            out = model(inp)
+
+        self.assertTrue(compare_tensors("numpy path", out_ref, out_expected, atol=1e-6, rtol=1e-6, verbose=verbose))
+        self.assertTrue(compare_tensors("io binding", out, out_ref, atol=0.0, rtol=0.0, verbose=verbose))
+
+    def test_reuse_outputs(self, verbose=True):
+        """
+        Tests that consecutive calls with reused output buffers do not alias, so that rollouts can feed the output back
+        """
+        model = self._get_model(onnx_io_binding=True, onnx_reuse_outputs=True)
+
+        inp1 = torch.randn(1, len(self.channel_names), self.lat, self.lon, dtype=torch.float32, device=self.device)
+        inp2 = torch.randn(1, len(self.channel_names), self.lat, self.lon, dtype=torch.float32, device=self.device)
+
+        with torch.no_grad():
+            out1 = model(inp1)
+            out1_ref = out1.clone()
+            out2 = model(inp2)
+
+        self.assertNotEqual(out1.data_ptr(), out2.data_ptr())
+        self.assertTrue(compare_tensors("first output", out1, out1_ref, atol=0.0, rtol=0.0, verbose=verbose))
+
+        # the output of the second call can be fed back as input of the third
+        with torch.no_grad():
+            out3 = model(out2)
+        self.assertNotEqual(out3.data_ptr(), out2.data_ptr())
+
+    def test_session_pool(self, verbose=True):
+        """
+        Tests that the sessions of the pool produce identical results and that the generic session interface matches
+        """
+        model = self._get_model(onnx_io_binding=True, onnx_num_sessions=2)
+
+        atmospheric = torch.randn(self.n_atmo_chans, self.n_atmo_groups, self.lat, self.lon, dtype=torch.float32, device=self.device)
+        surface = torch.randn(self.n_surf, self.lat, self.lon, dtype=torch.float32, device=self.device)
+
+        with model.acquire_session(self.device) as session1, model.acquire_session(self.device) as session2:
+            self.assertFalse(session1 is session2)
+            out1 = model.onnx_session_run({"input": atmospheric, "input_surface": surface}, session=session1)
+            out2 = model.onnx_session_run({"input": atmospheric, "input_surface": surface}, session=session2)
+
+        for res1, res2, ref in zip(out1, out2, [atmospheric + 1.0, 2.0 * surface]):
+            self.assertTrue(compare_tensors("session 1", res1, ref, atol=1e-6, rtol=1e-6, verbose=verbose))
+            self.assertTrue(compare_tensors("session 2", res2, ref, atol=1e-6, rtol=1e-6, verbose=verbose))
+
+    def test_binding_device(self):
+        """
+        Tests that CUDA tensors are only bound to sessions which run on the CUDA provider
+        """
+        from makani.models.onnx_wrapper import OnnxWrapper
+
+        model = self._get_model()
+        session = model.cpu_session
+
+        self.assertTrue(OnnxWrapper._can_bind(session, torch.device("cpu")))
+        self.assertEqual(OnnxWrapper._can_bind(session, torch.device("cuda")), "CUDAExecutionProvider" in session.get_providers())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -23,7 +23,8 @@ import torch
 import h5py as h5
 from typing import Optional
 
-from makani.utils.inference.rollout_buffer import TemporalAverageBuffer
+from makani.utils.inference.rollout_buffer import TemporalAverageBuffer, SpectrumAverageBuffer
+from makani.utils.inference.transform_cache import SpectralTransformCache
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from .testutils import init_dataset, get_default_parameters, compare_arrays, H5_PATH, IMG_SIZE_H, IMG_SIZE_W
@@ -261,6 +262,132 @@ class TestRolloutBuffers(unittest.TestCase):
         with self.subTest(desc="std"):
             self.assertTrue(compare_arrays("std", buffer_std, manual_std, atol=0.0, rtol=1e-5))
 
+    @parameterized.expand(
+        [
+            (1, 1), (2, 1), (4, 2),
+        ],
+        skip_on_empty=True,
+    )
+    def test_fused_welford_update(self, batch_size, num_rollout_steps):
+        """
+        Test that the fused Welford update agrees with the unfused statistics and combine passes,
+        also for data with a large offset relative to its variance
+        """
+        buffers = []
+        for fused_update in [False, True]:
+            buffers.append(
+                TemporalAverageBuffer(
+                    num_rollout_steps=num_rollout_steps,
+                    rollout_dt=self.rollout_dt,
+                    img_shape=self.img_shape,
+                    local_shape=self.local_shape,
+                    local_offset=self.local_offset,
+                    channel_names=self.channel_names,
+                    lat_lon=self.lat_lon,
+                    device=self.device,
+                    output_channels=self.output_channels,
+                    scale=2.0 * torch.ones((self.num_channels,), dtype=torch.float32),
+                    bias=100.0 * torch.ones((self.num_channels,), dtype=torch.float32),
+                    fused_update=fused_update,
+                )
+            )
+
+        for idt in range(4 * num_rollout_steps):
+            data = torch.randn((batch_size, self.num_channels, *self.img_shape), dtype=torch.float32, device=self.device)
+            for buffer in buffers:
+                buffer.update(data, idt % num_rollout_steps)
+
+        ref, fused = buffers
+        with self.subTest(desc="counts"):
+            self.assertTrue(torch.equal(ref.num_samples_tracked, fused.num_samples_tracked))
+        with self.subTest(desc="mean"):
+            self.assertTrue(compare_arrays("mean", fused.running_mean.cpu().numpy(), ref.running_mean.cpu().numpy(), atol=1e-4, rtol=1e-5))
+        with self.subTest(desc="m2"):
+            self.assertTrue(compare_arrays("m2", fused.running_var.cpu().numpy(), ref.running_var.cpu().numpy(), atol=1e-3, rtol=1e-4))
+
+    @parameterized.expand(
+        [
+            (2, 1), (2, 2), (4, 2),
+        ],
+        skip_on_empty=True,
+    )
+    def test_spectrum_buffer_transform_cache(self, num_rollout_steps, lead_time_stride):
+        """
+        Test that SpectrumAverageBuffer produces the same spectra with and without a shared transform cache
+        and that only strided lead times are recorded
+        """
+        batch_size = 2
+        ensemble_size = 2
+
+        scale = 0.5 + torch.rand((self.num_channels,), dtype=torch.float32)
+        bias = torch.randn((self.num_channels,), dtype=torch.float32)
+
+        # reference buffer without cache and two buffers sharing a cache
+        transform_cache = SpectralTransformCache()
+        output_files = [os.path.join(self.tmpdir.name, f"spectrum_output_{i}.h5") for i in range(3)]
+        buffers = []
+        for i, output_file in enumerate(output_files):
+            buffers.append(
+                SpectrumAverageBuffer(
+                    num_rollout_steps=num_rollout_steps,
+                    rollout_dt=self.rollout_dt,
+                    img_shape=self.img_shape,
+                    ensemble_size=ensemble_size,
+                    grid_type="equiangular",
+                    channel_names=self.channel_names,
+                    device=self.device,
+                    scale=scale,
+                    bias=bias,
+                    output_channels=self.output_channels,
+                    output_file=output_file,
+                    lead_time_stride=lead_time_stride,
+                    transform_cache=(transform_cache if i > 0 else None),
+                )
+            )
+
+        # Load test data from the dummy dataset
+        test_file = os.path.join(self.valid_path, "2019.h5")
+        with h5.File(test_file, "r") as hf:
+            data = hf[H5_PATH][:]
+        data_tensor = torch.from_numpy(data).to(self.device)
+
+        num_rollouts = data_tensor.shape[0] // batch_size // num_rollout_steps
+        for ir in range(num_rollouts):
+            for idt in range(num_rollout_steps):
+                offset = (ir * num_rollout_steps + idt) * batch_size
+                targ = data_tensor[offset : offset + batch_size, ...]
+                pred = targ.unsqueeze(1) + 0.1 * torch.randn((batch_size, ensemble_size, *targ.shape[1:]), dtype=targ.dtype, device=self.device)
+
+                for buffer in buffers:
+                    buffer.update(pred, targ.unsqueeze(1), idt)
+
+                # both cached buffers share the transforms of prediction and target
+                with self.subTest(desc="cache hits"):
+                    self.assertEqual(transform_cache.hits, 2 * len(transform_cache))
+
+                transform_cache.reset()
+                transform_cache.hits = 0
+
+        for buffer in buffers:
+            buffer.finalize()
+
+        results = []
+        for output_file in output_files:
+            with h5.File(output_file, "r") as hf:
+                results.append((hf["mean"][:], hf["std"][:], hf["lead_time"][:]))
+
+        num_strided_steps = num_rollout_steps // lead_time_stride
+        expected_lead_times = np.arange(1, num_strided_steps + 1, dtype=np.float64) * self.rollout_dt * lead_time_stride
+        for i, (mean, std, lead_time) in enumerate(results):
+            with self.subTest(desc=f"lead times {i}"):
+                self.assertEqual(mean.shape[0], num_strided_steps)
+                self.assertTrue(compare_arrays("lead times", lead_time, expected_lead_times, atol=0.0, rtol=1e-6))
+            if i > 0:
+                with self.subTest(desc=f"mean {i}"):
+                    self.assertTrue(compare_arrays("mean", mean, results[0][0], atol=1e-6, rtol=1e-4))
+                with self.subTest(desc=f"std {i}"):
+                    self.assertTrue(compare_arrays("std", std, results[0][1], atol=1e-6, rtol=1e-4))
+
 
 if __name__ == "__main__":
     unittest.main() 
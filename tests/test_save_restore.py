@@ -27,7 +27,8 @@ from torch import nn
 
 from makani.models.common import MLP
 from makani.utils.driver import Driver
-from makani.utils.checkpoint_helpers import get_latest_checkpoint_version
+from makani.utils.checkpoint_helpers import get_latest_checkpoint_version, reshard_model_state_dict, AsyncCheckpointWriter
+from makani.utils.checkpoint_helpers import _compute_block_layout, save_indexed_checkpoint, load_indexed_checkpoint
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from .testutils import get_default_parameters, compare_arrays
@@ -79,8 +80,8 @@ class TestSaveRestore(unittest.TestCase):
         self.assertTrue(version == 0)
 
 
-    @parameterized.expand(["legacy", "flexible"])
-    def test_save_restore(self, checkpoint_mode):
+    @parameterized.expand([("legacy", False), ("flexible", False), ("sharded", False), ("indexed", False), ("legacy", True), ("flexible", True), ("sharded", True)])
+    def test_save_restore(self, checkpoint_mode, async_checkpoint):
         """
         Tests initialization of all the models and the forward and backward pass
         """
@@ -108,10 +109,12 @@ class TestSaveRestore(unittest.TestCase):
             checkpoint_path = os.path.join(tempdir, "ckpt.tar")
 
             # store checkpoint
+            checkpoint_writer = AsyncCheckpointWriter() if async_checkpoint else None
             Driver.save_checkpoint(
                 checkpoint_path,
                 model=model,
-                checkpoint_mode=checkpoint_mode
+                checkpoint_mode=checkpoint_mode,
+                checkpoint_writer=checkpoint_writer,
             )
 
             # scramble model
@@ -119,6 +122,10 @@ class TestSaveRestore(unittest.TestCase):
                 for p in model.parameters():
                     p.zero_()
 
+            # make sure the checkpoint is on disk
+            if checkpoint_writer is not None:
+                checkpoint_writer.wait()
+
             # reload checkpoint
             Driver.restore_from_checkpoint(
                 checkpoint_path,
@@ -136,6 +143,95 @@ class TestSaveRestore(unittest.TestCase):
         # compare
         self.assertTrue(compare_arrays("output", out_before, out_after, rtol=1e-6, atol=1e-6))
 
+    def test_reshard_model_state_dict(self):
+        """
+        Tests reassembly of a checkpoint stored in a 2x2 model parallel layout into a single shard
+        """
+
+        weight = torch.randn(6, 8)
+        bias = torch.randn(6)
+
+        # comm grids of four shards, where weight is split along h and w and bias only along h
+        comm_grids = [{"h": {"size": 2, "rank": rh}, "w": {"size": 2, "rank": rw}} for rh in range(2) for rw in range(2)]
+        sharded_dims_mp = {"weight": ["h", "w"], "bias": ["h"]}
+
+        shards = []
+        for grid in comm_grids:
+            rh = grid["h"]["rank"]
+            rw = grid["w"]["rank"]
+            shards.append({"weight": weight[3 * rh : 3 * (rh + 1), 4 * rw : 4 * (rw + 1)], "bias": bias[3 * rh : 3 * (rh + 1)], "scale": torch.ones(1)})
+
+        state_dict = reshard_model_state_dict(shards, comm_grids, sharded_dims_mp, {})
+
+        with self.subTest(desc="weight"):
+            self.assertTrue(compare_arrays("weight", state_dict["weight"].numpy(), weight.numpy()))
+        with self.subTest(desc="bias"):
+            self.assertTrue(compare_arrays("bias", state_dict["bias"].numpy(), bias.numpy()))
+        with self.subTest(desc="scale"):
+            self.assertTrue(compare_arrays("scale", state_dict["scale"].numpy(), np.ones(1)))
+
+        # entries which are not sharded have to agree across the shards
+        shards[1]["scale"] = 2.0 * torch.ones(1)
+        with self.assertRaises(ValueError):
+            reshard_model_state_dict(shards, comm_grids, sharded_dims_mp, {})
+
+    def test_async_checkpoint_staging_buffers(self):
+        """
+        Tests that the staging buffers of the asynchronous checkpoint writer are reused by subsequent saves
+        """
+
+        store_dict = {"model_state": {"weight": torch.randn(6, 8), "step": torch.ones(1, dtype=torch.int64)}}
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            checkpoint_writer = AsyncCheckpointWriter(max_pending=1)
+
+            checkpoint_writer.save(store_dict, os.path.join(tempdir, "ckpt1.tar"))
+            checkpoint_writer.wait()
+            buffers = {key: [b.data_ptr() for b in value] for key, value in checkpoint_writer._staging_buffers.items()}
+            self.assertEqual(len(buffers), 2)
+
+            checkpoint_writer.save(store_dict, os.path.join(tempdir, "ckpt2.tar"))
+            checkpoint_writer.wait()
+            self.assertEqual({key: [b.data_ptr() for b in value] for key, value in checkpoint_writer._staging_buffers.items()}, buffers)
+
+            restored = torch.load(os.path.join(tempdir, "ckpt2.tar"), weights_only=True)
+
+        self.assertTrue(compare_arrays("weight", restored["model_state"]["weight"].numpy(), store_dict["model_state"]["weight"].numpy()))
+
+    def test_indexed_block_layout(self):
+        """
+        Tests the computation of global shape, block offsets and writers for a tensor stored in a 2x2 model parallel layout
+        """
+
+        comm_grids = [{"h": {"size": 2, "rank": rh}, "w": {"size": 2, "rank": rw}} for rh in range(2) for rw in range(2)]
+        local_shapes = [[3 if rh == 0 else 2, 4] for rh in range(2) for rw in range(2)]
+
+        # only split along h, so the blocks are replicated along w
+        global_shape, offsets, writers = _compute_block_layout(local_shapes, comm_grids, ["h", None])
+
+        self.assertEqual(global_shape, [5, 4])
+        self.assertEqual(offsets, [[0, 0], [0, 0], [3, 0], [3, 0]])
+        self.assertEqual(writers, [True, False, True, False])
+
+    def test_indexed_partial_load(self):
+        """
+        Tests that loading an indexed checkpoint with a prefix only returns the requested tensors
+        """
+
+        tensors = {"model_state.weight": torch.randn(6, 8), "model_state.scale": torch.randn(1).to(torch.bfloat16), "optimizer_state.0.exp_avg": torch.randn(6, 8)}
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            checkpoint_fname = os.path.join(tempdir, "ckpt.tar")
+            save_indexed_checkpoint(checkpoint_fname, tensors, {}, {"iters": 10})
+            header, loaded = load_indexed_checkpoint(checkpoint_fname, prefixes=["model_state."])
+
+        self.assertEqual(header["iters"], 10)
+        self.assertEqual(list(loaded.keys()), ["model_state.weight", "model_state.scale"])
+        with self.subTest(desc="weight"):
+            self.assertTrue(compare_arrays("weight", loaded["model_state.weight"].numpy(), tensors["model_state.weight"].numpy()))
+        with self.subTest(desc="scale"):
+            self.assertTrue(compare_arrays("scale", loaded["model_state.scale"].float().numpy(), tensors["model_state.scale"].float().numpy()))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -241,6 +241,42 @@ class TestTrainer(unittest.TestCase):
             with self.subTest(desc="train output vs reference roundtrip 2"):
                 self.assertTrue(compare_tensors("train output vs reference roundtrip 2", out, out_ref))
 
+    def test_ensemble_streaming(self):
+        """
+        Tests that the member-streaming ensemble step produces the same loss and gradients as the regular ensemble step
+        """
+
+        device = torch.device("cpu")
+        trainer = EnsembleTrainer(self.params, 0, device=device)
+        trainer._set_train()
+
+        # get a batch
+        data = next(iter(trainer.train_dataloader))
+        inp, tar = trainer.preprocessor.cache_unpredicted_features(*map(lambda x: x.to(device), data))
+        inp = trainer.preprocessor.flatten_history(inp)
+        tar = trainer.preprocessor.flatten_history(tar)
+
+        # regular ensemble step
+        rng_state = trainer._get_rng_state()
+        trainer.model_train.zero_grad(set_to_none=True)
+        _, loss_ref = trainer._ensemble_step(inp, tar)
+        loss_ref.backward()
+        grads_ref = [p.grad.clone() for p in trainer.model_train.parameters() if p.grad is not None]
+
+        # streaming ensemble step starting from the same random state
+        trainer._set_rng_state(rng_state)
+        trainer.model_train.zero_grad(set_to_none=True)
+        _, loss = trainer._ensemble_step_streaming(inp, tar, 1.0, True)
+        grads = [p.grad.clone() for p in trainer.model_train.parameters() if p.grad is not None]
+
+        with self.subTest(desc="loss"):
+            self.assertTrue(compare_tensors("loss", loss, loss_ref.detach()))
+
+        self.assertEqual(len(grads), len(grads_ref))
+        for idx, (grad, grad_ref) in enumerate(zip(grads, grads_ref)):
+            with self.subTest(desc=f"gradient {idx}"):
+                self.assertTrue(compare_tensors(f"gradient {idx}", grad, grad_ref, atol=1e-5, rtol=1e-5))
+
 
 if __name__ == "__main__":
     unittest.main()